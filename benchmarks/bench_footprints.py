@@ -0,0 +1,81 @@
+"""Benchmarks ReportStore footprint lookups (reports_covering and
+reports_overlapping) over an archive of synthetic report footprints.
+
+Run from the repository root:
+
+    python benchmarks/bench_footprints.py [reports] [repeats]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pmst  # noqa: E402
+
+
+class ArchivedReport():
+    """Stands in for a Report with a footprint and no protected matters.
+    """
+    def __init__(self, file, coords, buffer):
+        self.file = file
+        self.date = None
+        self.email = None
+        self.buffer = buffer
+        self.coords = pmst.CoordArray(coords)
+        self.url_buckets = {kind: {} for kind in pmst.UrlRouter.KINDS}
+
+    def is_fetched(self, kind):
+        return False
+
+
+def archive(count, seed=1):
+    """Yields count reports with 50-vertex polygon footprints of up to
+    about 50 km across, scattered over south-west and eastern Australia.
+    """
+    rng = random.Random(seed)
+    for number in range(count):
+        lat, long = rng.uniform(-40, -12), rng.uniform(114, 153)
+        radius = rng.uniform(0.02, 0.25)
+        ring = [
+            [lat + radius * pmst.np.sin(angle),
+             long + radius * pmst.np.cos(angle)]
+            for angle in pmst.np.linspace(0, 2 * pmst.np.pi, 50)[:-1]
+            ]
+        yield ArchivedReport(
+            f"report_{number}.html", ring + ring[:1], rng.choice([0, 1, 5]))
+
+
+def main(count=5000, repeats=20):
+    directory = tempfile.mkdtemp()
+    store = pmst.ReportStore(os.path.join(directory, "reports.sqlite"))
+    ingest_time = timeit.timeit(
+        lambda: store.add_many(archive(count)), number=1)
+
+    # Inside the first archived footprint, so it has a report covering it
+    centre = next(archive(1)).coords.array[:-1].mean(axis=0)
+    point = pmst.Query(geom_type=1, coord_type=1)
+    point.set_coord_list(centre)
+    line = pmst.Query(geom_type=2, coord_type=1)
+    line.set_coord_list([centre, centre + [0.01, 0.01]])
+    polygon = pmst.Query(geom_type=3, coord_type=1)
+    polygon.set_coord_list(
+        [[-32.0, 115.0], [-32.0, 117.0], [-31.0, 116.0], [-32.0, 115.0]])
+
+    print(f"reports:   {count}, ingested in {ingest_time:.2f} s")
+    for name, query in (("point", point), ("line", line),
+                        ("polygon", polygon)):
+        for method in (store.reports_covering, store.reports_overlapping):
+            found = len(method(query))
+            seconds = min(timeit.repeat(
+                lambda: method(query), number=1, repeat=repeats))
+            print(f"{name:<8} {method.__name__:<20} {seconds * 1000:8.2f} ms"
+                  f" ({found} reports)")
+    store.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
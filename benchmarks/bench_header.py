@@ -0,0 +1,87 @@
+"""Benchmarks single-pass header extraction in Report against the previous
+approach of one tree walk per field.
+
+Run from the repository root:
+
+    python benchmarks/bench_header.py [report.html] [repeats]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pmst  # noqa: E402
+
+DEFAULT_REPORT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PMST.html"
+    )
+
+
+def per_field_header(soup):
+    """The header extraction Report used before the single pass: a
+    find() per field with a regex compiled on every call, then a find_all()
+    over the a tags with list membership checks.
+    """
+    buffer_string = soup.find(
+        "span", string=re.compile(r'(Buffer:)')
+        ).text
+    buffer = float(re.search(r"[-+]?\d*\.\d+|\d+", buffer_string).group())
+
+    coord_string = soup.find(
+        "span", string=re.compile(r"[-+]?\d*\.\d+ [-+]?\d*\.\d+")
+        ).text
+    coord_list = re.findall(r'[-+]?\d+.\d+', coord_string)
+
+    date_string = soup.find(
+        "span", string=re.compile(r'(Report created:)')
+        ).text
+    date = re.search(r"\d{1,2}/\d{1,2}/\d{2}", date_string).group()
+
+    url_list = []
+    for url in soup.find_all("a"):
+        if url.get("href") is None:
+            pass
+        elif url.get("href") in url_list:
+            pass
+        else:
+            url_list.append(url.get("href"))
+    url_list.sort()
+
+    return buffer, coord_list, date, url_list
+
+
+def single_pass_header(soup):
+    """The header extraction Report uses now.
+    """
+    report = pmst.Report.__new__(pmst.Report)
+    report.tables = False
+    report._soup = soup
+    report._get_header()
+    return report
+
+
+def main(file=DEFAULT_REPORT, repeats=20):
+    with open(file) as html:
+        soup = pmst.bs4.BeautifulSoup(html, "lxml")
+
+    old = per_field_header(soup)
+    new = single_pass_header(soup)
+    assert old[0] == new.buffer, "Buffers differ"
+    assert old[3] == new.url_list, "URL lists differ"
+
+    old_time = min(timeit.repeat(
+        lambda: per_field_header(soup), number=1, repeat=repeats))
+    new_time = min(timeit.repeat(
+        lambda: single_pass_header(soup), number=1, repeat=repeats))
+
+    print(f"report:      {file}")
+    print(f"per field:   {old_time * 1000:8.2f} ms")
+    print(f"single pass: {new_time * 1000:8.2f} ms")
+    print(f"speed up:    {old_time / new_time:8.2f}x")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
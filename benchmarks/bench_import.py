@@ -0,0 +1,118 @@
+"""Benchmarks the time taken to import pmst, and to validate a Query, in a
+new interpreter, as a short-lived worker or CLI invocation would.
+
+Each run starts python with -X importtime and reads the cumulative import
+time of pmst (in microseconds) from its output, along with the modules that
+took longest to import inside pmst. With --max-ms the script exits with
+status 1 if the median import of pmst takes longer, so it can guard against
+a slow dependency being imported at module level again.
+
+Run from the repository root:
+
+    python benchmarks/bench_import.py [-n repeats] [--max-ms 100]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = (
+    ("import pmst", "import pmst"),
+    ("Query validation", "import pmst\n"
+     "query = pmst.Query(geom_type=1, coord_type=1)\n"
+     "query.set_coord_list([-31.8, 116.0])"),
+)
+
+
+def import_times(code):
+    """Runs code in a new interpreter with -X importtime. Returns the wall
+    time of the run (seconds), the cumulative import time of pmst and the
+    cumulative import time of each module imported directly by pmst or by
+    code (microseconds). Modules imported with importlib (as pmst's lazy
+    dependencies are) aren't listed by -X importtime, only what they import.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True, cwd=ROOT,
+        )
+    wall = time.perf_counter() - start
+
+    modules = {}
+    pmst_time = None
+    # Nested imports are listed before the module that imported them, so
+    # everything after site finishes is imported by pmst or code
+    after_site = False
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        name = name.rstrip()
+        depth = len(name) - len(name.lstrip())
+        if after_site and depth <= 3:
+            modules[name.strip()] = int(cumulative)
+        if name.strip() == "pmst":
+            pmst_time = int(cumulative)
+        elif name == " site":
+            after_site = True
+    return wall, pmst_time, modules
+
+
+def run(repeats=10):
+    """Returns the median wall time, median pmst import time and the
+    slowest imports of the last run for each case.
+    """
+    results = {}
+    for name, code in CASES:
+        walls, pmst_times = [], []
+        for _ in range(repeats):
+            wall, pmst_time, modules = import_times(code)
+            walls.append(wall)
+            pmst_times.append(pmst_time)
+        slowest = sorted(
+            ((time_, module) for module, time_ in modules.items()
+             if module != "pmst"),
+            reverse=True,
+            )[:5]
+        results[name] = {
+            "wall": statistics.median(walls),
+            "pmst": statistics.median(pmst_times),
+            "slowest": slowest,
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--repeats", type=int, default=10,
+                        help="interpreters started per case (default: 10)")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="fail if importing pmst takes longer than this")
+    args = parser.parse_args(argv)
+
+    results = run(repeats=args.repeats)
+    print("{0:<20} {1:>10} {2:>14}".format(
+        "case", "wall ms", "pmst import ms"))
+    for name, result in results.items():
+        print("{0:<20} {1:>10.1f} {2:>14.1f}".format(
+            name, result["wall"] * 1000, result["pmst"] / 1000))
+        for time_, module in result["slowest"]:
+            print("    {0:<30} {1:>8.1f} ms".format(module, time_ / 1000))
+
+    import_ms = results["import pmst"]["pmst"] / 1000
+    if args.max_ms is not None and import_ms > args.max_ms:
+        print("import pmst took {0:.1f} ms, more than {1} ms".format(
+            import_ms, args.max_ms))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
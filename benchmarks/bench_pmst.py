@@ -0,0 +1,267 @@
+"""Benchmark suite for the parsing hot paths in pmst.py.
+
+Times and memory-profiles Report construction on PMST.html and the
+construction of a protected matter for every page in tests/html. Protected
+matter pages are fetched from a local HTTP server serving tests/html rather
+than the live site, so results only depend on this machine. With --replay
+they are read straight from disk by a ReplayTransport instead, leaving out
+the HTTP overhead.
+
+Run from the repository root:
+
+    python benchmarks/bench_pmst.py                   # run and print
+    python benchmarks/bench_pmst.py --save baseline   # also save results
+    python benchmarks/bench_pmst.py --compare baseline
+
+Saved results go to benchmarks/results/<name>.json.
+"""
+
+import argparse
+import contextlib
+import datetime
+import functools
+import http.server
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pmst  # noqa: E402
+
+PMST_HTML = os.path.join(ROOT, "PMST.html")
+PMST_PDF = os.path.join(ROOT, "PMST.pdf")
+HTML_DIR = os.path.join(ROOT, "tests", "html")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Protected matter class for each page in tests/html, by file name prefix
+MATTER_CLASSES = (
+    ("biota_", pmst.Biota),
+    ("tec_", pmst.Tec),
+    ("KEF", pmst.Kef),
+)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files with keep-alive connections and without logging every
+    request.
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, Nagle's
+    # algorithm and delayed ACKs add ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def local_site(directory=HTML_DIR):
+    """Serves directory over HTTP on a free localhost port while the context
+    is open, yielding the base URL. Stands in for the SPRAT site.
+    """
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{0}".format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def matter_cases(base_url, fetcher):
+    """Yields (name, function) for each page in tests/html with a matching
+    protected matter class, once for each parser. Query strings are added so
+    Biota can read a sprat_id from the URL; the local server ignores them.
+    """
+    for file_name in sorted(os.listdir(HTML_DIR)):
+        for prefix, matter_class in MATTER_CLASSES:
+            if not file_name.startswith(prefix):
+                continue
+            url = "{0}/{1}?taxon_id=1".format(base_url, file_name)
+            for parser in pmst.ProtectedMatter.PARSERS:
+                name = "{0}({1})".format(matter_class.__name__, file_name)
+                if parser != pmst.ProtectedMatter.parser:
+                    name = "{0}({1}, {2})".format(
+                        matter_class.__name__, file_name, parser)
+                yield (
+                    name,
+                    functools.partial(
+                        matter_class, url=url, fetcher=fetcher,
+                        parser=parser),
+                    )
+
+
+def report_cases():
+    """Yields (name, function) for building a Report from PMST.html,
+    without fetching protected matters, with only its header tags parsed,
+    with the biota and TEC lists
+    read from its tables, and from a snapshot (saved by the warm up call),
+    and from PMST.pdf with its pages read in this process and across four
+    processes, and with its species and communities resolved from a
+    SpratIndex. Peak memory of the PDF cases only counts this process.
+    """
+    yield ("Report(PMST.html)",
+           functools.partial(pmst.Report, PMST_HTML, fetch=()))
+    yield ("Report(PMST.html, strainer)",
+           functools.partial(
+               pmst.Report, PMST_HTML, fetch=(), parser="strainer"))
+    yield ("Report(PMST.html, streaming)",
+           functools.partial(
+               pmst.Report, PMST_HTML, fetch=(), streaming=True))
+    yield ("Report(PMST.html, tables)",
+           functools.partial(pmst.Report, PMST_HTML, tables=True))
+    yield ("Report(PMST.html, streaming, tables)",
+           functools.partial(
+               pmst.Report, PMST_HTML, streaming=True, tables=True))
+    yield ("Report(PMST.pdf)", functools.partial(pmst.Report, PMST_PDF))
+    snapshots = pmst.SnapshotCache(
+        path=os.path.join(tempfile.mkdtemp(), "snapshots.sqlite"))
+    yield ("Report(PMST.html, snapshot)",
+           functools.partial(pmst.Report, PMST_HTML, snapshots=snapshots))
+    yield ("Report(PMST.html, streaming, index)",
+           functools.partial(
+               pmst.Report, PMST_HTML, streaming=True, index=table_index(),
+               fetch=("biota", "tec")))
+
+
+def table_index():
+    """Returns a SpratIndex of the species and communities listed in the
+    tables of PMST.html, standing in for one built from SPRAT.
+    """
+    report = pmst.Report(PMST_HTML, tables=True)
+    router = pmst.UrlRouter()
+    path = os.path.join(tempfile.mkdtemp(), "sprat.idx")
+    pmst.SpratIndex.write(path, (
+        pmst.IndexEntry(kind, router.route(record.url)[1], time.time(),
+                        record._replace(presence=None))
+        for kind in pmst.SpratIndex.KINDS
+        for record in getattr(report, kind + "_list")
+        ))
+    return pmst.SpratIndex(path)
+
+
+def measure(function, repeats):
+    """Returns timings (seconds) and the peak memory allocated by Python
+    (bytes) for function. Memory is measured on a separate call so tracing
+    doesn't slow the timed calls.
+    """
+    function()  # warm up connections and caches
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "peak_memory": peak,
+        "repeats": repeats,
+    }
+
+
+@contextlib.contextmanager
+def replay_site(directory=HTML_DIR):
+    """Yields a base URL whose pages a ReplayTransport of directory serves.
+    Used in place of local_site() to read pages straight from disk.
+    """
+    yield "http://fixtures"
+
+
+def run(repeats=5, select=None, replay=False):
+    """Runs every benchmark case whose name contains select and returns the
+    results keyed by case name.
+    """
+    results = {}
+    site = replay_site() if replay else local_site()
+    with site as base_url, \
+            contextlib.redirect_stdout(open(os.devnull, "w")):
+        if replay:
+            fetcher = pmst.Fetcher(transport=pmst.ReplayTransport(HTML_DIR))
+        else:
+            fetcher = pmst.Fetcher()
+        cases = list(report_cases()) + list(matter_cases(base_url, fetcher))
+        for name, function in cases:
+            if select and select not in name:
+                continue
+            results[name] = measure(function, repeats)
+        fetcher.close()
+    return results
+
+
+def save(results, name):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, name + ".json")
+    with open(path, "w") as file:
+        json.dump({
+            "created": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "results": results,
+        }, file, indent=2)
+    return path
+
+
+def load(name):
+    with open(os.path.join(RESULTS_DIR, name + ".json")) as file:
+        return json.load(file)["results"]
+
+
+def print_results(results, baseline=None):
+    print("{0:<44} {1:>10} {2:>10} {3:>10} {4:>8}".format(
+        "case", "min ms", "median ms", "peak KiB", "vs base"))
+    for name, result in results.items():
+        change = ""
+        if baseline and name in baseline:
+            change = "{0:.2f}x".format(
+                result["median"] / baseline[name]["median"])
+        print("{0:<44} {1:>10.2f} {2:>10.2f} {3:>10.1f} {4:>8}".format(
+            name,
+            result["min"] * 1000,
+            result["median"] * 1000,
+            result["peak_memory"] / 1024,
+            change,
+            ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--repeats", type=int, default=5,
+                        help="timed runs per case (default: 5)")
+    parser.add_argument("-k", "--select", default=None,
+                        help="only run cases whose name contains this")
+    parser.add_argument("--replay", action="store_true",
+                        help="read pages from disk instead of a local server")
+    parser.add_argument("--save", metavar="NAME",
+                        help="save results as benchmarks/results/NAME.json")
+    parser.add_argument("--compare", metavar="NAME",
+                        help="compare median times with saved results NAME")
+    args = parser.parse_args(argv)
+
+    baseline = load(args.compare) if args.compare else None
+    results = run(
+        repeats=args.repeats, select=args.select, replay=args.replay)
+    print_results(results, baseline)
+    if args.save:
+        print("saved", save(results, args.save))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,1746 @@
 """Contains classes for PMST objects
 """
 
-from bs4 import BeautifulSoup
+import argparse
+import array
+import bisect
+from collections import OrderedDict, deque, namedtuple
+import concurrent.futures
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import datetime
+import hashlib
+import importlib
+import json
+import logging
+import marshal
+import math
+import mmap
+import os
+import queue
+import random
 import re
-import requests
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+__version__ = '0.2.0'
+
+log = logging.getLogger(__name__)
+
+
+class _LazyModule():
+    """Stands in for a module that is slow to import until one of its
+    attributes is first used. The module is imported then and replaces the
+    stand-in in this module's globals, so later uses go straight to it.
+    """
+
+    def __init__(self, name, alias):
+        """Initialise class instance.
+
+        Arguments:
+            name {str} -- full name of the module
+            alias {str} -- global name the module is used under
+        """
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
+
+
+# Parsing, HTTP and array libraries take most of the time to import pmst, so
+# they are only imported when first used. Validating a Query or reading a
+# snapshot never loads the parsers or requests
+bs4 = _LazyModule('bs4', 'bs4')
+etree = _LazyModule('lxml.etree', 'etree')
+np = _LazyModule('numpy', 'np')
+requests = _LazyModule('requests', 'requests')
+
+# Default location for files cached between runs
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pmst")
+
+
+def normalize_url(url):
+    """Returns url in a canonical form so the same page always gives the same
+    string. The scheme and host are lower cased, default ports and the
+    fragment are dropped and query parameters are sorted (keeping the "&" or
+    ";" separator the URL used).
+
+    Arguments:
+        url {str} -- URL to normalize
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rpartition(':')[2]) in (('http', '80'),
+                                               ('https', '443')):
+        netloc = netloc.rpartition(':')[0]
+
+    query = parts.query
+    if query:
+        separator = ';' if ';' in query and '&' not in query else '&'
+        query = separator.join(sorted(re.split(r'[&;]', query)))
+
+    return urllib.parse.urlunsplit(
+        (scheme, netloc, parts.path or '/', query, '')
+        )
+
+
+class _NullTimer():
+    """Timer returned while instrumentation is disabled. Does nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer():
+    """Times a with block and reports it to an Instruments object."""
+    __slots__ = ('instruments', 'stage', 'start')
+
+    def __init__(self, instruments, stage):
+        self.instruments = instruments
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.timing(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Instruments():
+    """Collects per-stage timings and counters from the hot paths (reading
+    and parsing reports, fetching and parsing each protected matter) and
+    passes them to sinks. With no sinks, which is the default, timer()
+    returns a shared no-op context manager and count() returns straight
+    away, so leaving the instrumentation in place costs next to nothing.
+
+    Stage names are "<Class>.<stage>", e.g. "Report.soup", "Biota.fetch"
+    or "Biota.parse". Counters include the Fetcher's "requests",
+    "cache_hits" and "bytes".
+
+    The module-level instruments object is the one the library reports to:
+
+        stats = pmst.StatsSink()
+        pmst.instruments.add_sink(stats)
+    """
+
+    def __init__(self):
+        self.sinks = ()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def add_sink(self, sink):
+        """Starts passing timings and counters to sink.
+        """
+        with self._lock:
+            self.sinks = self.sinks + (sink,)
+        return sink
+
+    def remove_sink(self, sink):
+        """Stops passing timings and counters to sink, and closes it.
+        """
+        with self._lock:
+            self.sinks = tuple(other for other in self.sinks
+                               if other is not sink)
+        sink.close()
+
+    def timer(self, stage):
+        """Returns a context manager that times its block as stage.
+        """
+        if not self.sinks:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def timing(self, stage, seconds):
+        """Reports that stage took seconds.
+        """
+        for sink in self.sinks:
+            sink.timing(stage, seconds)
+
+    def count(self, name, value=1):
+        """Adds value to the counter name.
+        """
+        if not self.sinks:
+            return
+        for sink in self.sinks:
+            sink.count(name, value)
+
+
+class StatsSink():
+    """Sink that keeps running totals in the process: the number of
+    timings, total, minimum and maximum seconds for each stage, and the
+    total of each counter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def timing(self, stage, seconds):
+        with self._lock:
+            entry = self.timings.get(stage)
+            if entry is None:
+                self.timings[stage] = [1, seconds, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                if seconds < entry[2]:
+                    entry[2] = seconds
+                if seconds > entry[3]:
+                    entry[3] = seconds
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        """Returns the totals as a dictionary of JSON serialisable values.
+        """
+        with self._lock:
+            return {
+                'timings': {
+                    stage: {
+                        'count': count,
+                        'total': total,
+                        'mean': total / count,
+                        'min': minimum,
+                        'max': maximum,
+                    }
+                    for stage, (count, total, minimum, maximum)
+                    in self.timings.items()
+                },
+                'counters': dict(self.counters),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.timings.clear()
+            self.counters.clear()
+
+    def close(self):
+        pass
+
+
+class LoggingSink():
+    """Sink that logs every timing and counter, by default to the pmst
+    logger at DEBUG level.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or log
+        self.level = level
+
+    def timing(self, stage, seconds):
+        self.logger.log(self.level, "%s took %.3f ms", stage, seconds * 1000)
+
+    def count(self, name, value):
+        self.logger.log(self.level, "%s +%s", name, value)
+
+    def close(self):
+        pass
+
+
+class JsonSink():
+    """Sink that appends every timing and counter to a metrics file as a
+    line of JSON, e.g. {"type": "timing", "name": "Report.soup",
+    "value": 0.41, "time": 1571290000.0}.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def _write(self, kind, name, value):
+        line = json.dumps({
+            'type': kind, 'name': name, 'value': value, 'time': time.time(),
+            })
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def timing(self, stage, seconds):
+        self._write('timing', stage, seconds)
+
+    def count(self, name, value):
+        self._write('counter', name, value)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# Instrumentation the library reports to, disabled until a sink is added
+instruments = Instruments()
+
+
+class UrlRouter():
+    """Sorts URLs into the kinds of page they link to in a single pass. All
+    of the URL patterns are combined into one precompiled regex, so each URL
+    is searched once. URLs are normalized, and pages with an ID (species,
+    communities, KEFs and heritage places) are keyed by it, so the same page
+    linked in different ways only appears once.
+    """
+
+    # (kind, regex matching the URL, regex for the ID in the URL or None)
+    ROUTES = (
+        ('biota', r'/cgi-bin/sprat/public/publicspecies\.pl',
+         r'[?&;]taxon_id=(\d+)'),
+        ('tec', r'/cgi-bin/sprat/public/publicshowcommunity\.pl',
+         r'[?&;]id=(\d+)'),
+        ('kef', r'/sprat-public/action/kef/', r'/kef/view/(\d+)'),
+        ('heritage', r'/cgi-bin/ahdb/', r'[?&;]place_id=(\d+)'),
+        ('bioregion', r'topics/marine/marine-bioregional-plans?', None),
+    )
+    KINDS = tuple(route[0] for route in ROUTES) + ('other',)
+
+    def __init__(self):
+        self._regex = re.compile('|'.join(
+            f'(?P<{kind}>{pattern})' for kind, pattern, _ in self.ROUTES
+            ))
+        self._id_regex_dict = {
+            kind: re.compile(id_pattern)
+            for kind, _, id_pattern in self.ROUTES if id_pattern
+            }
+
+    def route(self, url):
+        """Returns (kind, key, url) for one URL. key is the page's ID as an
+        int for kinds that have one, otherwise the normalized URL. Links that
+        aren't web URLs (e.g. anchors in the report) are kept as they are
+        under "other".
+        """
+        if not url.lower().startswith(('http://', 'https://')):
+            return ('other', url, url)
+
+        url = normalize_url(url)
+        match = self._regex.search(url)
+        if match is None:
+            return ('other', url, url)
+
+        kind = match.lastgroup
+        id_regex = self._id_regex_dict.get(kind)
+        if id_regex is not None:
+            id_match = id_regex.search(url)
+            if id_match is not None:
+                return (kind, int(id_match.group(1)), url)
+        return (kind, url, url)
+
+    def classify(self, url_list):
+        """Returns a dictionary with a bucket for each kind in KINDS. Each
+        bucket is a dictionary of key (see route()) to URL, in the order the
+        URLs were first seen.
+
+        Arguments:
+            url_list {iterable} -- URLs to classify
+        """
+        buckets = {kind: {} for kind in self.KINDS}
+        for url in url_list:
+            kind, key, url = self.route(url)
+            buckets[kind].setdefault(key, url)
+        return buckets
+
+
+CachedPage = namedtuple(
+    'CachedPage',
+    ['url', 'text', 'etag', 'last_modified', 'fetched'],
+    )
+
+
+class _SqliteCache():
+    """Base of the caches stored in a SQLite file on disk: one table of rows
+    keyed by key, with the time each row was last used (accessed) and its
+    size in bytes. When the sizes add up to more than max_bytes the least
+    recently used rows are removed. Subclasses set TABLE, COLUMNS (the
+    columns after key, ending with accessed and size) and FILE_NAME.
+
+    The total size is kept as a running count of the rows this instance
+    writes and removes, so the table is only summed when the count goes over
+    max_bytes. Several processes can share a file; each one finds the rows
+    the others added when it next sums the table.
+    """
+
+    TABLE = None
+    COLUMNS = None
+    FILE_NAME = None
+
+    def __init__(self, path=None, max_bytes=256 * 2**20):
+        if max_bytes < 1:
+            raise ValueError('max_bytes must be at least 1')
+
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, self.FILE_NAME)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._db:
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+                f"key TEXT PRIMARY KEY, {self.COLUMNS})"
+                )
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.TABLE}_accessed "
+                f"ON {self.TABLE} (accessed)"
+                )
+        self._total = self._sum_sizes()
+
+    def size(self):
+        """Returns the total size of the cached rows in bytes.
+        """
+        with self._lock:
+            self._total = self._sum_sizes()
+            return self._total
+
+    def clear(self):
+        """Removes every row from the cache.
+        """
+        with self._lock, self._db:
+            self._db.execute(f"DELETE FROM {self.TABLE}")
+            self._total = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _select(self, columns, key):
+        """Returns the columns of the row for key and marks it as used, or
+        None if there isn't one.
+        """
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {columns} FROM {self.TABLE} WHERE key = ?", (key,)
+                ).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute(
+                    f"UPDATE {self.TABLE} SET accessed = ? WHERE key = ?",
+                    (time.time(), key),
+                    )
+        return row
+
+    def _insert(self, row):
+        """Adds or replaces a row (key first and size last), then evicts the
+        least recently used rows if the cache is over max_bytes.
+        """
+        with self._lock, self._db:
+            old = self._db.execute(
+                f"SELECT size FROM {self.TABLE} WHERE key = ?", (row[0],)
+                ).fetchone()
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.TABLE} VALUES "
+                f"({', '.join('?' * len(row))})",
+                row,
+                )
+            self._total += row[-1] - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _sum_sizes(self):
+        return self._db.execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM {self.TABLE}"
+            ).fetchone()[0]
+
+    def _evict(self):
+        """Deletes least recently used rows until the cache fits in
+        max_bytes. Must be called with the lock held, inside a transaction.
+        """
+        self._total = self._sum_sizes()
+        if self._total <= self.max_bytes:
+            return
+
+        rows = self._db.execute(
+            f"SELECT key, size FROM {self.TABLE} ORDER BY accessed"
+            ).fetchall()
+        for key, size in rows:
+            if self._total <= self.max_bytes:
+                break
+            self._db.execute(
+                f"DELETE FROM {self.TABLE} WHERE key = ?", (key,))
+            self._total -= size
+
+
+class PageCache(_SqliteCache):
+    """Persistent cache of fetched web pages, stored in a SQLite file on
+    disk. Pages are keyed by their normalized URL and stay fresh for ttl
+    seconds. Stale pages are kept so they can be revalidated with a
+    conditional request (ETag / Last-Modified) rather than downloaded again.
+    When the cache grows past max_bytes the least recently used pages are
+    removed.
+    """
+
+    TABLE = 'pages'
+    COLUMNS = ('url TEXT, body BLOB, etag TEXT, last_modified TEXT, '
+               'fetched REAL, accessed REAL, size INTEGER')
+    FILE_NAME = 'pages.sqlite'
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, max_bytes=256 * 2**20):
+        """Initialise class instance.
+
+        Arguments:
+            path {str} -- Keyword argument, path of the cache file. Defaults
+            to pages.sqlite in DEFAULT_CACHE_DIR
+            ttl {int} -- Keyword argument, seconds a page stays fresh. None
+            means pages never go stale (default: {one week})
+            max_bytes {int} -- Keyword argument, maximum size of the cached
+            pages (compressed) in bytes (default: {256 MB})
+
+        Raises:
+            ValueError: Exception generated if max_bytes is less than 1
+        """
+        self.ttl = ttl
+        super().__init__(path=path, max_bytes=max_bytes)
+
+    def get(self, url):
+        """Returns the CachedPage for url, or None if it isn't cached. Stale
+        pages are returned too, check them with is_fresh().
+
+        Arguments:
+            url {str} -- URL of the page
+        """
+        row = self._select('url, body, etag, last_modified, fetched',
+                           normalize_url(url))
+        if row is None:
+            return None
+        text = zlib.decompress(row[1]).decode('utf-8')
+        return CachedPage(row[0], text, row[2], row[3], row[4])
+
+    def is_fresh(self, page):
+        """Checks if a CachedPage is younger than the cache ttl.
+        """
+        return self.ttl is None or time.time() - page.fetched < self.ttl
+
+    def put(self, url, text, etag=None, last_modified=None):
+        """Adds or replaces the page for url, then evicts the least recently
+        used pages if the cache is over max_bytes.
+
+        Arguments:
+            url {str} -- URL of the page
+            text {str} -- text of the page
+            etag {str} -- Keyword argument, ETag header from the response
+            last_modified {str} -- Keyword argument, Last-Modified header
+            from the response
+        """
+        body = zlib.compress(text.encode('utf-8'))
+        now = time.time()
+        self._insert((normalize_url(url), url, body, etag, last_modified, now,
+                      now, len(body)))
+
+    def touch(self, url):
+        """Marks the page for url as fresh again, used after the server
+        confirms that the cached copy hasn't changed.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE pages SET fetched = ?, accessed = ? WHERE key = ?",
+                (now, now, normalize_url(url)),
+                )
+
+
+class SnapshotCache(_SqliteCache):
+    """Persistent cache of the state extracted from PMST reports, stored in
+    a SQLite file on disk, so a report that hasn't changed can be reopened
+    without parsing it again. Snapshots are keyed by a hash of the report
+    file's contents and the library version, so editing the file or
+    upgrading the library makes the old snapshot unreachable. Snapshots
+    hold only plain values (see Report._snapshot_state()) and are stored as
+    compressed marshal data. When the cache grows past max_bytes the least
+    recently used snapshots are removed.
+    """
+
+    TABLE = 'snapshots'
+    COLUMNS = ('file TEXT, body BLOB, created REAL, accessed REAL, '
+               'size INTEGER')
+    FILE_NAME = 'snapshots.sqlite'
+
+    def __init__(self, path=None, max_bytes=256 * 2**20):
+        """Initialise class instance.
+
+        Arguments:
+            path {str} -- Keyword argument, path of the cache file. Defaults
+            to snapshots.sqlite in DEFAULT_CACHE_DIR
+            max_bytes {int} -- Keyword argument, maximum size of the
+            snapshots (compressed) in bytes (default: {256 MB})
+
+        Raises:
+            ValueError: Exception generated if max_bytes is less than 1
+        """
+        super().__init__(path=path, max_bytes=max_bytes)
+
+    @staticmethod
+    def file_key(file, **options):
+        """Returns the key for the snapshot of a report file: the SHA-256
+        of its contents, the library and marshal format versions, and any
+        options that change what is extracted from the report.
+
+        Arguments:
+            file {str} -- path of the report file
+            options -- Keyword arguments, options the snapshot depends on
+        """
+        digest = hashlib.sha256()
+        with open(file, 'rb') as report:
+            for block in iter(lambda: report.read(2**20), b''):
+                digest.update(block)
+        parts = [digest.hexdigest(), __version__, str(marshal.version)]
+        parts.extend(
+            f'{name}={value!r}' for name, value in sorted(options.items())
+            )
+        return ':'.join(parts)
+
+    def get(self, key):
+        """Returns the state saved under key, or None if there isn't one.
+        """
+        row = self._select('body', key)
+        if row is None:
+            return None
+        return marshal.loads(zlib.decompress(row[0]))
+
+    def put(self, key, file, state):
+        """Adds or replaces the state saved under key, then evicts the least
+        recently used snapshots if the cache is over max_bytes.
+
+        Arguments:
+            key {str} -- key from file_key()
+            file {str} -- path of the report file, kept for reference
+            state {dict} -- plain values to save, any type marshal supports
+        """
+        body = zlib.compress(marshal.dumps(state))
+        now = time.time()
+        self._insert((key, file, body, now, now, len(body)))
+
+
+class RecordCache():
+    """In-memory cache of protected matter records by page URL, shared by
+    the reports a long-running process creates, so a species or community
+    linked from many reports is fetched and parsed once. When it holds more
+    than max_entries records the least recently used are dropped. Safe to
+    use from several threads.
+    """
+
+    def __init__(self, max_entries=10000):
+        """Initialise class instance.
+
+        Arguments:
+            max_entries {int} -- Keyword argument, maximum number of records
+            kept (default: {10000})
+
+        Raises:
+            ValueError: Exception generated if max_entries is less than 1
+        """
+        if max_entries < 1:
+            raise ValueError('max_entries must be at least 1')
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Returns the record saved for url, or None if there isn't one.
+        """
+        url = normalize_url(url)
+        with self._lock:
+            record = self._records.get(url)
+            if record is None:
+                self.misses += 1
+                return None
+            self._records.move_to_end(url)
+            self.hits += 1
+        return record
+
+    def put(self, url, record):
+        """Adds or replaces the record saved for url, then drops the least
+        recently used records if the cache is over max_entries.
+        """
+        url = normalize_url(url)
+        with self._lock:
+            self._records[url] = record
+            self._records.move_to_end(url)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+
+    def clear(self):
+        """Removes every record from the cache.
+        """
+        with self._lock:
+            self._records.clear()
+
+    def __len__(self):
+        return len(self._records)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'entries': len(self._records),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+IndexEntry = namedtuple('IndexEntry', ['kind', 'key', 'fetched', 'record'])
+
+
+class SpratIndex():
+    """Read-only index of resolved species and community records, keyed by
+    sprat_id and community ID, in a compact binary file that is memory
+    mapped, so a record is found by a binary search of the mapped file with
+    no parsing and no requests. Files are written by SpratIndex.write(),
+    usually through build_index() and refresh_index(), and are replaced
+    whole, so an index that is open keeps reading the file it mapped.
+
+    The file is a header (MAGIC, FORMAT_VERSION, entry count, offsets of
+    the entries and strings, build time and library version), then the
+    sorted keys as 64-bit integers (kind << 32 | key), which are searched
+    with bisect on a view of the map, then one fixed size entry per key,
+    then the UTF-8 strings the entries point to. Each entry holds the kind,
+    the migratory, marine and cetacean flags, the key, the time the page
+    was fetched, and the offset and length of the name, scientific name,
+    category and URL.
+    """
+
+    MAGIC = b'PMSTIDX\0'
+    FORMAT_VERSION = 1
+
+    # Kinds of protected matter in the index, stored as their position
+    KINDS = ('biota', 'tec')
+
+    _HEADER = struct.Struct('<8sHxxIIId16s')
+    _ENTRY = struct.Struct('<BBxxId8I')
+
+    # Bits of an entry's flags: the first three are the migratory, marine
+    # and cetacean values, the next three are set when a value is None
+    _FLAG_FIELDS = ('migratory', 'marine', 'cetacean')
+    _NONE_SHIFT = 3
+
+    # Length stored for a string that is None
+    _NONE_LENGTH = 0xFFFFFFFF
+
+    _URL_ROUTER = UrlRouter()
+
+    def __init__(self, path):
+        """Initialise class instance.
+
+        Arguments:
+            path {str} -- path of the index file
+
+        Raises:
+            ValueError: Exception generated if the file isn't an index, or
+            was written in a different format version
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < self._HEADER.size:
+            self._map.close()
+            raise ValueError(f'{path} is not a PMST index')
+        (magic, self.format_version, self._count, self._entries,
+         self._strings, self.built, library) = \
+            self._HEADER.unpack_from(self._map)
+        if magic != self.MAGIC:
+            self._map.close()
+            raise ValueError(f'{path} is not a PMST index')
+        if self.format_version != self.FORMAT_VERSION:
+            self._map.close()
+            raise ValueError(
+                f'{path} is index format {self.format_version}, expected '
+                f'{self.FORMAT_VERSION}; build it again')
+        self.library_version = library.rstrip(b'\0').decode('ascii')
+        keys = memoryview(self._map)[
+            self._HEADER.size:self._HEADER.size + 8 * self._count]
+        if sys.byteorder == 'little':
+            self._keys = keys.cast('Q')
+        else:
+            # Keys are written little-endian, so copy them into native order
+            self._keys = array.array('Q', keys.tobytes())
+            self._keys.byteswap()
+            keys.release()
+
+    @classmethod
+    def write(cls, path, entries, now=None):
+        """Writes entries to a new index file at path, replacing any file
+        that is there once it is complete.
+
+        Arguments:
+            path {str} -- path of the index file
+            entries {iterable} -- IndexEntry for each record. kind is one of
+            KINDS, key the sprat_id or community ID, fetched the time the
+            page was fetched (seconds since the epoch) and record a
+            BiotaRecord or TecRecord. Later entries replace earlier ones
+            with the same kind and key
+            now {float} -- Keyword argument, build time saved in the header
+            (default: {time.time()})
+
+        Returns:
+            int -- number of entries written
+        """
+        unique = {}
+        for entry in entries:
+            unique[(cls.KINDS.index(entry.kind), entry.key)] = entry
+
+        strings = bytearray()
+        string_offsets = {}
+
+        def add_string(value):
+            if value is None:
+                return 0, cls._NONE_LENGTH
+            data = str(value).encode('utf-8')
+            if data not in string_offsets:
+                string_offsets[data] = len(strings)
+                strings.extend(data)
+            return string_offsets[data], len(data)
+
+        keys = array.array('Q')
+        table = bytearray()
+        for (kind, key), entry in sorted(unique.items()):
+            keys.append(kind << 32 | key)
+            record = entry.record
+            if entry.kind == 'biota':
+                fields = (record.common_name, record.scientific_name,
+                          record.category, record.url)
+                flags = 0
+                for bit, name in enumerate(cls._FLAG_FIELDS):
+                    value = getattr(record, name)
+                    if value is None:
+                        flags |= 1 << (bit + cls._NONE_SHIFT)
+                    elif value:
+                        flags |= 1 << bit
+            else:
+                fields = (record.name, None, record.category, record.url)
+                flags = 0
+            pointers = []
+            for value in fields:
+                pointers.extend(add_string(value))
+            table.extend(cls._ENTRY.pack(
+                kind, flags, key, entry.fetched, *pointers))
+
+        if sys.byteorder != 'little':
+            keys.byteswap()
+        entries_offset = cls._HEADER.size + 8 * len(keys)
+        header = cls._HEADER.pack(
+            cls.MAGIC, cls.FORMAT_VERSION, len(unique), entries_offset,
+            entries_offset + len(table),
+            time.time() if now is None else now,
+            __version__.encode('ascii')[:16],
+            )
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(header)
+            file.write(keys.tobytes())
+            file.write(table)
+            file.write(strings)
+        os.replace(temporary, path)
+        return len(unique)
+
+    def _find(self, kind, key):
+        """Returns the position of the entry for kind and key, or None.
+        """
+        try:
+            target = self.KINDS.index(kind) << 32 | key
+        except ValueError:
+            return None
+        position = bisect.bisect_left(self._keys, target)
+        if position < self._count and self._keys[position] == target:
+            return position
+        return None
+
+    def _string(self, offset, length):
+        if length == self._NONE_LENGTH:
+            return None
+        start = self._strings + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def _entry(self, position):
+        (kind, flags, key, fetched, *pointers) = self._ENTRY.unpack_from(
+            self._map, self._entries + position * self._ENTRY.size)
+        name = self._string(pointers[0], pointers[1])
+        scientific_name = self._string(pointers[2], pointers[3])
+        category = self._string(pointers[4], pointers[5])
+        url = self._string(pointers[6], pointers[7])
+        kind = self.KINDS[kind]
+        if kind == 'biota':
+            values = [
+                None if flags >> (bit + self._NONE_SHIFT) & 1
+                else bool(flags >> bit & 1)
+                for bit in range(len(self._FLAG_FIELDS))
+                ]
+            record = BiotaRecord(
+                key, name, scientific_name, category, *values, url)
+        else:
+            record = TecRecord(name, category, url)
+        return IndexEntry(kind, key, fetched, record)
+
+    def entry(self, kind, key):
+        """Returns the IndexEntry for kind ("biota" or "tec") and key (the
+        sprat_id or community ID), or None if it isn't in the index.
+        """
+        position = self._find(kind, key)
+        return None if position is None else self._entry(position)
+
+    def get(self, kind, key):
+        """Returns the record for kind and key, or None if it isn't in the
+        index.
+        """
+        entry = self.entry(kind, key)
+        return None if entry is None else entry.record
+
+    def record_for(self, url):
+        """Returns the record for the species or community page at url, or
+        None if the URL isn't for one or it isn't in the index.
+        """
+        kind, key, _ = self._URL_ROUTER.route(url)
+        if kind not in self.KINDS or not isinstance(key, int):
+            return None
+        return self.get(kind, key)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Yields every IndexEntry, in order of kind and key.
+        """
+        for position in range(self._count):
+            yield self._entry(position)
+
+    def close(self):
+        if isinstance(self._keys, memoryview):
+            self._keys.release()
+        self._map.close()
+
+
+class ReportStore():
+    """Persistent, indexed store of PMST reports and their protected
+    matters in a SQLite file, so reports can be queried without parsing the
+    HTML again.
+
+    Each protected matter is stored once in its own table (species by
+    sprat_id, communities, KEFs and heritage places by the ID in their URL,
+    see UrlRouter) and report_matters links reports to them. Links are kept
+    for every matter linked in a report, while matter rows only exist for
+    the lists that have been fetched (or read from the report's tables).
+    Adding a report that is already stored replaces it and its links, and
+    updates the matters in place.
+
+    The buffered bounding box of each report's footprint is kept in an
+    R-tree (SQLite's rtree module, or an indexed table where SQLite is built
+    without it), so reports covering or overlapping a query are found from
+    the boxes first and only those are tested exactly (see Footprint).
+    """
+
+    # Table and columns for each kind of protected matter. The first column
+    # is the ID; the rest are the record's fields, stored as they are
+    # except for KEF bioregions, which are stored as JSON
+    MATTER_TABLES = {
+        'biota': ('species', [
+            'sprat_id', 'common_name', 'scientific_name', 'category',
+            'migratory', 'marine', 'cetacean', 'url']),
+        'tec': ('communities', ['id', 'name', 'category', 'url']),
+        'kef': ('kefs', ['id', 'name', 'bioregion', 'url']),
+        'heritage': ('heritage', [
+            'id', 'name', 'category', 'type', 'status', 'url']),
+    }
+
+    def __init__(self, path=None):
+        """Initialise class instance.
+
+        Arguments:
+            path {str} -- Keyword argument, path of the database file.
+            Defaults to reports.sqlite in DEFAULT_CACHE_DIR
+        """
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, 'reports.sqlite')
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                "id INTEGER PRIMARY KEY, file TEXT UNIQUE NOT NULL, "
+                "date TEXT, buffer REAL, email TEXT, coords TEXT, "
+                "added REAL)"
+                )
+            for table, columns in self.MATTER_TABLES.values():
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    f"{columns[0]} INTEGER PRIMARY KEY, "
+                    f"{', '.join(columns[1:])})"
+                    )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS report_matters ("
+                "report_id INTEGER NOT NULL "
+                "REFERENCES reports (id) ON DELETE CASCADE, "
+                "kind TEXT NOT NULL, matter_id INTEGER NOT NULL, "
+                "presence TEXT, "
+                "PRIMARY KEY (report_id, kind, matter_id)) WITHOUT ROWID"
+                )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS report_matters_matter "
+                "ON report_matters (kind, matter_id)"
+                )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS reports_date ON reports (date)"
+                )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS species_category "
+                "ON species (category)"
+                )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS communities_category "
+                "ON communities (category)"
+                )
+            try:
+                self._db.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING "
+                    "rtree (report_id, min_lat, max_lat, min_long, max_long)"
+                    )
+            except sqlite3.OperationalError:
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS footprints ("
+                    "report_id INTEGER PRIMARY KEY, min_lat REAL, "
+                    "max_lat REAL, min_long REAL, max_long REAL)"
+                    )
+                self._db.execute(
+                    "CREATE INDEX IF NOT EXISTS footprints_lat "
+                    "ON footprints (min_lat, max_lat)"
+                    )
+            # Reports stored before footprints were indexed
+            for report_id, coords, buffer in self._db.execute(
+                    "SELECT id, coords, buffer FROM reports WHERE id NOT IN "
+                    "(SELECT report_id FROM footprints)").fetchall():
+                self._index_footprint(report_id, coords, buffer)
+
+    def add(self, report):
+        """Adds a report, or replaces it if a report from the same file is
+        already stored, and returns its ID.
+
+        Arguments:
+            report {Report} -- report to add
+        """
+        return self.add_many([report])[0]
+
+    def add_many(self, reports):
+        """Adds several reports in one transaction and returns their IDs.
+
+        Arguments:
+            reports {iterable} -- Report objects to add
+        """
+        report_ids = []
+        with self._lock:
+            with self._db:
+                for report in reports:
+                    report_ids.append(self._add(report))
+            # Refreshes the statistics the query planner uses to pick
+            # between indexes, when they are out of date
+            self._db.execute("PRAGMA optimize")
+        return report_ids
+
+    def _add(self, report):
+        """Writes one report, its links and its fetched matters. Must be
+        called with the lock held, inside a transaction.
+        """
+        coords = report.coords.tolist() if report.coords else []
+        # No RETURNING, which needs SQLite 3.35
+        self._db.execute(
+            "INSERT INTO reports (file, date, buffer, email, coords, added) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (file) DO UPDATE SET date = excluded.date, "
+            "buffer = excluded.buffer, email = excluded.email, "
+            "coords = excluded.coords, added = excluded.added",
+            (report.file,
+             report.date.isoformat() if report.date else None,
+             report.buffer, report.email, json.dumps(coords), time.time()),
+            )
+        report_id = self._db.execute(
+            "SELECT id FROM reports WHERE file = ?", (report.file,)
+            ).fetchone()[0]
+        self._db.execute(
+            "DELETE FROM report_matters WHERE report_id = ?", (report_id,))
+        self._db.execute(
+            "DELETE FROM footprints WHERE report_id = ?", (report_id,))
+        self._index_footprint(report_id, json.dumps(coords), report.buffer)
+
+        for kind, (table, columns) in self.MATTER_TABLES.items():
+            presence_dict = {}
+            if report.is_fetched(kind):
+                rows = []
+                for record in getattr(report, kind + '_list'):
+                    # Matters listed in a PDF report without an ID have no
+                    # URL to key them by
+                    if record.url is None:
+                        continue
+                    matter_id = Report._URL_ROUTER.route(record.url)[1]
+                    if not isinstance(matter_id, int):
+                        log.warning("Not storing %s %s, its URL has no ID",
+                                    kind, record.url)
+                        continue
+                    presence_dict[matter_id] = getattr(
+                        record, 'presence', None)
+                    row = [matter_id] + [
+                        getattr(record, column) for column in columns[1:]
+                        ]
+                    if kind == 'kef':
+                        row[columns.index('bioregion')] = json.dumps(
+                            list(record.bioregion))
+                    rows.append(row)
+                self._db.executemany(
+                    f"INSERT INTO {table} VALUES "
+                    f"({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT ({columns[0]}) DO UPDATE SET "
+                    + ', '.join(f'{column} = excluded.{column}'
+                                for column in columns[1:]),
+                    rows,
+                    )
+
+            self._db.executemany(
+                "INSERT INTO report_matters VALUES (?, ?, ?, ?)",
+                [(report_id, kind, matter_id, presence_dict.get(matter_id))
+                 for matter_id in report.url_buckets[kind]
+                 if isinstance(matter_id, int)],
+                )
+        return report_id
+
+    def _index_footprint(self, report_id, coords, buffer):
+        """Adds the bounding box of a report's buffered footprint to the
+        footprints index. Must be called inside a transaction.
+
+        Arguments:
+            report_id {int} -- ID of the report
+            coords {str} -- coordinates as stored in the reports table
+            buffer {float} -- buffer in km
+        """
+        coords = json.loads(coords) if coords else []
+        if coords:
+            footprint = Footprint(CoordArray(coords), buffer)
+            self._db.execute(
+                "INSERT INTO footprints VALUES (?, ?, ?, ?, ?)",
+                (report_id,) + footprint.bbox(),
+                )
+
+    def _footprint_candidates(self, footprint, contain):
+        """Returns (file, Footprint) of the reports whose buffered bounding
+        box overlaps the footprint's, or contains it if contain is True.
+        """
+        min_lat, max_lat, min_long, max_long = footprint.bbox()
+        if contain:
+            values = (min_lat, max_lat, min_long, max_long)
+        else:
+            values = (max_lat, min_lat, max_long, min_long)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT reports.file, reports.coords, reports.buffer "
+                "FROM footprints JOIN reports "
+                "ON reports.id = footprints.report_id "
+                "WHERE footprints.min_lat <= ? AND footprints.max_lat >= ? "
+                "AND footprints.min_long <= ? AND footprints.max_long >= ? "
+                "ORDER BY reports.id", values,
+                ).fetchall()
+        return [
+            (file, Footprint(CoordArray(json.loads(coords)), buffer))
+            for file, coords, buffer in rows
+            ]
+
+    def reports_covering(self, query):
+        """Returns the files of the reports whose buffered footprint
+        contains the whole of the query's, so their results can be used
+        instead of running the query.
+
+        Arguments:
+            query {Query} -- query with its coordinates set, or a Footprint
+        """
+        footprint = query if isinstance(query, Footprint) \
+            else Footprint.from_query(query)
+        return [
+            file for file, candidate
+            in self._footprint_candidates(footprint, contain=True)
+            if candidate.covers(footprint)
+            ]
+
+    def reports_overlapping(self, query):
+        """Returns the files of the reports whose buffered footprint
+        overlaps the query's.
+
+        Arguments:
+            query {Query} -- query with its coordinates set, or a Footprint
+        """
+        footprint = query if isinstance(query, Footprint) \
+            else Footprint.from_query(query)
+        return [
+            file for file, candidate
+            in self._footprint_candidates(footprint, contain=False)
+            if candidate.overlaps(footprint)
+            ]
+
+    def remove(self, file):
+        """Removes the report from file and its links. Matters are kept.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM report_matters WHERE report_id IN "
+                "(SELECT id FROM reports WHERE file = ?)", (file,))
+            self._db.execute(
+                "DELETE FROM footprints WHERE report_id IN "
+                "(SELECT id FROM reports WHERE file = ?)", (file,))
+            self._db.execute("DELETE FROM reports WHERE file = ?", (file,))
+
+    def files(self):
+        """Returns the files of every stored report, in the order added.
+        """
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT file FROM reports ORDER BY id")]
+
+    def reports_with(self, kind, matter_id):
+        """Returns the files of the reports that link to a protected matter.
+
+        Arguments:
+            kind {str} -- kind of protected matter, e.g. 'biota'
+            matter_id {int} -- ID of the matter, e.g. its sprat_id
+        """
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT reports.file FROM report_matters "
+                "JOIN reports ON reports.id = report_matters.report_id "
+                "WHERE report_matters.kind = ? "
+                "AND report_matters.matter_id = ? ORDER BY reports.id",
+                (kind, matter_id))]
+
+    def reports_with_species(self, sprat_id):
+        """Returns the files of the reports that list a species.
+        """
+        return self.reports_with('biota', sprat_id)
+
+    def reports_with_category(self, kind, category):
+        """Returns the files of the reports that link to at least one
+        species ('biota') or community ('tec') in a threatened category.
+
+        Arguments:
+            kind {str} -- 'biota' or 'tec'
+            category {str} -- threatened category, e.g. "Critically
+            Endangered"
+        """
+        table, columns = self.MATTER_TABLES[kind]
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                f"SELECT DISTINCT reports.file FROM {table} "
+                f"JOIN report_matters ON report_matters.kind = ? "
+                f"AND report_matters.matter_id = {table}.{columns[0]} "
+                f"JOIN reports ON reports.id = report_matters.report_id "
+                f"WHERE {table}.category = ? ORDER BY reports.id",
+                (kind, category))]
+
+    def matter(self, kind, matter_id):
+        """Returns the stored record of a protected matter, or None if it
+        isn't stored.
+
+        Arguments:
+            kind {str} -- kind of protected matter, e.g. 'biota'
+            matter_id {int} -- ID of the matter, e.g. its sprat_id
+        """
+        table, columns = self.MATTER_TABLES[kind]
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT * FROM {table} WHERE {columns[0]} = ?", (matter_id,)
+                ).fetchone()
+        if row is None:
+            return None
+        fields = dict(zip(columns, row))
+        if kind == 'biota':
+            for flag in ('migratory', 'marine', 'cetacean'):
+                if fields[flag] is not None:
+                    fields[flag] = bool(fields[flag])
+        elif kind == 'kef':
+            fields['bioregion'] = tuple(json.loads(fields['bioregion']))
+        if kind != 'biota' and kind != 'heritage':
+            del fields['id']
+        return Report._RECORD_DICT[kind](**fields)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CoordArray():
+    """Coordinates of a query or report footprint as an (n, 2) NumPy array
+    of (latitude, longitude) pairs in decimal degrees. Used by both Query
+    and Report, so checks run on every vertex at once rather than pair by
+    pair, which matters for polygons with many vertices.
+    """
+
+    # Ranges accepted by the PMST search tool, exclusive
+    LAT_RANGE = (-70, -5)
+    LONG_RANGE = (65, 180)
+    # Most vertices a PMST search accepts
+    MAX_VERTICES = 150
+    # Decimal places coordinates are rounded to, about 1 m
+    PLACES = 5
+    NUMBER_RE = re.compile(r'[-+]?\d*\.?\d+')
+
+    def __init__(self, coords):
+        """Initialise class instance.
+
+        Arguments:
+            coords {array_like} -- (latitude, longitude) pairs, or a flat
+            sequence of latitudes and longitudes. Strings are converted to
+            floats
+
+        Raises:
+            ValueError: Exception generated if coords can't be converted to
+            floats or has an odd number of values
+        """
+        array = np.asarray(coords, dtype=float)
+        if array.size % 2:
+            raise ValueError('Coordinates must be pairs of numbers')
+        self.array = array.reshape(-1, 2)
+
+    @classmethod
+    def from_string(cls, coord_string):
+        """Creates a CoordArray from a string of latitudes and longitudes
+        separated by spaces, e.g. the coordinates in a PMST report.
+        """
+        return cls(cls.NUMBER_RE.findall(coord_string))
+
+    @classmethod
+    def from_dms(cls, dms):
+        """Creates a CoordArray from coordinates in degrees, minutes and
+        seconds.
+
+        Arguments:
+            dms {array_like} -- (n, 2, 3) array of ((degrees, minutes,
+            seconds), (degrees, minutes, seconds)) for latitude and
+            longitude. The sign of the degrees is the sign of the coordinate
+        """
+        dms = np.asarray(dms, dtype=float)
+        if dms.ndim != 3 or dms.shape[1:] != (2, 3):
+            raise ValueError('DMS coordinates must be pairs of (degrees, '
+                             'minutes, seconds)')
+        magnitude = (np.abs(dms[..., 0]) + dms[..., 1] / 60
+                     + dms[..., 2] / 3600)
+        return cls(np.copysign(magnitude, dms[..., 0]))
+
+    def to_dms(self):
+        """Returns the coordinates as an (n, 2, 3) array of degrees, minutes
+        and seconds, the inverse of from_dms(). Seconds are rounded to
+        PLACES - 3 places, the same precision as PLACES decimal places.
+        """
+        magnitude = np.abs(self.array)
+        degrees = np.floor(magnitude)
+        minutes = np.floor((magnitude - degrees) * 60)
+        seconds = np.round(
+            (magnitude - degrees - minutes / 60) * 3600, self.PLACES - 3)
+        # Rounding can carry seconds (and then minutes) up to 60
+        carry = seconds >= 60
+        seconds[carry] -= 60
+        minutes[carry] += 1
+        carry = minutes >= 60
+        minutes[carry] -= 60
+        degrees[carry] += 1
+        return np.stack(
+            [np.copysign(degrees, self.array), minutes, seconds], axis=-1)
+
+    def rounded(self, places=PLACES):
+        """Returns a copy with the coordinates rounded to places decimal
+        places (default: {PLACES}).
+        """
+        return CoordArray(np.round(self.array, places))
+
+    def out_of_range(self):
+        """Returns the indexes of the pairs with a latitude or longitude
+        outside LAT_RANGE and LONG_RANGE.
+        """
+        lat, long = self.array[:, 0], self.array[:, 1]
+        bad = ((lat <= self.LAT_RANGE[0]) | (lat >= self.LAT_RANGE[1])
+               | (long <= self.LONG_RANGE[0]) | (long >= self.LONG_RANGE[1]))
+        return np.flatnonzero(bad)
+
+    def check_range(self):
+        """Raises ValueError if any pair is out of range, naming the first
+        few of them.
+        """
+        bad = self.out_of_range()
+        if bad.size:
+            raise ValueError(
+                f'{bad.size} coordinate pairs out of range (latitude '
+                f'{self.LAT_RANGE}, longitude {self.LONG_RANGE}), e.g. '
+                f'{self.array[bad[:3]].tolist()} at {bad[:3].tolist()}'
+                )
+
+    @property
+    def is_closed(self):
+        """True if the last vertex is the same as the first.
+        """
+        return len(self) > 1 and bool(np.all(self.array[0] == self.array[-1]))
+
+    def check_geometry(self, geom_type):
+        """Raises ValueError if the number of vertices doesn't suit geom_type
+        (from Query._GEOM_TYPE_DICT) or is over MAX_VERTICES. A point has one
+        vertex, a line at least two and a polygon at least three, not
+        counting a closing vertex.
+        """
+        if geom_type not in Query._GEOM_TYPE_DICT:
+            raise ValueError('geom_type out of range')
+        count = len(self)
+        if count > self.MAX_VERTICES:
+            raise ValueError(
+                f'{count} vertices, a query can have at most '
+                f'{self.MAX_VERTICES}')
+
+        vertices = count - 1 if self.is_closed else count
+        minimum = {1: 1, 2: 2, 3: 3, 4: 1}[geom_type]
+        if vertices < minimum or (geom_type == 1 and count > 1):
+            raise ValueError(
+                f'{Query._GEOM_TYPE_DICT[geom_type]} geometry can\'t have '
+                f'{count} vertices')
+
+    def to_dict(self):
+        """Returns the pairs as lists of floats in a dict keyed by their
+        position (from 1).
+        """
+        return {
+            key: pair for key, pair in enumerate(self.array.tolist(), 1)
+            }
+
+    def tolist(self):
+        return self.array.tolist()
+
+    def __len__(self):
+        return len(self.array)
+
+    def __eq__(self, other):
+        if not isinstance(other, CoordArray):
+            return NotImplemented
+        return np.array_equal(self.array, other.array)
+
+    def __repr__(self):
+        return f'CoordArray({self.array.tolist()!r})'
+
+
+def _point_segment_distances(points, starts, ends):
+    """Returns the distance from each point to each segment, as a (points,
+    segments) array. Coordinates are planar (km).
+    """
+    direction = ends - starts
+    length_sq = np.einsum('ij,ij->i', direction, direction)
+    offset = points[:, None, :] - starts[None, :, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.einsum('psj,sj->ps', offset, direction) / length_sq
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    nearest = starts[None, :, :] + t[..., None] * direction[None, :, :]
+    return np.hypot(*(points[:, None, :] - nearest).transpose(2, 0, 1))
+
+
+def _segments_cross(starts_a, ends_a, starts_b, ends_b):
+    """Returns a (segments a, segments b) boolean array of which segments
+    properly cross. Touching segments are caught by the distance test.
+    """
+    def orientation(p, q, r):
+        return np.sign(
+            (q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1])
+            - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0])
+            )
+
+    a0, a1 = starts_a[:, None, :], ends_a[:, None, :]
+    b0, b1 = starts_b[None, :, :], ends_b[None, :, :]
+    return ((orientation(a0, a1, b0) * orientation(a0, a1, b1) < 0)
+            & (orientation(b0, b1, a0) * orientation(b0, b1, a1) < 0))
+
+
+def _points_in_polygon(points, ring):
+    """Returns which points are inside the closed ring, by ray casting.
+    """
+    x, y = points[:, 0][:, None], points[:, 1][:, None]
+    x0, y0 = ring[:-1, 0][None, :], ring[:-1, 1][None, :]
+    x1, y1 = ring[1:, 0][None, :], ring[1:, 1][None, :]
+    straddles = (y0 > y) != (y1 > y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        crossing_x = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return np.count_nonzero(straddles & (x < crossing_x), axis=1) % 2 == 1
+
+
+def _simplify_mask(points, tolerance):
+    """Returns which points to keep to simplify a line or closed ring of
+    planar points (km) with the Douglas-Peucker algorithm. Every point
+    dropped is within tolerance of the simplified line, and so is the area
+    between them. The first and last points are always kept.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _point_segment_distances(
+            points[start + 1:end], points[start:start + 1],
+            points[end:end + 1])[:, 0]
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            keep[middle] = True
+            stack.extend([(start, middle), (middle, end)])
+    return keep
+
+
+def _ring_area(ring):
+    """Returns the signed area of an open ring (shoelace formula).
+    """
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def _clip_ring(ring, axis, value, keep_below):
+    """Clips an open ring to the half-plane where coordinate axis is at most
+    (keep_below) or at least value (Sutherland-Hodgman). Parts of a concave
+    polygon on the same side are joined along the cut line.
+    """
+    side = ring[:, axis] - value
+    if not keep_below:
+        side = -side
+    inside = side <= 0
+    following = np.roll(ring, -1, axis=0)
+    following_side = np.roll(side, -1)
+    crossing = inside != np.roll(inside, -1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = side / (side - following_side)
+    crossings = ring + np.nan_to_num(t)[:, None] * (following - ring)
+    crossings[:, axis] = value
+
+    # Each vertex if it is inside, then the point its edge crosses the line
+    candidates = np.stack([ring, crossings], axis=1)
+    clipped = candidates[np.column_stack([inside, crossing])]
+    if len(clipped) > 1:
+        distinct = np.any(clipped != np.roll(clipped, 1, axis=0), axis=1)
+        clipped = clipped[distinct] if distinct.any() else clipped[:1]
+    return clipped
+
+
+def _split_ring(ring, max_vertices, depth=0):
+    """Splits an open ring into open rings of at most max_vertices vertices
+    covering the same area, cutting it at the median vertex across the
+    longer side of its bounding box until every part is small enough.
+
+    Raises:
+        ValueError: Exception generated if the parts are still too large
+        after 40 cuts
+    """
+    if len(ring) <= max_vertices:
+        return [ring]
+    if depth >= 40:
+        raise ValueError(
+            f'polygon can\'t be split into parts of {max_vertices} vertices')
+
+    axis = int(np.argmax(ring.max(axis=0) - ring.min(axis=0)))
+    values = ring[:, axis]
+    cut = float(np.median(values))
+    if not values.min() < cut < values.max():
+        cut = float(values.min() + values.max()) / 2
+
+    rings = []
+    for keep_below in (True, False):
+        part = _clip_ring(ring, axis, cut, keep_below)
+        if len(part) >= 3 and _ring_area(part) != 0:
+            rings.extend(_split_ring(part, max_vertices, depth + 1))
+    return rings
+
+
+class Footprint():
+    """Area searched by a PMST query or report: a point, line or polygon
+    with a buffer in km around it. Used by ReportStore to find the reports
+    that cover or overlap a new query.
+
+    Geometry tests are made on the coordinates projected to km around the
+    footprints' mean latitude (equirectangular), which is accurate to well
+    under 1% over the few hundred km a PMST search covers.
+    """
+
+    KM_PER_DEGREE_LAT = 110.574
+    KM_PER_DEGREE_LONG = 111.320
+    # Most points inside a polygon tested by covers(), on a grid
+    INTERIOR_SAMPLES = 2500
+
+    def __init__(self, coords, buffer=0.0, geom_type=4):
+        """Initialise class instance.
+
+        Arguments:
+            coords {CoordArray} -- vertices of the footprint
+            buffer {float} -- Keyword argument, buffer in km (default: {0})
+            geom_type {int} -- Keyword argument, geometry type from
+            Query._GEOM_TYPE_DICT. If undefined (4), one vertex is a point,
+            a closed ring of at least four vertices a polygon and anything
+            else a line (default: {4})
+        """
+        if not len(coords):
+            raise ValueError('Footprint must have at least one vertex')
+        if geom_type == 4:
+            if len(coords) == 1:
+                geom_type = 1
+            elif len(coords) >= 4 and coords.is_closed:
+                geom_type = 3
+            else:
+                geom_type = 2
+        self.coords = coords
+        self.buffer = float(buffer or 0.0)
+        self.geom_type = geom_type
+
+    @classmethod
+    def from_query(cls, query):
+        """Creates the Footprint of a Query with its coordinates set.
+        """
+        if query.coord_list is None:
+            raise ValueError('Query coordinates not set')
+        return cls(query.coord_list, query.buffer, query.geom_type)
+
+    @classmethod
+    def from_report(cls, report):
+        """Creates the Footprint of a Report, or returns None if it has no
+        coordinates.
+        """
+        if not report.coords:
+            return None
+        return cls(report.coords, report.buffer)
+
+    def bbox(self):
+        """Returns (min lat, max lat, min long, max long) of the buffered
+        footprint in degrees.
+        """
+        array = self.coords.array
+        lat_pad = self.buffer / self.KM_PER_DEGREE_LAT
+        # Longitude degrees are shortest furthest from the equator
+        long_pad = self.buffer / (self.KM_PER_DEGREE_LONG * np.cos(
+            np.radians(np.abs(array[:, 0]).max() + lat_pad)))
+        return (
+            float(array[:, 0].min() - lat_pad),
+            float(array[:, 0].max() + lat_pad),
+            float(array[:, 1].min() - long_pad),
+            float(array[:, 1].max() + long_pad),
+            )
+
+    def _planar(self, origin_lat):
+        array = self.coords.array
+        return np.column_stack([
+            array[:, 1] * self.KM_PER_DEGREE_LONG
+            * np.cos(np.radians(origin_lat)),
+            array[:, 0] * self.KM_PER_DEGREE_LAT,
+            ])
+
+    def _segments(self, points):
+        if len(points) == 1:
+            return points, points
+        return points[:-1], points[1:]
+
+    def _samples(self, points, spacing):
+        """Returns the vertices plus points along each edge at most spacing
+        km apart, used to test whether the whole footprint is covered.
+        """
+        starts, ends = self._segments(points)
+        lengths = np.hypot(*(ends - starts).T)
+        counts = np.maximum(np.ceil(lengths / spacing).astype(int), 1)
+        t = np.concatenate([np.arange(count) / count for count in counts])
+        index = np.repeat(np.arange(len(starts)), counts)
+        samples = starts[index] + t[:, None] * (ends - starts)[index]
+        return np.vstack([samples, points[-1:]])
+
+    def _interior_samples(self, points):
+        """Returns the points of a grid over the polygon's bounding box that
+        are inside it, at most INTERIOR_SAMPLES of them.
+        """
+        side = int(np.sqrt(self.INTERIOR_SAMPLES))
+        low, high = points.min(axis=0), points.max(axis=0)
+        grid = np.stack(np.meshgrid(
+            np.linspace(low[0], high[0], side),
+            np.linspace(low[1], high[1], side),
+            ), axis=-1).reshape(-1, 2)
+        return grid[_points_in_polygon(grid, points)]
+
+    def _signed_distances(self, points, own):
+        """Distance in km from each point to the footprint's geometry, not
+        counting the buffer. Points inside a polygon get minus their
+        distance to its edge.
+        """
+        starts, ends = self._segments(own)
+        distances = _point_segment_distances(points, starts, ends).min(axis=1)
+        if self.geom_type == 3:
+            inside = _points_in_polygon(points, own)
+            distances[inside] *= -1
+        return distances
+
+    def _origin(self, other):
+        return float(np.concatenate(
+            [self.coords.array[:, 0], other.coords.array[:, 0]]).mean())
+
+    def covers(self, other):
+        """Checks if the buffered footprint contains the whole of another
+        buffered footprint, i.e. a search of other would only find matters
+        this footprint's search already found. Edges of other are sampled
+        every 100 m (or a tenth of the buffer, if smaller), and the inside
+        of a polygon on a grid of up to INTERIOR_SAMPLES points, so a hole
+        in this footprint smaller than the grid spacing can be missed.
+        """
+        origin = self._origin(other)
+        own, points = self._planar(origin), other._planar(origin)
+        spacing = min(0.1, self.buffer / 10) if self.buffer else 0.1
+        samples = other._samples(points, spacing)
+        if other.geom_type == 3:
+            # Covering a polygon's boundary doesn't cover its inside if this
+            # footprint has a hole there, e.g. a line looping round it
+            samples = np.vstack([samples, other._interior_samples(points)])
+        distances = self._signed_distances(samples, own)
+        return bool(np.all(distances <= self.buffer - other.buffer + 1e-9))
+
+    def overlaps(self, other):
+        """Checks if the buffered footprint intersects another buffered
+        footprint.
+        """
+        origin = self._origin(other)
+        own, points = self._planar(origin), other._planar(origin)
+        reach = self.buffer + other.buffer + 1e-9
+
+        starts_a, ends_a = self._segments(own)
+        starts_b, ends_b = other._segments(points)
+        if _segments_cross(starts_a, ends_a, starts_b, ends_b).any():
+            return True
+        if (self.geom_type == 3
+                and _points_in_polygon(points[:1], own).any()):
+            return True
+        if (other.geom_type == 3
+                and _points_in_polygon(own[:1], points).any()):
+            return True
+        distance = min(
+            _point_segment_distances(points, starts_a, ends_a).min(),
+            _point_segment_distances(own, starts_b, ends_b).min(),
+            )
+        return bool(distance <= reach)
 
 
 class Query():
@@ -13,130 +1749,1428 @@ class Query():
     Can be created from an existing PMST report object
     """
 
-    """To Do List
-    Add a check for geometry set method - if more than one point in the coords
-    list then the geom can't be point
-    Add a check for the set coord list method to check against the geometry
-    type. Of there's more than one set of points then it can't be a point geom.
-    The number of points in the coord list must be <= 150, add check for this.
+    _GEOM_TYPE_DICT = {
+        1: "Point",
+        2: "Line",
+        3: "Polygon",
+        4: "Undefined",
+    }
+
+    _COORD_TYPE_DICT = {
+        1: "Decimal degrees",
+        2: "Degrees minutes seconds",
+        3: "Undefined",
+    }
+
+    def __init__(self, **kwargs):
+        self.name = None
+        self.coord_type = kwargs.get('coord_type', 3)
+        self.coord_list = None
+        self.geom_type = None
+        self.buffer = kwargs.get('buffer', 1)
+        self.email = kwargs.get('email', None)
+
+        # this doesn't seem very Pythonic, might be a better way to implement
+        # this
+        if 'geom_type' in kwargs:
+            self.set_geom_type(kwargs.get('geom_type'))
+        else:
+            self.geom_type = 4
+
+    def set_geom_type(self, geom_type):
+        """Sets the geometry type of the query (point, line, area). This can't
+        be derived from PMST report except for the cases where there is one
+        coordinate pair (geometry must be a point) or two coordinate pairs
+        (geometry must be a line). Any case where three or more pairs of
+        coordinates occur could be either a line or an area. Any case with two
+        or more pairs of coordinates can't be a point.
+        """
+        if geom_type in self._GEOM_TYPE_DICT:
+            self.geom_type = geom_type
+        else:
+            raise ValueError('geom_type out of range')
+
+    def set_coord_type(self, coord_type):
+        """Sets the coordinate type for the query. Used when querying the PMST
+        report page.
+
+        Arguments:
+            coord_type {str} -- coordinate type from class variable
+            _COORD_TYPE_DICT
+
+        Raises:
+            ValueError: Exception generated if coord_type argument is not a
+            value within _COORD_TYPE_DICT
+        """
+
+        if coord_type in self._COORD_TYPE_DICT:
+            self.coord_type = coord_type
+        else:
+            raise ValueError('coord_type out of range')
+
+    def _read_coords(self, coord_list):
+        """Returns coord_list as a CoordArray, reading it as degrees minutes
+        seconds if coord_type is 2, and checks every pair is in range.
+        """
+        if self.coord_type == 2:
+            coords = CoordArray.from_dms(coord_list)
+        else:
+            coords = CoordArray(coord_list)
+        coords.check_range()
+        return coords
+
+    def tile(self, coord_list, max_vertices=None, tolerance=0.0):
+        """Splits a line or polygon with more vertices than a PMST search
+        accepts into sub-queries that each fit, and that together search the
+        whole of the buffered geometry. A line is cut into consecutive
+        pieces that share their end vertices. A polygon is cut in two at the
+        median vertex, across the longer side of its bounding box, until
+        every part fits; parts on the same side of a cut may be joined along
+        it. Geometries that already fit are returned as one query.
+
+        With a tolerance, the geometry is simplified first (Douglas-Peucker)
+        so no vertex moves more than tolerance km, and the tiles' buffer is
+        increased by tolerance so they still cover the buffered geometry.
+        Simplifying a smooth line often leaves few enough vertices for one
+        query.
+
+        Arguments:
+            coord_list {array_like} -- vertices of the geometry, as for
+            set_coord_list() but with any number of them
+            max_vertices {int} -- Keyword argument, most vertices per tile,
+            counting a polygon's closing vertex
+            (default: {CoordArray.MAX_VERTICES})
+            tolerance {float} -- Keyword argument, how far in km vertices
+            can move when the geometry is simplified, 0 to not simplify it
+            (default: {0.0})
+
+        Returns:
+            list -- Query for each tile, with this query's geometry type,
+            coordinate type, email and buffer (plus tolerance)
+
+        Raises:
+            ValueError: Exception generated if the coordinates aren't pairs
+            or are out of range, max_vertices is less than 4, or the tiles
+            don't suit the geometry type (e.g. a point with several vertices)
+        """
+        if max_vertices is None:
+            max_vertices = CoordArray.MAX_VERTICES
+        if max_vertices < 4:
+            raise ValueError('max_vertices must be at least 4')
+
+        coords = self._read_coords(coord_list)
+        array = coords.array
+        geom_type = Footprint(coords, geom_type=self.geom_type).geom_type
+        buffer = float(self.buffer or 0.0)
+        if tolerance and geom_type != 1 and len(array) > max_vertices:
+            planar = Footprint(coords)._planar(float(array[:, 0].mean()))
+            array = array[_simplify_mask(planar, tolerance)]
+            buffer = round(buffer + tolerance, 6)
+
+        if len(array) <= max_vertices or geom_type == 1:
+            pieces = [array]
+        elif geom_type == 3:
+            ring = array[:-1] if CoordArray(array).is_closed else array
+            pieces = [
+                np.vstack([part, part[:1]])
+                for part in _split_ring(ring, max_vertices - 1)
+                ]
+        else:
+            step = max_vertices - 1
+            pieces = [
+                array[start:start + max_vertices]
+                for start in range(0, len(array) - 1, step)
+                ]
+        return [self._tile_query(piece, buffer) for piece in pieces]
+
+    def _tile_query(self, array, buffer):
+        """Returns a copy of the query with the coordinates in array and the
+        given buffer.
+        """
+        query = Query(
+            coord_type=self.coord_type, buffer=buffer, email=self.email,
+            geom_type=self.geom_type,
+            )
+        query.name = self.name
+        coords = CoordArray(array)
+        coords.check_geometry(self.geom_type)
+        query.coord_list = coords.rounded()
+        return query
+
+    def search_tiled(self, coord_list, search, max_workers=4,
+                     **tile_options):
+        """Searches a geometry of any size: splits it with tile(), searches
+        the tiles concurrently and merges their reports with Report.merge().
+        If a tile's search fails its exception is raised, as the merged
+        report would be missing part of the area.
+
+        Arguments:
+            coord_list {array_like} -- vertices of the geometry, see tile()
+            search {callable} -- function that takes a Query (of at most
+            max_vertices vertices) and returns its Report, e.g. a client of
+            the PMST search tool or a local stand-in for it
+            max_workers {int} -- Keyword argument, most searches run at once
+            (default: {4})
+            tile_options -- Keyword arguments passed to tile(), i.e.
+            max_vertices and tolerance
+
+        Returns:
+            Report -- report for the whole geometry
+        """
+        tiles = self.tile(coord_list, **tile_options)
+        with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(tiles))) as executor:
+            reports = list(executor.map(search, tiles))
+        return Report.merge(
+            reports,
+            coords=self._read_coords(coord_list).rounded(),
+            buffer=tiles[0].buffer,
+            )
+
+    def set_coord_list(self, coord_list):
+        """Sets the coordinates of the query as a CoordArray, rounded to 5
+        decimal places. Every pair is checked at once: latitude must be
+        between -70 and -5 and longitude between 65 and 180, and the number
+        of vertices must suit the geometry type and be at most 150.
+
+        Arguments:
+            coord_list {array_like} -- (latitude, longitude) pairs in decimal
+            degrees, or ((d, m, s), (d, m, s)) pairs if coord_type is 2
+            (degrees minutes seconds)
+
+        Raises:
+            ValueError: Exception generated if the coordinates aren't pairs,
+            are out of range or don't suit the geometry type
+        """
+        coords = self._read_coords(coord_list)
+        coords.check_geometry(self.geom_type)
+        self.coord_list = coords.rounded()
+
+    def set_buffer(self, buffer):
+        """To do
+        """
+        try:
+            buffer_string = self._soup.find(
+                        "span", text=re.compile(r'(Buffer:)')
+                    ).text
+        except ValueError:
+            log.warning("No buffer found")
+
+        def find_buffer(string):
+            try:
+                result = re.search(r"[-+]?\d*\.\d+|\d+", string)
+                return result.group()
+            except ValueError:
+                log.warning("No date found")
+
+        try:
+            self.buffer = find_buffer(buffer_string)
+        except ValueError:
+            log.warning("Buffer not set")
+
+
+class BiotaRecord(namedtuple('BiotaRecord', [
+        'sprat_id', 'common_name', 'scientific_name', 'category',
+        'migratory', 'marine', 'cetacean', 'url', 'presence'],
+        defaults=(None,))):
+    """Immutable record of the attributes read from the SPRAT page for a
+    species. Created by Biota.record(), or from the report's own tables (see
+    _TableScanner), which also give the type of presence.
+    """
+    __slots__ = ()
+
+
+class TecRecord(namedtuple(
+        'TecRecord', ['name', 'category', 'url', 'presence'],
+        defaults=(None,))):
+    """Immutable record of a Threatened Ecological Community. Created by
+    Tec.record(), or from the report's own tables with the type of presence.
+    """
+    __slots__ = ()
+
+
+class KefRecord(namedtuple('KefRecord', ['name', 'bioregion', 'url'])):
+    """Immutable record of a Key Ecological Feature, bioregion is a tuple of
+    URLs. Created by Kef.record().
+    """
+    __slots__ = ()
+
+
+class HeritageRecord(namedtuple('HeritageRecord', [
+        'id', 'name', 'category', 'type', 'status', 'url'])):
+    """Immutable record of a heritage place. Created by Heritage.record().
+    """
+    __slots__ = ()
+
+
+class TransportResponse():
+    """Response returned by transports that don't go through requests. Has
+    the parts of requests.Response that Fetcher uses.
+    """
+
+    def __init__(self, url, status_code, text, headers=None, content=None):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self._content = content
+
+    @property
+    def content(self):
+        """The body as bytes: as it was read, or the text encoded as UTF-8.
+        """
+        if self._content is None:
+            self._content = self.text.encode('utf-8')
+        return self._content
+
+    def raise_for_status(self):
+        """Raises requests.HTTPError for 4xx and 5xx status codes, like
+        requests.Response.raise_for_status().
+        """
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                f'{self.status_code} Error for url: {self.url}',
+                response=self,
+                )
+
+
+class Transport():
+    """Base class for the ways a Fetcher can get a page. Subclasses
+    implement get(), returning an object with status_code, text, content,
+    headers and raise_for_status() (a requests.Response or a
+    TransportResponse).
+    """
+
+    def get(self, url, headers=None, timeout=None):
+        """Requests url with the given extra headers and returns the
+        response. Must be safe to call from several threads at once.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HttpTransport(Transport):
+    """Gets pages from the live web over one pooled requests.Session, so
+    keep-alive connections are reused between pages.
+    """
+
+    def __init__(self, pool_size=8):
+        """Initialise class instance.
+
+        Arguments:
+            pool_size {int} -- Keyword argument, number of connections kept
+            open per host, should be at least the number of threads using
+            the transport (default: {8})
+        """
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """requests.Session shared by all requests, created on first use.
+        """
+        with self._lock:
+            if self._session is None:
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                    )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+        return self._session
+
+    def get(self, url, headers=None, timeout=None):
+        return self.session.get(url, headers=headers, timeout=timeout)
+
+    def close(self):
+        """Closes the pooled connections held by the session.
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class RecordTransport(Transport):
+    """Gets pages through another transport (live HTTP by default) and saves
+    each response to an archive directory, which ReplayTransport can serve
+    later. Each page body is saved to its own file and described by a line
+    in the archive's index.jsonl.
+    """
+
+    def __init__(self, directory, transport=None):
+        """Initialise class instance.
+
+        Arguments:
+            directory {str} -- archive directory, created if needed
+            transport {Transport} -- Keyword argument, transport used to get
+            the pages (default: {HttpTransport()})
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.transport = transport or HttpTransport()
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, timeout=None):
+        response = self.transport.get(url, headers=headers, timeout=timeout)
+        # 304 responses have no body, the archive keeps the earlier copy
+        if response.status_code != 304:
+            self._save(url, response)
+        return response
+
+    def _save(self, url, response):
+        key = normalize_url(url)
+        file_name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.html'
+        with open(os.path.join(self.directory, file_name), 'w',
+                  encoding='utf-8') as page:
+            page.write(response.text)
+
+        entry = {
+            'url': key,
+            'file': file_name,
+            'status': response.status_code,
+            'headers': {
+                name: response.headers[name]
+                for name in ('ETag', 'Last-Modified', 'Content-Type')
+                if name in response.headers
+                },
+            }
+        with self._lock, open(os.path.join(
+                self.directory, 'index.jsonl'), 'a') as index:
+            index.write(json.dumps(entry) + '\n')
+
+    def close(self):
+        self.transport.close()
+
+
+class ReplayTransport(Transport):
+    """Serves pages from local files instead of the web. A URL is looked up
+    in order in:
+
+    * the mapping passed in, of URLs to file paths
+    * the index.jsonl of an archive made by RecordTransport
+    * the directory, by the last part of the URL's path (so a directory of
+      saved pages such as tests/html can be used directly)
+
+    URLs that aren't found get a 404 response.
+    """
+
+    def __init__(self, directory, mapping=None):
+        """Initialise class instance.
+
+        Arguments:
+            directory {str} -- archive or directory of html files
+            mapping {dict} -- Keyword argument, URLs and the path of the file
+            to serve for each (default: {None})
+        """
+        self.directory = directory
+        self._entries = {}
+
+        index_path = os.path.join(directory, 'index.jsonl')
+        if os.path.exists(index_path):
+            with open(index_path) as index:
+                for line in index:
+                    entry = json.loads(line)
+                    # later lines are newer recordings of the same page
+                    self._entries[entry['url']] = entry
+
+        for url, path in (mapping or {}).items():
+            self._entries[normalize_url(url)] = {'file': path, 'status': 200}
+
+    def get(self, url, headers=None, timeout=None):
+        entry = self._entries.get(normalize_url(url))
+        if entry is None:
+            path = urllib.parse.urlsplit(url).path
+            entry = {'file': os.path.basename(path), 'status': 200}
+
+        path = os.path.join(self.directory, entry['file'])
+        if not entry['file'] or not os.path.isfile(path):
+            return TransportResponse(url, 404, '')
+        with open(path, 'rb') as page:
+            content = page.read()
+        return TransportResponse(
+            url, entry['status'], content.decode('utf-8'),
+            entry.get('headers'), content=content,
+            )
+
+
+class TokenBucket():
+    """Token bucket rate limiter. Tokens are added at rate per second up to
+    burst; each acquire() takes one, sleeping until it is available. Callers
+    that have to wait reserve their token first, so they are served in
+    order.
+    """
+
+    def __init__(self, rate, burst=1):
+        """Initialise class instance.
+
+        Arguments:
+            rate {float} -- tokens added per second
+            burst {int} -- Keyword argument, maximum tokens held at once
+            (default: {1})
+
+        Raises:
+            ValueError: Exception generated if rate or burst isn't positive
+        """
+        if rate <= 0 or burst <= 0:
+            raise ValueError('rate and burst must be positive')
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class AdaptiveWindow():
+    """Limits how many requests are in flight at once, adjusting the limit
+    from the responses (additive increase, multiplicative decrease). The
+    limit is halved when the server throttles (429 or 503), and grows by
+    about one per window of responses that come back within
+    latency_target seconds.
+    """
+
+    def __init__(self, maximum, minimum=1, latency_target=2.0):
+        """Initialise class instance.
+
+        Arguments:
+            maximum {int} -- largest limit, and the starting limit
+            minimum {int} -- Keyword argument, smallest limit (default: {1})
+            latency_target {float} -- Keyword argument, responses slower
+            than this many seconds don't grow the limit (default: {2.0})
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.latency_target = latency_target
+        self.limit = float(maximum)
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Waits until a request can be started under the current limit.
+        """
+        with self._condition:
+            while self.active >= int(self.limit):
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, latency, throttled=False):
+        """Marks a request as finished and adjusts the limit.
+
+        Arguments:
+            latency {float} -- seconds the request took
+            throttled {bool} -- Keyword argument, True if the server asked
+            us to slow down (default: {False})
+        """
+        with self._condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif latency <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class FetchStats():
+    """Counts the requests made by a Fetcher. Safe to update from several
+    threads. Counts are also passed on to the module's instruments.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.cache_hits = 0
+        self.bytes = 0
+        self.started = None
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        """Adds to the named counters, e.g. add(requests=1, bytes=500).
+        """
+        with self._lock:
+            if self.started is None:
+                self.started = time.monotonic()
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+        for name, count in counts.items():
+            instruments.count(name, count)
+
+    def requests_per_second(self):
+        """Returns the requests made per second since the first one.
+        """
+        with self._lock:
+            if self.started is None:
+                return 0.0
+            elapsed = time.monotonic() - self.started
+        return self.requests / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        counts = {
+            name: getattr(self, name) for name in (
+                'requests', 'retries', 'throttled', 'failures',
+                'cache_hits', 'bytes',
+                )}
+        counts['requests_per_second'] = self.requests_per_second()
+        return counts
+
+
+class Fetcher():
+    """Fetches the web pages for protected matters through a Transport,
+    running fetches concurrently on a bounded pool of worker threads. The
+    default HttpTransport keeps one pooled HTTP session, so keep-alive
+    connections are reused between pages. A single Fetcher is shared by a
+    Report and all of the ProtectedMatter objects it creates. If the Fetcher
+    has a PageCache, pages are read from it and fetched pages are saved to
+    it.
+
+    Requests that fail to connect, time out or get a 429 or 5xx status are
+    retried with jittered exponential backoff (or after the server's
+    Retry-After). The number of requests in flight is set by an
+    AdaptiveWindow, which backs off when the server throttles, and requests
+    to each host can be limited to a rate by a TokenBucket. Counts of what
+    was fetched are kept in stats.
+    """
+
+    # Statuses worth retrying, the first two also mean the server is
+    # throttling us
+    THROTTLE_STATUSES = (429, 503)
+    RETRY_STATUSES = (429, 503, 500, 502, 504)
+
+    def __init__(self, max_workers=8, timeout=30, cache=None,
+                 transport=None, retries=3, backoff=0.5, rate_limit=None,
+                 latency_target=2.0):
+        """Initialise class instance.
+
+        Arguments:
+            max_workers {int} -- Keyword argument, maximum number of pages
+            fetched at the same time (default: {8})
+            timeout {int} -- Keyword argument, seconds to wait for a
+            response before giving up (default: {30})
+            cache {PageCache} -- Keyword argument, cache for fetched pages
+            (default: {None})
+            transport {Transport} -- Keyword argument, how pages are fetched
+            (default: {HttpTransport(pool_size=max_workers)})
+            retries {int} -- Keyword argument, times a failed request is
+            retried (default: {3})
+            backoff {float} -- Keyword argument, seconds before the first
+            retry, doubled for each retry after (default: {0.5})
+            rate_limit {float} -- Keyword argument, maximum requests per
+            second to each host, None for no limit (default: {None})
+            latency_target {float} -- Keyword argument, response time in
+            seconds below which the number of requests in flight is allowed
+            to grow (default: {2.0})
+
+        Raises:
+            ValueError: Exception generated if max_workers is less than 1
+        """
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = cache
+        self.transport = transport or HttpTransport(pool_size=max_workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limit = rate_limit
+        self.window = AdaptiveWindow(
+            max_workers, latency_target=latency_target,
+            )
+        self.stats = FetchStats()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Fetches url and returns the text of the page. A fresh page in the
+        cache is returned without a request. A stale one is revalidated with
+        a conditional request and reused if the server answers 304 Not
+        Modified.
+
+        Arguments:
+            url {str} -- URL of the page to fetch
+
+        Raises:
+            requests.HTTPError: Exception generated if the server returns an
+            error status
+        """
+        page = None
+        headers = {}
+
+        if self.cache is not None:
+            page = self.cache.get(url)
+            if page is not None:
+                if self.cache.is_fresh(page):
+                    self.stats.add(cache_hits=1)
+                    return page.text
+                if page.etag:
+                    headers['If-None-Match'] = page.etag
+                if page.last_modified:
+                    headers['If-Modified-Since'] = page.last_modified
+
+        try:
+            response = self._request(url, headers)
+        except requests.RequestException:
+            self.stats.add(failures=1)
+            raise
+
+        if page is not None and response.status_code == 304:
+            self.cache.touch(url)
+            self.stats.add(cache_hits=1)
+            return page.text
+
+        if response.status_code >= 400:
+            self.stats.add(failures=1)
+        response.raise_for_status()
+
+        if self.cache is not None:
+            self.cache.put(
+                url,
+                response.text,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                )
+        return response.text
+
+    def _request(self, url, headers):
+        """Gets url through the transport, waiting for the rate limit and
+        the adaptive window, and retrying connection errors, timeouts and
+        retryable statuses. Returns the last response, or raises the last
+        connection error if every attempt failed to connect.
+        """
+        bucket = self._bucket(url)
+
+        for attempt in range(self.retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+            self.window.acquire()
+            start = time.monotonic()
+            response = error = None
+            try:
+                response = self.transport.get(
+                    url, headers=headers, timeout=self.timeout
+                    )
+            except (requests.ConnectionError, requests.Timeout) as caught:
+                error = caught
+            finally:
+                throttled = response is not None and \
+                    response.status_code in self.THROTTLE_STATUSES
+                self.window.release(
+                    time.monotonic() - start, throttled=throttled,
+                    )
+
+            self.stats.add(
+                requests=1,
+                throttled=int(throttled),
+                bytes=len(response.content) if response is not None else 0,
+                )
+
+            if response is not None and \
+                    response.status_code not in self.RETRY_STATUSES:
+                return response
+            if attempt == self.retries:
+                if response is None:
+                    raise error
+                return response
+
+            self.stats.add(retries=1)
+            time.sleep(self._retry_delay(attempt, response))
+
+    def _retry_delay(self, attempt, response):
+        """Returns the seconds to wait before retrying. Uses the
+        Retry-After header if the server sent one in seconds, otherwise
+        exponential backoff with random jitter.
+        """
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), 60.0)
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def _bucket(self, url):
+        """Returns the TokenBucket for the host of url, or None if requests
+        aren't rate limited.
+        """
+        if self.rate_limit is None:
+            return None
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate_limit)
+            return self._buckets[host]
+
+    def map(self, func, iterable):
+        """Calls func on every item of iterable using up to max_workers
+        threads. Results are returned as a list in the same order as
+        iterable, whatever order the fetches finish in.
+
+        Arguments:
+            func {callable} -- function taking a single item
+            iterable {iterable} -- items to pass to func
+        """
+        items = list(iterable)
+
+        if self.max_workers == 1 or len(items) < 2:
+            return [func(item) for item in items]
+
+        with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(items))
+                ) as executor:
+            return list(executor.map(func, items))
+
+    def close(self):
+        """Closes the transport, and with it any pooled connections.
+        """
+        self.transport.close()
+
+
+class _HeaderScanner():
+    """Collects the header fields of a PMST report (buffer, coordinates,
+    date, email and URLs) from the report's span and a tags, which are fed
+    to it one at a time in document order. Used so the report only has to be
+    walked once, whether it comes from a BS4 object or a streaming parser.
+    """
+
+    # Labels are plain substrings, checked with "in" before any regex runs
+    # as most spans in a report are long tables of species names
+    BUFFER_LABEL = 'Buffer:'
+    DATE_LABEL = 'Report created:'
+    COORD_STRING_RE = re.compile(r"[-+]?\d*\.\d+ [-+]?\d*\.\d+")
+    EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+    NUMBER_RE = re.compile(r"[-+]?\d*\.\d+|\d+")
+    DATE_RE = re.compile(r"\d{1,2}/\d{1,2}/\d{2}")
+
+    def __init__(self):
+        self.buffer_string = None
+        self.coord_string = None
+        self.date_string = None
+        self.email = None
+        self.urls = set()
+
+    def feed(self, tag_name, text, href=None):
+        """Checks one tag against the header fields. Only the first match for
+        each field is kept.
+
+        Arguments:
+            tag_name {str} -- name of the tag ("span" or "a")
+            text {str} -- text of the tag if it only contains a string,
+            otherwise None
+            href {str} -- Keyword argument, href of an a tag
+        """
+        if tag_name == "a":
+            if href is not None:
+                self.urls.add(href)
+                if self.email is None and href.startswith("mailto:"):
+                    self.email = href[len("mailto:"):]
+            return
+
+        if text is None:
+            return
+
+        if self.buffer_string is None and self.BUFFER_LABEL in text:
+            self.buffer_string = text
+        elif self.date_string is None and self.DATE_LABEL in text:
+            self.date_string = text
+        elif (self.coord_string is None and '.' in text
+                and self.COORD_STRING_RE.search(text)):
+            self.coord_string = text
+        elif self.email is None and '@' in text:
+            email = self.EMAIL_RE.search(text)
+            if email:
+                self.email = email.group()
+
+
+def _element_string(element):
+    """Returns the text of an lxml element in the same way as the string
+    attribute of a BS4 tag: the text if the element only contains text, the
+    string of its child if it only contains one element, otherwise None.
+    """
+    children = list(element)
+    if not children:
+        return element.text
+    if len(children) == 1 and element.text is None \
+            and children[0].tail is None:
+        return _element_string(children[0])
+    return None
+
+
+class _TableScanner():
+    """Reads the species, community and KEF tables of a PMST report. The
+    report lists each threatened community and each threatened, migratory,
+    marine and cetacean species with its category and type of presence,
+    which is all Biota and Tec read from SPRAT, and each KEF with the region
+    it is in, so the lists can be built without any requests. KEF names are
+    cut short in the report, as they are in the PDF (see _PdfScanner).
+
+    Cells are fed in document order: the text of each link with its href,
+    and the text of each span that isn't inside a link. Section headings are
+    recognised from the report's table of contents, whose links give the
+    name of every section present.
+    """
+
+    # Section of the report each kind of table is in. Headings are matched
+    # in lower case, as the table of contents doesn't always use the same
+    # capitals as the heading
+    SECTION_DICT = {
+        'listed threatened ecological communities': 'tec',
+        'listed threatened species': 'threatened',
+        'listed migratory species': 'migratory',
+        'listed marine species': 'marine',
+        'whales and other cetaceans': 'cetacean',
+        'key ecological features (marine)': 'kef',
+    }
+    # Column headings, repeated at the top of every page of a table
+    HEADINGS = frozenset(['Name', 'Status', 'Threatened', 'Type of Presence',
+                          'Region'])
+    # Ends every complete type of presence. Cells split over two pages are
+    # joined back together
+    PRESENCE_END = 'within area'
+    COMMON_NAME_RE = re.compile(r'\s*\[\d+\]$')
+
+    def __init__(self, species_categories, community_categories):
+        """Initialise class instance.
+
+        Arguments:
+            species_categories {list} -- threatened categories for species
+            community_categories {list} -- threatened categories for TECs
+        """
+        self.species_categories = frozenset(species_categories)
+        self.community_categories = frozenset(community_categories)
+        self.sections = set()
+        self.section = None
+        # Fields of each species, community and KEF by ID, in the order
+        # they are first listed
+        self.species = {}
+        self.communities = {}
+        self.kefs = {}
+        self._current = None
+
+    def feed(self, text, href=None):
+        """Reads one cell of the report.
+
+        Arguments:
+            text {str} -- text of the link or span, or None if it doesn't
+            only contain a string
+            href {str} -- Keyword argument, href of the link
+        """
+        if text is None:
+            return
+        text = ' '.join(text.split())
+        if not text:
+            return
+
+        if href is not None:
+            if href.startswith('#'):
+                self.sections.add(text.rstrip(':').lower())
+                return
+            if self.section is not None:
+                self._feed_link(text, href)
+            return
+
+        if text.lower() in self.sections:
+            self.section = self.SECTION_DICT.get(text.lower())
+            self._current = None
+        elif self._current is not None and text not in self.HEADINGS:
+            self._feed_cell(text)
+
+    def _feed_link(self, text, href):
+        kind, key, url = Report._URL_ROUTER.route(href)
+        if self.section == 'tec':
+            if kind != 'tec':
+                return
+            if key not in self.communities:
+                self._current = self.communities[key] = {
+                    'name': text, 'category': None, 'url': url,
+                    'presence': None,
+                    }
+            elif self._current is self.communities[key]:
+                self._feed_cell(text)
+        elif self.section == 'kef':
+            if kind != 'kef':
+                self._current = None
+            elif key not in self.kefs:
+                self._current = self.kefs[key] = {
+                    'name': text, 'bioregion': None, 'url': url,
+                    }
+        elif kind == 'biota':
+            fields = self.species.get(key)
+            if fields is None:
+                fields = self.species[key] = {
+                    'sprat_id': key, 'common_name': None,
+                    'scientific_name': text, 'category': None,
+                    'migratory': False, 'marine': False, 'cetacean': False,
+                    'url': url, 'presence': None,
+                    }
+            if self.section != 'threatened':
+                fields[self.section] = True
+            self._current = fields
+        else:
+            self._current = None
+
+    def _feed_cell(self, text):
+        """Fills in the next empty field of the current species or community
+        from one cell of its row.
+        """
+        fields = self._current
+        if 'bioregion' in fields:
+            if fields['bioregion'] is None:
+                fields['bioregion'] = (text,)
+            return
+        if 'sprat_id' in fields:
+            if self.COMMON_NAME_RE.search(text):
+                if fields['common_name'] is None:
+                    fields['common_name'] = self.COMMON_NAME_RE.sub('', text)
+                return
+            categories = self.species_categories
+        else:
+            categories = self.community_categories
+
+        # Species listed under a different scientific name on the EPBC Act
+        # have their category marked with an asterisk
+        category = text.rstrip('*')
+        presence = fields['presence']
+        if category in categories:
+            if fields['category'] is None:
+                fields['category'] = category
+        elif presence is None:
+            fields['presence'] = text
+        elif not presence.endswith(self.PRESENCE_END):
+            fields['presence'] = presence + ' ' + text
+
+    def biota_records(self):
+        """Returns a BiotaRecord for each species, in the order they are
+        first listed.
+        """
+        return [BiotaRecord(**fields) for fields in self.species.values()]
+
+    def tec_records(self):
+        """Returns a TecRecord for each community, in the order they are
+        listed.
+        """
+        return [TecRecord(**fields) for fields in self.communities.values()]
+
+    def kef_records(self):
+        """Returns a KefRecord for each KEF, with the region it is listed
+        under as its bioregion.
+        """
+        return [
+            KefRecord(fields['name'], fields['bioregion'] or (), fields['url'])
+            for fields in self.kefs.values()
+            ]
+
+
+def _pdf_page_range(file, start, stop):
+    """Returns the text fragments and link URIs of pages start to stop of a
+    PDF. Each fragment is (x, y, font size, text) with its position on the
+    page, as the order text is drawn in doesn't follow the layout. Runs in
+    the worker processes of read_pdf_pages().
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(file)
+    pages = []
+    for page in reader.pages[start:stop]:
+        fragments = []
+
+        def visit(text, cm, tm, font_dict, font_size):
+            text = text.strip()
+            if text:
+                fragments.append((
+                    tm[4] * cm[0] + tm[5] * cm[2] + cm[4],
+                    tm[4] * cm[1] + tm[5] * cm[3] + cm[5],
+                    font_size,
+                    text,
+                    ))
+
+        page.extract_text(visitor_text=visit)
+        uris = []
+        for annotation in page.get('/Annots') or ():
+            action = annotation.get_object().get('/A')
+            if action is not None and '/URI' in action:
+                uris.append(str(action['/URI']))
+        pages.append((fragments, uris))
+    return pages
+
+
+# Fewest pages each process reads when a PDF is spread across processes.
+# Every process parses the file again and starting one costs about as much
+# as reading a few pages, so shorter PDFs are read in one process
+PDF_PAGES_PER_WORKER = 50
+
+
+def read_pdf_pages(file, max_workers=1):
+    """Returns the text fragments and link URIs of every page of a PDF (see
+    _pdf_page_range()). With more than one worker, pages are split into one
+    run of consecutive pages per process, so each process only opens the
+    file once. No more processes are started than there are CPUs, or than
+    give each at least PDF_PAGES_PER_WORKER pages.
+
+    Arguments:
+        file {str} -- path of the PDF
+        max_workers {int} -- Keyword argument, largest number of processes.
+        1 reads the pages in this process (default: {1})
     """
+    if (max_workers or 1) == 1 or (os.cpu_count() or 1) == 1:
+        return _pdf_page_range(file, 0, None)
 
-    _GEOM_TYPE_DICT = {
-        1: "Point",
-        2: "Line",
-        3: "Polygon",
-        4: "Undefined",
-    }
+    from pypdf import PdfReader
 
-    _COORD_TYPE_DICT = {
-        1: "Decimal degrees",
-        2: "Degrees minutes seconds",
-        3: "Undefined",
-    }
+    count = len(PdfReader(file).pages)
+    workers = max(1, min(max_workers, os.cpu_count(),
+                         count // PDF_PAGES_PER_WORKER))
+    if workers == 1:
+        return _pdf_page_range(file, 0, count)
 
-    def __init__(self, **kwargs):
-        self.name = None
-        self.coord_type = kwargs.get('coord_type', 3)
-        self.coord_list = None
-        self.geom_type = None
-        self.buffer = kwargs.get('buffer', 1)
-        self.email = kwargs.get('email', None)
+    bounds = [count * worker // workers for worker in range(workers + 1)]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers) as executor:
+        chunks = executor.map(
+            _pdf_page_range, [file] * workers, bounds[:-1], bounds[1:])
+        return [page for chunk in chunks for page in chunk]
 
-        # this doesn't seem very Pythonic, might be a better way to implement
-        # this
-        if 'geom_type' in kwargs:
-            self.set_geom_type(kwargs.get('geom_type'))
-        else:
-            self.geom_type = 4
 
-    def set_geom_type(self, geom_type):
-        """Sets the geometry type of the query (point, line, area). This can't
-        be derived from PMST report except for the cases where there is one
-        coordinate pair (geometry must be a point) or two coordinate pairs
-        (geometry must be a line). Any case where three or more pairs of
-        coordinates occur could be either a line or an area. Any case with two
-        or more pairs of coordinates can't be a point.
+class _PdfScanner():
+    """Reads the header fields and the protected matter tables of a PMST
+    report saved as a PDF, from the text fragments of each page.
+
+    The PDF has no links to SPRAT, so rows are put back together from the
+    layout: fragments on the same line are split into the columns of the
+    table's heading row (Name, Status, Type of Presence, ...), and cells
+    that wrap onto several lines are joined. A species row starts with its
+    scientific name on a line of its own, followed by its common names and
+    SPRAT ID in brackets, from which its SPRAT URL is made. Communities, KEFs
+    and heritage places have no ID in the PDF, so their records have no URL.
+    """
+
+    # Ends the heading of every section of the report
+    SECTION_END = '[ Resource Information ]'
+    SECTION_DICT = dict(_TableScanner.SECTION_DICT, **{
+        'world heritage properties': 'heritage',
+        'national heritage properties': 'heritage',
+        'national heritage places': 'heritage',
+        'commonwealth heritage places': 'heritage',
+    })
+    # Type of heritage place listed in each heritage section, as a key of
+    # Heritage.HERITAGE_TYPE_DICT
+    HERITAGE_TYPE_DICT = {
+        'world heritage properties': 1,
+        'national heritage properties': 2,
+        'national heritage places': 2,
+        'commonwealth heritage places': 3,
+    }
+    # Field each column heading holds
+    COLUMN_DICT = {
+        'Name': 'name',
+        'Status': 'status',
+        'Threatened': 'status',
+        'Type of Presence': 'presence',
+        'State': 'state',
+        'Region': 'region',
+    }
+    HERITAGE_CATEGORIES = frozenset(['Natural', 'Historic', 'Indigenous'])
+    SPECIES_KINDS = frozenset(['threatened', 'migratory', 'marine',
+                               'cetacean'])
+    SPRAT_ID_RE = re.compile(r'\[(\d+)\]$')
+    SPECIES_URL = ('http://www.environment.gov.au/cgi-bin/sprat/public/'
+                   'publicspecies.pl?taxon_id={0}')
+    # Fragments less than this far apart vertically are on the same line
+    LINE_TOLERANCE = 2.0
+
+    def __init__(self, species_categories, community_categories):
+        """Initialise class instance.
+
+        Arguments:
+            species_categories {list} -- threatened categories for species
+            community_categories {list} -- threatened categories for TECs
         """
-        if geom_type in self._GEOM_TYPE_DICT:
-            self.geom_type = geom_type
-        else:
-            raise ValueError('geom_type out of range')
+        self.species_categories = frozenset(species_categories)
+        self.community_categories = frozenset(community_categories)
+        self.header = _HeaderScanner()
+        self.heading = None
+        self.section = None
+        # Columns of the current table as (x, field), and the font size of
+        # its rows. Lines in any other size end the table
+        self._columns = None
+        self._font_size = None
+        self._row = None
+        self._pending = []
+        self._heritage_category = None
+        self.rows = {kind: [] for kind in ('species', 'tec', 'kef',
+                                           'heritage')}
 
-    def set_coord_type(self, coord_type):
-        """Sets the coordinate type for the query. Used when querying the PMST
-        report page.
+    def feed_page(self, fragments, uris=()):
+        """Reads one page of the report.
 
         Arguments:
-            coord_type {str} -- coordinate type from class variable
-            _COORD_TYPE_DICT
+            fragments {list} -- (x, y, font size, text) of each fragment
+            uris {list} -- Keyword argument, URIs of the links on the page
+        """
+        for uri in uris:
+            self.header.feed("a", None, uri)
+        for line in self._lines(fragments):
+            for fragment in line:
+                self.header.feed("span", fragment[3])
+            self._feed_line(line)
 
-        Raises:
-            ValueError: Exception generated if coord_type argument is not a
-            value within _COORD_TYPE_DICT
+    def _lines(self, fragments):
+        """Groups fragments into lines from the top of the page down, each
+        sorted left to right.
         """
+        line = []
+        for fragment in sorted(fragments, key=lambda item: -item[1]):
+            if line and line[0][1] - fragment[1] > self.LINE_TOLERANCE:
+                yield sorted(line)
+                line = []
+            line.append(fragment)
+        if line:
+            yield sorted(line)
 
-        if coord_type in self._COORD_TYPE_DICT:
-            self.coord_type = coord_type
+    def _feed_line(self, line):
+        texts = [fragment[3] for fragment in line]
+        if texts[-1] == self.SECTION_END:
+            self._end_row()
+            self.heading = ' '.join(' '.join(texts[:-1]).split()).lower()
+            self.section = self.SECTION_DICT.get(self.heading)
+            self._columns = None
+            self._heritage_category = None
+            return
+        if self.section is None:
+            return
+
+        if texts[0] == 'Name' and all(text in self.COLUMN_DICT
+                                      for text in texts):
+            self._columns = [(fragment[0], self.COLUMN_DICT[fragment[3]])
+                             for fragment in line]
+            self._font_size = line[0][2]
+            return
+        if self._columns is None:
+            return
+        if any(fragment[2] != self._font_size for fragment in line):
+            self._end_row()
+            self.section = None
+            return
+
+        cells = {}
+        for x, _, _, text in line:
+            field = self._columns[0][1]
+            for column_x, column_field in self._columns:
+                if column_x <= x + self.LINE_TOLERANCE:
+                    field = column_field
+            cells.setdefault(field, []).append(text)
+        cells = {field: ' '.join(parts) for field, parts in cells.items()}
+
+        if self.section in self.SPECIES_KINDS:
+            self._feed_species(cells)
         else:
-            raise ValueError('coord_type out of range')
+            self._feed_place(cells)
 
-    def set_coord_list(self, coord_list):
+    def _feed_species(self, cells):
+        row = self._row
+        if row is not None and not self.SPRAT_ID_RE.search(row['name']):
+            # Common names and presence wrapping onto the next line
+            self._extend(row, cells)
+        elif set(cells) == {'name'}:
+            # Scientific name of the next row, or a group such as "Birds"
+            self._pending.append(cells['name'])
+        elif 'name' in cells:
+            scientific_name = self._pending[-1] if self._pending else None
+            self._end_row()
+            self._row = dict(cells, kind=self.section,
+                             scientific_name=scientific_name)
+        elif row is not None:
+            # Presence continued at the top of the next page
+            self._extend(row, cells)
+        self._pending = self._pending if set(cells) == {'name'} else []
 
-        def _check_coord_pair(coords):
-            """Coords must be a pair. Lat must be in first position of coords pair
-            and must be between -70 and -5. Long must be in second position and
-            must be between 65 and 180
-            """
+    def _feed_place(self, cells):
+        if set(cells) - {'name', 'presence'}:
+            self._end_row()
+            self._row = dict(cells, kind=self.section,
+                             heading=self.heading,
+                             category=self._heritage_category)
+        elif (self.section == 'heritage'
+                and cells.get('name') in self.HERITAGE_CATEGORIES):
+            self._end_row()
+            self._heritage_category = cells['name']
+        elif self._row is not None:
+            self._extend(self._row, cells)
 
-            if len(coords) != 2:
-                raise ValueError('Coordinates must be a pair of numbers')
+    @staticmethod
+    def _extend(row, cells):
+        for field, text in cells.items():
+            row[field] = row[field] + ' ' + text if row.get(field) else text
 
-            if not -70 < coords[0] < -5:
-                raise ValueError('Latitude out of range')
+    def _end_row(self):
+        if self._row is not None:
+            kind = self._row['kind']
+            if kind in self.SPECIES_KINDS:
+                kind = 'species'
+            self.rows[kind].append({
+                field: ' '.join(value.split())
+                if isinstance(value, str) else value
+                for field, value in self._row.items()
+                })
+        self._row = None
+        self._pending = []
 
-            if not 65 < coords[1] < 180:
-                raise ValueError('Longitude out of range')
+    def close(self):
+        """Finishes the last row. Called after the last page.
+        """
+        self._end_row()
 
-            return True
+    def biota_records(self):
+        """Returns a BiotaRecord for each species with a SPRAT ID, in the
+        order they are first listed, merged across the threatened,
+        migratory, marine and cetacean tables as in _TableScanner.
+        """
+        species = {}
+        for row in self.rows['species']:
+            match = self.SPRAT_ID_RE.search(row['name'])
+            if match is None:
+                continue
+            sprat_id = int(match.group(1))
+            fields = species.get(sprat_id)
+            if fields is None:
+                fields = species[sprat_id] = {
+                    'sprat_id': sprat_id,
+                    'common_name': _TableScanner.COMMON_NAME_RE.sub(
+                        '', row['name']),
+                    'scientific_name': row['scientific_name'],
+                    'category': None, 'migratory': False, 'marine': False,
+                    'cetacean': False,
+                    'url': self.SPECIES_URL.format(sprat_id),
+                    'presence': row.get('presence'),
+                    }
+            if row['kind'] != 'threatened':
+                fields[row['kind']] = True
+            category = (row.get('status') or '').rstrip('*')
+            if fields['category'] is None \
+                    and category in self.species_categories:
+                fields['category'] = category
+        return [BiotaRecord(**fields) for fields in species.values()]
+
+    def tec_records(self):
+        """Returns a TecRecord for each community, in the order they are
+        listed.
+        """
+        return [
+            TecRecord(row.get('name'),
+                      row.get('status') if row.get('status')
+                      in self.community_categories else None,
+                      None, row.get('presence'))
+            for row in self.rows['tec']
+            ]
 
-        def _trim_coord_pair(coords):
-            """Trims coords to 5 places if the coord is a long float
-            Not yet implemented
-            """
-            pass
+    def kef_records(self):
+        """Returns a KefRecord for each KEF, with the region it is listed
+        under as its bioregion.
+        """
+        return [
+            KefRecord(row.get('name'),
+                      (row['region'],) if row.get('region') else (), None)
+            for row in self.rows['kef']
+            ]
 
-        if len(coord_list) < 150:
-            raise ValueError('coord_list must be <= 150')
+    def heritage_records(self):
+        """Returns a HeritageRecord for each heritage place, with its type
+        from the section it is listed in and its category from the group
+        (natural, historic or indigenous) it is listed under.
+        """
+        return [
+            HeritageRecord(
+                None, row.get('name'), row['category'],
+                Heritage.HERITAGE_TYPE_DICT.get(
+                    self.HERITAGE_TYPE_DICT.get(row['heading'])),
+                row.get('status'), None)
+            for row in self.rows['heritage']
+            ]
 
-        coord_list = []
 
-        for coords in coord_list:
-            if _check_coord_pair(coords):
-                coord_list.append(coords)
+MatterDiff = namedtuple('MatterDiff', ['added', 'removed', 'unchanged'])
 
-        self.coord_list = coord_list
 
-    def set_buffer(self, buffer):
-        """To do
+class ReportDiff():
+    """Differences between two PMST reports, e.g. the same project footprint
+    run again some months later. Created by Report.diff().
+
+    For each kind of protected matter, matters holds a MatterDiff of the
+    URLs added to, removed from and unchanged in the current report. Matters
+    are compared by their ID (see UrlRouter), so the same page linked in a
+    different way counts as unchanged.
+    """
+
+    def __init__(self, previous, current):
+        """Initialise class instance.
+
+        Arguments:
+            previous {Report} -- earlier report
+            current {Report} -- later report
         """
-        try:
-            buffer_string = self._soup.find(
-                        "span", text=re.compile(r'(Buffer:)')
-                    ).text
-        except ValueError:
-            print("No buffer found")
+        self.previous_file = previous.file
+        self.file = current.file
+        self.coords_changed = \
+            self._coords(previous) != self._coords(current)
+        self.buffer_changed = previous.buffer != current.buffer
+        self.matters = {}
+        for kind in Report._MATTER_DICT:
+            before = previous.url_buckets[kind]
+            after = current.url_buckets[kind]
+            self.matters[kind] = MatterDiff(
+                tuple(url for key, url in after.items() if key not in before),
+                tuple(url for key, url in before.items() if key not in after),
+                tuple(url for key, url in after.items() if key in before),
+                )
 
-        def find_buffer(string):
-            try:
-                result = re.search(r"[-+]?\d*\.\d+|\d+", string)
-                return result.group()
-            except ValueError:
-                print("No date found")
+    @staticmethod
+    def _coords(report):
+        return report.coords.tolist() if report.coords else []
 
-        try:
-            self.buffer = find_buffer(buffer_string)
-        except ValueError:
-            print("Buffer not set")
+    @property
+    def changed(self):
+        """True if the footprint or any protected matter has changed.
+        """
+        return self.coords_changed or self.buffer_changed or any(
+            diff.added or diff.removed for diff in self.matters.values()
+            )
+
+    def to_dict(self):
+        """Returns the differences as a dictionary of JSON serialisable
+        values, with the added and removed URLs and the number unchanged for
+        each kind of protected matter.
+        """
+        return {
+            'previous': self.previous_file,
+            'file': self.file,
+            'changed': self.changed,
+            'coords_changed': self.coords_changed,
+            'buffer_changed': self.buffer_changed,
+            'matters': {
+                kind: {
+                    'added': list(diff.added),
+                    'removed': list(diff.removed),
+                    'unchanged': len(diff.unchanged),
+                }
+                for kind, diff in self.matters.items()
+            },
+        }
 
 
 class Report():
@@ -149,36 +3183,410 @@ class Report():
         3: "Undefined",
     }
 
+    # Kinds of protected matter that can be fetched for a report, and the
+    # method that gets each of them
+    _MATTER_DICT = {
+        'kef': '_get_kefs',
+        'tec': '_get_tecs',
+        'biota': '_get_biota',
+        'heritage': '_get_heritage',
+    }
+
+    # Record class of each kind of protected matter, used to restore the
+    # lists from a snapshot
+    _RECORD_DICT = {
+        'kef': KefRecord,
+        'tec': TecRecord,
+        'biota': BiotaRecord,
+        'heritage': HeritageRecord,
+    }
+
+    _URL_ROUTER = UrlRouter()
+
+    # How protected matter pages are parsed, see ProtectedMatter.PARSERS
+    parser = 'soup'
+
+    # Records of protected matters shared between reports, see RecordCache
+    records = None
+
+    # Index of species and community records, see SpratIndex
+    index = None
+
+    # Tags the header is read from, all that is kept of the report when it
+    # isn't parsed in full
+    _PARSE_ONLY = ('span', 'a')
+
     def __init__(self, file, **kwargs):
         """Initialise class instance.
 
         Arguments:
-            file {html} -- HTML file containing PMST data
+            file {str} -- HTML or PDF file containing PMST data. A PDF
+            report is read with every protected matter list filled in from
+            its tables, see _read_pdf()
+            fetcher {Fetcher} -- Keyword argument, Fetcher used to get the
+            pages for protected matters. Defaults to the Fetcher shared by
+            all ProtectedMatter objects
+            max_workers {int} -- Keyword argument, maximum number of pages
+            fetched at the same time. Ignored if fetcher is passed
+            cache {PageCache} -- Keyword argument, cache for fetched pages.
+            Ignored if fetcher is passed
+            transport {Transport} -- Keyword argument, how pages are fetched,
+            e.g. a ReplayTransport to work offline. Ignored if fetcher is
+            passed
+            streaming {bool} -- Keyword argument, if True the report is read
+            with an incremental parser and no BS4 object is kept
+            (default: {False})
+            tables {bool} -- Keyword argument, if True the biota, TEC and KEF
+            lists are read from the tables in the report while it is parsed,
+            rather than fetched from SPRAT, so no requests are made for them
+            (default: {False})
+            snapshots {SnapshotCache} -- Keyword argument, cache of the
+            state extracted from reports. If it has a snapshot of this file
+            the report is loaded from it without being parsed, otherwise the
+            report is parsed and saved to it, and saved again whenever a
+            protected matter list is fetched (default: {None})
+            parser {str} -- Keyword argument, how protected matter pages are
+            parsed, one of ProtectedMatter.PARSERS. Unless it is "soup", the
+            BS4 object of the report only holds its span and a tags, or the
+            whole report if tables is True (default: {"soup"})
+            pdf_workers {int} -- Keyword argument, largest number of
+            processes the pages of a PDF report are read in, see
+            read_pdf_pages() (default: {1})
+            index {SpratIndex} -- Keyword argument, index of resolved
+            species and community records. Biota and TECs found in it are
+            used without fetching their page (default: {None})
+            records {RecordCache} -- Keyword argument, cache of protected
+            matter records by URL. Records found in it are used without
+            fetching their page, and records that are made are added to it
+            (default: {None})
+            fetch {iterable} -- Keyword argument, kinds of protected matter
+            from _MATTER_DICT to fetch when the report is created. Other
+            kinds are fetched the first time their list is used
+            (default: {()})
+
+        Raises:
+            ValueError: Exception generated if fetch contains a kind that
+            isn't in _MATTER_DICT, or parser isn't in ProtectedMatter.PARSERS
         """
+        self._configure(kwargs)
+        self.file = file
+
+        fetch = tuple(kwargs.get('fetch', ()))
+        self._check_kinds(fetch)
+
+        self._set_file_type(file)
+        if not self._load_snapshot():
+            if self.file_type == 1:
+                self._read_pdf(file)
+            elif self.streaming:
+                with instruments.timer('Report.stream'):
+                    self._stream_header(file)
+            else:
+                self._make_soup(file)
+                self._get_header()
+            self._save_snapshot()
+        if fetch:
+            self.prefetch(fetch)
+
+    def _configure(self, kwargs):
+        """Sets the report's options from the keyword arguments of
+        __init__() and its other attributes to their empty values.
+        """
+        self.parser = kwargs.get('parser', self.parser)
+        if self.parser not in ProtectedMatter.PARSERS:
+            raise ValueError(f'parser {self.parser!r} not recognised')
+
+        if 'fetcher' in kwargs:
+            self.fetcher = kwargs['fetcher']
+        elif {'max_workers', 'cache', 'transport'} & set(kwargs):
+            self.fetcher = Fetcher(
+                max_workers=kwargs.get('max_workers', 8),
+                cache=kwargs.get('cache', None),
+                transport=kwargs.get('transport', None),
+                )
+        else:
+            self.fetcher = ProtectedMatter.fetcher
+
         self.date = None
         self._soup = None
         self.buffer = None
-        self._coord_dict = None
+        self.coords = None
         self.file_type = None
         self.url_list = None
+        self.url_buckets = None
         self.kef_list = None
         self.park_list = None
         self.tec_list = None
         self.heritage_list = None
         self.biota_list = None
+        self.email = None
         self.description = None
+        self.failed_urls = {}
+        self.streaming = kwargs.get('streaming', False)
+        self.tables = kwargs.get('tables', False)
+        self.snapshots = kwargs.get('snapshots', None)
+        self.pdf_workers = kwargs.get('pdf_workers', 1)
+        self.records = kwargs.get('records', self.records)
+        self.index = kwargs.get('index', self.index)
+        self.file = None
+        self.tiles = None
+        self._snapshot_key = None
 
-        self._set_file_type(file)
-        self._make_soup(file)
-        self._get_buffer()
-        self._get_coords()
-        self._get_date()
-        self._get_urls()
-        # self._get_kefs() - works, commented to stop hitting site
-        # self._get_tecs()
-        # self._get_biota()
-        # self._get_parks()
-        self._get_heritage()
+        self._matter_locks = {
+            kind: threading.Lock() for kind in self._MATTER_DICT
+            }
+
+    def _matter_list(kind):
+        """Creates the property for a protected matter list. The list is
+        fetched by the kind's method in _MATTER_DICT the first time it is
+        read, then kept.
+        """
+        attribute = '_' + kind + '_list'
+
+        def get_list(self):
+            if getattr(self, attribute, None) is None:
+                with self._matter_locks[kind]:
+                    if getattr(self, attribute, None) is None:
+                        method = self._MATTER_DICT[kind]
+                        with instruments.timer(
+                                'Report.' + method.lstrip('_')):
+                            getattr(self, method)()
+                        self._save_snapshot()
+            return getattr(self, attribute)
+
+        def set_list(self, value):
+            setattr(self, attribute, value)
+
+        return property(
+            get_list,
+            set_list,
+            doc=f'Records of the {kind} protected matters in the report, '
+                f'fetched on first use.',
+            )
+
+    kef_list = _matter_list('kef')
+    tec_list = _matter_list('tec')
+    biota_list = _matter_list('biota')
+    heritage_list = _matter_list('heritage')
+    del _matter_list
+
+    @property
+    def migratory_list(self):
+        """Records of the listed migratory species in biota_list.
+        """
+        return [record for record in self.biota_list if record.migratory]
+
+    @property
+    def marine_list(self):
+        """Records of the listed marine species in biota_list.
+        """
+        return [record for record in self.biota_list if record.marine]
+
+    @property
+    def _coord_dict(self):
+        """The coordinate pairs as lists keyed by their position (from 1),
+        as they were stored before coords was a CoordArray.
+        """
+        return self.coords.to_dict() if self.coords else {}
+
+    def is_fetched(self, kind):
+        """Checks if the list for a kind of protected matter has already
+        been fetched.
+        """
+        return getattr(self, '_' + kind + '_list', None) is not None
+
+    def prefetch(self, kinds=None):
+        """Fetches the lists for several kinds of protected matter at once,
+        rather than waiting for each to be used. Kinds already fetched are
+        skipped. The kinds are fetched in parallel; the fetcher's adaptive
+        window still limits the requests in flight.
+
+        Arguments:
+            kinds {iterable} -- Keyword argument, kinds from _MATTER_DICT
+            (default: {all kinds})
+
+        Raises:
+            ValueError: Exception generated if kinds contains a kind that
+            isn't in _MATTER_DICT
+        """
+        kinds = tuple(self._MATTER_DICT if kinds is None else kinds)
+        self._check_kinds(kinds)
+        kinds = [kind for kind in kinds if not self.is_fetched(kind)]
+
+        if len(kinds) == 1:
+            getattr(self, kinds[0] + '_list')
+        elif kinds:
+            with ThreadPoolExecutor(max_workers=len(kinds)) as executor:
+                list(executor.map(
+                    lambda kind: getattr(self, kind + '_list'), kinds
+                    ))
+
+    def diff(self, previous, fetch=()):
+        """Compares the report with an earlier one, e.g. for the same
+        project footprint, and returns a ReportDiff of the coordinates,
+        buffer and protected matters. The protected matter lists for the
+        kinds in fetch are also resolved with reuse(), so only the matters
+        new in this report are fetched.
+
+        Arguments:
+            previous {Report} -- earlier report
+            fetch {iterable} -- Keyword argument, kinds of protected matter
+            from _MATTER_DICT to resolve (default: {()})
+
+        Raises:
+            ValueError: Exception generated if fetch contains a kind that
+            isn't in _MATTER_DICT
+        """
+        fetch = tuple(fetch)
+        self._check_kinds(fetch)
+        if fetch:
+            self.reuse(previous, kinds=fetch)
+        return ReportDiff(previous, self)
+
+    def reuse(self, previous, kinds=None):
+        """Sets the protected matter lists from the records already
+        fetched for an earlier report. Matters in both reports keep their
+        previous record and only the matters new in this report (or that
+        failed last time) are fetched. Kinds that haven't been fetched for
+        the previous report, or have already been fetched for this one, are
+        left alone.
+
+        Arguments:
+            previous {Report} -- earlier report
+            kinds {iterable} -- Keyword argument, kinds from _MATTER_DICT
+            (default: {all kinds})
+
+        Raises:
+            ValueError: Exception generated if kinds contains a kind that
+            isn't in _MATTER_DICT
+        """
+        kinds = tuple(self._MATTER_DICT if kinds is None else kinds)
+        self._check_kinds(kinds)
+        class_dict = {
+            'kef': Kef, 'tec': Tec, 'biota': Biota, 'heritage': Heritage,
+            }
+
+        for kind in kinds:
+            if not previous.is_fetched(kind):
+                continue
+            with self._matter_locks[kind]:
+                if self.is_fetched(kind):
+                    continue
+                # PDF reports have no URLs for most kinds, so their records
+                # can't be matched and are fetched again
+                record_dict = {
+                    self._URL_ROUTER.route(record.url)[1]: record
+                    for record in getattr(previous, kind + '_list')
+                    if record.url is not None
+                    }
+                bucket = self.url_buckets[kind]
+                new_urls = [
+                    url for key, url in bucket.items()
+                    if key not in record_dict
+                    ]
+                # _make_matters() leaves out URLs that failed, so match the
+                # new records to their keys by URL
+                new_dict = {
+                    self._URL_ROUTER.route(record.url)[1]: record
+                    for record in self._make_matters(
+                        class_dict[kind], new_urls)
+                    }
+                setattr(self, kind + '_list', [
+                    record_dict[key] if key in record_dict else new_dict[key]
+                    for key in bucket
+                    if key in record_dict or key in new_dict
+                    ])
+            self._save_snapshot()
+
+    @classmethod
+    def merge(cls, reports, coords=None, buffer=None, **kwargs):
+        """Returns one Report for the reports of the tiles of a query (see
+        Query.tile()). URLs are pooled and each protected matter is listed
+        once, matched by its ID (see UrlRouter), or by name if it has no
+        URL, keeping the first record found for it unless another has a more
+        certain type of presence (_PRESENCE_WORDS). Lists fetched for every
+        report are merged; the others are fetched for the merged URLs the
+        first time they are used. The merged report has no file; tiles holds
+        the file of each report.
+
+        Arguments:
+            reports {iterable} -- Report for each tile
+            coords {CoordArray} -- Keyword argument, coordinates of the whole
+            geometry (default: {None})
+            buffer {float} -- Keyword argument, buffer of the whole query.
+            Defaults to the largest buffer of the reports
+            kwargs -- Keyword arguments, options of the merged report, as
+            for Report(). The fetcher defaults to the first report's
+        """
+        reports = list(reports)
+        if reports and not {'fetcher', 'max_workers', 'cache',
+                            'transport'} & set(kwargs):
+            kwargs['fetcher'] = reports[0].fetcher
+        merged = cls.__new__(cls)
+        merged._configure(kwargs)
+        merged.tiles = [report.file for report in reports]
+        merged.coords = coords
+
+        buffers = [report.buffer for report in reports
+                   if report.buffer is not None]
+        merged.buffer = buffer if buffer is not None or not buffers \
+            else max(buffers)
+        dates = [report.date for report in reports if report.date]
+        merged.date = max(dates) if dates else None
+        merged.email = next(
+            (report.email for report in reports if report.email), None)
+
+        merged.url_list = sorted(
+            {url for report in reports for url in report.url_list or ()})
+        merged.url_buckets = cls._URL_ROUTER.classify(merged.url_list)
+        for report in reports:
+            merged.failed_urls.update(report.failed_urls)
+
+        for kind in cls._MATTER_DICT:
+            if reports and all(report.is_fetched(kind) for report in reports):
+                setattr(merged, kind + '_list', cls._merge_records(
+                    getattr(report, kind + '_list') for report in reports))
+        return merged
+
+    # Words in a type of presence, from most to least certain
+    _PRESENCE_WORDS = ('known', 'likely', 'may')
+
+    @classmethod
+    def _presence_rank(cls, record):
+        """Returns how certain the record's type of presence is, lowest
+        first. Records without one come last.
+        """
+        presence = (getattr(record, 'presence', None) or '').lower()
+        for rank, word in enumerate(cls._PRESENCE_WORDS):
+            if word in presence:
+                return rank
+        return len(cls._PRESENCE_WORDS)
+
+    @classmethod
+    def _merge_records(cls, record_lists):
+        """Returns the records in record_lists with each protected matter
+        once, in the order they were first found. See merge().
+        """
+        merged = {}
+        for records in record_lists:
+            for record in records:
+                if record.url:
+                    key = cls._URL_ROUTER.route(record.url)[:2]
+                elif isinstance(record, BiotaRecord):
+                    key = ('BiotaRecord', record.scientific_name)
+                else:
+                    key = (type(record).__name__, record.name)
+                kept = merged.get(key)
+                if kept is None or \
+                        cls._presence_rank(record) < cls._presence_rank(kept):
+                    merged[key] = record
+        return list(merged.values())
+
+    def _check_kinds(self, kinds):
+        for kind in kinds:
+            if kind not in self._MATTER_DICT:
+                raise ValueError(f'protected matter kind {kind!r} not '
+                                 'recognised')
 
     def _set_file_type(self, file):
         """Checks if the file is a PDF or a HTML
@@ -190,148 +3598,353 @@ class Report():
         else:
             raise ValueError('File extension must be html or PDF')
 
+    def to_dict(self):
+        """Returns the report as a dictionary of JSON serialisable values.
+        Protected matter lists that haven't been fetched are None, and
+        aren't fetched by this method.
+        """
+        def summaries(kind):
+            if not self.is_fetched(kind):
+                return None
+            return [
+                record._asdict()
+                for record in getattr(self, kind + '_list')
+                ]
+
+        return {
+            'file': self.file,
+            'date': self.date.isoformat() if self.date else None,
+            'buffer': self.buffer,
+            'coords': self.coords.tolist() if self.coords else [],
+            'email': self.email,
+            'biota': summaries('biota'),
+            'tec': summaries('tec'),
+            'kef': summaries('kef'),
+            'heritage': summaries('heritage'),
+            'failed_urls': self.failed_urls,
+        }
+
+    def _snapshot_state(self):
+        """Returns the state extracted from the report as plain values
+        (no records or datetimes), for saving in a SnapshotCache.
+        """
+        return {
+            'date': self.date.isoformat() if self.date else None,
+            'buffer': self.buffer,
+            'coords': self.coords.tolist() if self.coords else None,
+            'email': self.email,
+            'url_list': self.url_list,
+            'lists': {
+                kind: [tuple(record) for record in getattr(self, '_' + kind
+                                                           + '_list')]
+                for kind in self._MATTER_DICT if self.is_fetched(kind)
+                },
+            'failed_urls': dict(self.failed_urls),
+        }
+
+    def _restore_state(self, state):
+        """Sets the report's attributes from a state returned by
+        _snapshot_state().
+        """
+        self.date = (datetime.datetime.fromisoformat(state['date'])
+                     if state['date'] else None)
+        self.buffer = state['buffer']
+        self.coords = (CoordArray(state['coords'])
+                       if state['coords'] is not None else None)
+        self.email = state['email']
+        self.url_list = state['url_list']
+        self.url_buckets = self._URL_ROUTER.classify(self.url_list)
+        for kind, records in state['lists'].items():
+            record_class = self._RECORD_DICT[kind]
+            setattr(self, kind + '_list',
+                    [record_class(*record) for record in records])
+        self.failed_urls = state['failed_urls']
+
+    def _load_snapshot(self):
+        """Restores the report from its snapshot, if there is a snapshot
+        cache and it has one for the current contents of the file. Returns
+        True if the report was restored.
+        """
+        if self.snapshots is None:
+            return False
+        self._snapshot_key = self.snapshots.file_key(
+            self.file, tables=self.tables)
+        with instruments.timer('Report.snapshot'):
+            state = self.snapshots.get(self._snapshot_key)
+            if state is None:
+                instruments.count('snapshot_misses')
+                return False
+            self._restore_state(state)
+        instruments.count('snapshot_hits')
+        return True
+
+    def _save_snapshot(self):
+        """Saves the report's current state to the snapshot cache, if it
+        has one.
+        """
+        if self.snapshots is not None:
+            self.snapshots.put(
+                self._snapshot_key, self.file, self._snapshot_state())
+
     def _make_soup(self, file):
         """Creates BS4 object from html file
         """
         try:
-            with open(file) as html:
-                self._soup = BeautifulSoup(html, "lxml")
+            with instruments.timer('Report.read'):
+                with open(file) as html:
+                    text = html.read()
+            parse_only = None
+            if self.parser != 'soup' and not self.tables:
+                parse_only = bs4.SoupStrainer(self._PARSE_ONLY)
+            with instruments.timer('Report.soup'):
+                self._soup = bs4.BeautifulSoup(
+                    text, "lxml", parse_only=parse_only)
         except ValueError:
-            print("Unable to create BS4 object")
+            log.error("Unable to create BS4 object from %s", file)
+
+    def _get_header(self):
+        """Gets the buffer, coordinates, date, email and URLs from the BS4
+        object in one pass over its span and a tags, and sets them as
+        attributes on the class instance. Requires PMST report to have been
+        created for the Report object.
+        """
+        if not self._soup:
+            log.warning("_soup attribute for Report object does not exist.")
+            return None
 
-    def _get_buffer(self):
-        """Get the buffer from PMST and set the attribute on the class
-        instance
+        scanner = _HeaderScanner()
+        tables = self._table_scanner()
+        with instruments.timer('Report.header'):
+            # Walking descendants directly is several times faster than
+            # find_all() with a list of names
+            for tag in self._soup.descendants:
+                if tag.name == "span" or tag.name == "a":
+                    scanner.feed(tag.name, tag.string, tag.get("href"))
+                    if tables is not None:
+                        self._feed_tables(tables, tag.name, tag.string,
+                                          tag.get("href"), tag.parent)
+            self._set_header(scanner)
+            self._set_tables(tables)
+
+    def _stream_header(self, file):
+        """Gets the same fields as _get_header() straight from the file using
+        lxml's incremental parser, without creating a BS4 object. Elements
+        are cleared as soon as they have been read, so memory use doesn't
+        grow with the size of the report.
         """
-        try:
-            buffer_string = self._soup.find(
-                        "span", text=re.compile(r'(Buffer:)')
-                    ).text
-        except ValueError:
-            print("No buffer found")
+        scanner = _HeaderScanner()
+        tables = self._table_scanner()
+        # Number of span or a tags the parser is inside of. Elements inside
+        # them are kept until the outer tag has been read
+        inline_depth = 0
 
-        def find_buffer(string):
-            try:
-                result = re.search(r"[-+]?\d*\.\d+|\d+", string)
-                return float(result.group())
-            except ValueError:
-                print("No date found")
+        for event, element in etree.iterparse(
+                file, events=("start", "end"), html=True
+                ):
+            if element.tag == "span" or element.tag == "a":
+                if event == "start":
+                    inline_depth += 1
+                    continue
+                inline_depth -= 1
+                text = _element_string(element)
+                scanner.feed(element.tag, text, element.get("href"))
+                if tables is not None:
+                    self._feed_tables(tables, element.tag, text,
+                                      element.get("href"),
+                                      element.getparent())
+            elif event == "start":
+                continue
 
-        try:
-            self.buffer = find_buffer(buffer_string)
-        except ValueError:
-            print("Buffer not set")
+            if inline_depth == 0:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+        self._set_header(scanner)
+        self._set_tables(tables)
 
-    def _get_coords(self):
-        """Get coordinates from PMST and set the attribute on the class
-        instance
+    def _read_pdf(self, file):
+        """Gets the header fields and every protected matter list from a PDF
+        report, reading its pages across pdf_workers processes. The PDF has
+        no links to SPRAT, so species get their URL from the SPRAT ID listed
+        with them, and communities, KEFs and heritage places (listed without
+        an ID) have no URL. See _PdfScanner.
         """
-        coord_string = self._soup.find(
-                        "span", text=re.compile(r"[-+]?\d*\.\d+ [-+]?\d*\.\d+")
-                    ).text
+        with instruments.timer('Report.pdf'):
+            pages = read_pdf_pages(file, self.pdf_workers)
+        scanner = _PdfScanner(Biota.THREATENED_LIST, Tec.TEC_CAT_LIST)
+        with instruments.timer('Report.header'):
+            for fragments, uris in pages:
+                scanner.feed_page(fragments, uris)
+            scanner.close()
+            self.biota_list = scanner.biota_records()
+            self.tec_list = scanner.tec_records()
+            self.kef_list = scanner.kef_records()
+            self.heritage_list = scanner.heritage_records()
+            scanner.header.urls.update(
+                record.url for record in self.biota_list)
+            self._set_header(scanner.header)
 
-        coord_dict = {}
+    def _set_header(self, scanner):
+        """Sets the header attributes from a _HeaderScanner that has been fed
+        the report.
+        """
+        self.buffer = self._parse_buffer(scanner.buffer_string)
+        self.coords = self._parse_coords(scanner.coord_string)
+        self.date = self._parse_date(scanner.date_string)
+        self.email = scanner.email
+        self.url_list = sorted(scanner.urls)
+        self.url_buckets = self._URL_ROUTER.classify(self.url_list)
 
-        try:
-            coord_list = re.findall(r'[-+]?\d+.\d+', coord_string)
-            print(coord_list)
-
-            # empy list to append coordinates and make x,y pairs
-            coord_pair = []
-            # counter to serve as key in dict
-            key = 1
-
-            for coord in coord_list:
-                # adds a coordinate if the coord_pair list isn't full (i.e.
-                # length = 2)
-                if len(coord_pair) < 2:
-                    coord_pair.append(float(coord))
-                # If coord_pair list is a pair, add as value to the dict
-                # with key counter as key, empty the coord_pair list and
-                # increment the key counter. Finally add the coordinate to the
-                # empty list
-                elif len(coord_pair) == 2:
-                    coord_dict[key] = coord_pair
-                    coord_pair = []
-                    key += 1
-                    coord_pair.append(coord)
-                # add the final coor_pair list, as the loop doesn't catch this
-                # one
-                coord_dict[key] = coord_pair
-        except ValueError:
-            print("Nope")
+    def _table_scanner(self):
+        """Returns a _TableScanner if the lists are read from the report's
+        tables, otherwise None.
+        """
+        if not self.tables:
+            return None
+        return _TableScanner(Biota.THREATENED_LIST, Tec.TEC_CAT_LIST)
 
-        self._coord_dict = coord_dict
+    @staticmethod
+    def _feed_tables(tables, tag_name, text, href, parent):
+        """Feeds a span or a tag to a _TableScanner: links with their href,
+        and spans unless they are the text of a link.
+        """
+        if tag_name == "a":
+            if href is not None:
+                tables.feed(text, href)
+        elif parent is None or parent.get("href") is None:
+            tables.feed(text)
+
+    def _set_tables(self, tables):
+        """Sets the biota, TEC and KEF lists from a _TableScanner that has
+        been fed the report.
+        """
+        if tables is not None:
+            self.biota_list = tables.biota_records()
+            self.tec_list = tables.tec_records()
+            self.kef_list = tables.kef_records()
+
+    @staticmethod
+    def _parse_buffer(buffer_string):
+        """Returns the buffer in the "Buffer:" string as a float, or None if
+        there isn't one.
+        """
+        if buffer_string is None:
+            log.warning("No buffer found")
+            return None
+
+        result = _HeaderScanner.NUMBER_RE.search(buffer_string)
+        if result is None:
+            log.warning("Buffer not set from %r", buffer_string)
+            return None
+        return float(result.group())
 
-    def _get_date(self):
-        """Gets date the PMST report was generated. Date always comes in
-        DD/MM/YYYY HH:MM:SS format.
+    @staticmethod
+    def _parse_coords(coord_string):
+        """Returns a CoordArray of the coordinate pairs in coord_string, or
+        None if there are none.
         """
+        if coord_string is None:
+            log.warning("No coordinates found")
+            return None
+
         try:
-            date_string = self._soup.find(
-                        "span", text=re.compile(r'(Report created:)')
-                    ).text
+            return CoordArray.from_string(coord_string)
         except ValueError:
-            print("No report date found")
+            log.warning("Coordinates not set from %r", coord_string)
+            return None
 
-        def find_date(string):
-            try:
-                result = re.search(r"\d{1,2}/\d{1,2}/\d{2}", string)
-                return result.group()
-            except ValueError:
-                print("No date found")
+    @staticmethod
+    def _parse_date(date_string):
+        """Returns the date in the "Report created:" string as a datetime.
+        Date always comes in DD/MM/YY HH:MM:SS format.
+        """
+        if date_string is None:
+            log.warning("No report date found")
+            return None
 
+        result = _HeaderScanner.DATE_RE.search(date_string)
         try:
-            self.date = datetime.datetime.strptime(
-                find_date(date_string),
-                "%d/%m/%y",
-                )
-        except ValueError:
-            print("Date not set")
+            return datetime.datetime.strptime(result.group(), "%d/%m/%y")
+        except (AttributeError, ValueError):
+            log.warning("Date not set from %r", date_string)
+            return None
 
-    def _get_urls(self):
-        """Gets URLs from BS4 object. Requires PMST report to have been
-        created for the Report object.
+    def _make_matters(self, matter_class, url_list):
+        """Creates an instance of matter_class for each URL in url_list and
+        returns its record. The pages are fetched concurrently through the
+        report's fetcher and the returned list is in the same order as
+        url_list. Only the records are kept, so the parsed pages can be freed
+        as soon as each one has been read.
+
+        A URL that can't be fetched or read is left out of the list and
+        added to failed_urls with the error, rather than stopping the rest.
+        Records in the report's SpratIndex or RecordCache are looked up
+        first, in this thread, and only the other pages are fetched.
+
+        Arguments:
+            matter_class {class} -- ProtectedMatter subclass to create
+            url_list {list} -- URLs of the protected matters
         """
-        url_list = []
 
-        if not self._soup:
-            print("_soup attribute for Report object does not exist.")
+        stage = matter_class.__name__ + '.record'
+
+        def known_record(url):
+            if self.index is not None:
+                record = self.index.record_for(url)
+                if record is not None:
+                    instruments.count('index_hits')
+                    return record
+            if self.records is not None:
+                return self.records.get(url)
             return None
 
-        try:
-            for url in self._soup.find_all("a"):
-                if url.get("href") is None:
-                    pass
-                elif url.get("href") in url_list:
-                    pass
-                else:
-                    url_list.append(url.get("href"))
-            url_list.sort()
-            self.url_list = url_list
-        except ValueError:
-            print("Unable to get URLs from PMST report.")
+        def make_record(url):
+            try:
+                with instruments.timer(stage):
+                    record = matter_class(
+                        url=url, fetcher=self.fetcher, parser=self.parser,
+                        ).record()
+            except Exception as error:
+                instruments.count('matter_failures')
+                return error
+            if self.records is not None:
+                self.records.put(url, record)
+            return record
+
+        results = {}
+        if self.index is not None or self.records is not None:
+            for url in url_list:
+                record = known_record(url)
+                if record is not None:
+                    results[url] = record
+        missing = [url for url in url_list if url not in results]
+        results.update(zip(missing, self.fetcher.map(make_record, missing)))
+
+        record_list = []
+        for url in url_list:
+            result = results[url]
+            if isinstance(result, Exception):
+                self.failed_urls[url] = f'{type(result).__name__}: {result}'
+            else:
+                record_list.append(result)
+        return record_list
+
+    def _matter_urls(self, kind):
+        """Returns the URLs for one kind of protected matter from the
+        report's URL buckets, or an empty list if the report has no URLs.
+        """
+        if not self.url_buckets:
+            log.warning("URL list for report object does not exist. "
+                        "Unable to get %s URLs", kind)
+            return []
+        return list(self.url_buckets[kind].values())
 
     def _get_kefs(self):
         """Gets any Key Ecological Features that are in the PMST report url
         list, looks up the web page and the creates the KEF objects.
         """
-
-        kef_re_string = 'sprat-public/action/kef'
-        kef_list = []
-
-        if self.url_list:
-            kef_url_list = [
-                url for url in self.url_list if re.search(
-                    kef_re_string, url
-                    )]
-            for url in kef_url_list:
-                kef = Kef(url=url)
-                kef_list.append(kef)
-        else:
-            pass
-
-        self.kef_list = kef_list
+        self.kef_list = self._make_matters(Kef, self._matter_urls('kef'))
 
     def _get_parks(self):
         """Gets parks listed in the PMST report. Not yet implemented, no URLs
@@ -344,68 +3957,100 @@ class Report():
     def _get_tecs(self):
         """Gets TECs.
         """
-
-        tec_re_string = 'cgi-bin/sprat/public/publicshowcommunity'
-        tec_list = []
-
-        if self.url_list:
-            try:
-                tec_url_list = [
-                    url for url in self.url_list if re.search(
-                        tec_re_string, url
-                        )]
-                for url in tec_url_list:
-                    tec = Tec(
-                        url=url,
-                        )
-                    tec_list.append(tec)
-            except ValueError:
-                print("Unable to create TEC from URL list")
-        else:
-            print("URL list for report object does not exist. "
-                  "Unable to get TECs")
-
-        self.tec_list = tec_list
+        self.tec_list = self._make_matters(Tec, self._matter_urls('tec'))
 
     def _get_heritage(self):
         """Gets heritage places from the PMST report and created heritage
         objects.
         """
+        self.heritage_list = self._make_matters(
+            Heritage, self._matter_urls('heritage'),
+            )
 
-        heritage_re_string = "www.environment.gov.au/cgi-bin/ahdb/"
-        heritage_list = []
+    def _get_biota(self):
+        """Gets any species listed in SPRAT that are in the PMST report url
+        list, looks up the SPRAT page and creates the biota object. Each
+        species is fetched once, however many times it is linked.
+        """
+        self.biota_list = self._make_matters(
+            Biota, self._matter_urls('biota'),
+            )
 
-        try:
-            heritage_url_list = [
-                url for url in self.url_list if re.search(
-                    heritage_re_string, url
-                    )]
-            for url in heritage_url_list:
-                heritage = Heritage(
-                    url=url,
-                    )
-                heritage_list.append(heritage)
-        except ValueError:
-            print("Attribute url_list does not contain valid urls")
 
-        self.heritage_list = heritage_list
+ListingStatus = namedtuple(
+    'ListingStatus',
+    ['category', 'migratory', 'marine', 'cetacean'],
+    )
 
-    def _get_biota(self):
-        """Gets any species listed in SPRAT that are in the PMST report url
-        list, looks up the SPRAT page and creates the biota object. The
-        string the regex looks for is "sprat/public/publicspecies".
+
+class StatusClassifier():
+    """Reads the EPBC Act listing status of a species or community from the
+    text of its "EPBC Act Listing Status" cell. Every category and flag is
+    combined into one precompiled, case insensitive regex, so the text is
+    scanned once for all of them.
+    """
+
+    FLAG_DICT = {
+        'migratory': 'Listed migratory',
+        'marine': 'Listed marine',
+        'cetacean': 'Cetacean',
+    }
+
+    def __init__(self, categories):
+        """Initialise class instance.
+
+        Arguments:
+            categories {list} -- threatened categories in order of
+            precedence. Where a longer category contains a shorter one (e.g.
+            "Critically Endangered" and "Endangered") the longer one must
+            come first
         """
+        self.categories = list(categories)
+        self._label_dict = {}
+        patterns = []
 
-        if self.url_list:
-            biota_list = []
-            for url in self.url_list:
-                if re.search('/cgi-bin/sprat/public/publicspecies', url):
-                    biota = Biota(
-                        url=url,
-                    )
-                    biota_list.append(biota)
+        for label in self.categories + list(self.FLAG_DICT.values()):
+            self._label_dict[label.lower()] = label
+            patterns.append(r'\s+'.join(map(re.escape, label.split())))
+
+        # Alternatives are tried in list order at each position, so longer
+        # categories listed first win over the shorter ones they contain
+        self._regex = re.compile(
+            r'\b(?:' + '|'.join(patterns) + r')\b',
+            re.IGNORECASE,
+            )
+
+    def classify(self, text):
+        """Returns the ListingStatus found in text. If more than one
+        category is found the one first in the categories list is used.
+
+        Arguments:
+            text {str} -- text of the listing status cell
+        """
+        found = set()
+        for match in self._regex.finditer(text):
+            found.add(self._label_dict[' '.join(match.group().split()).lower()])
+
+        category = next(
+            (category for category in self.categories if category in found),
+            None,
+            )
+        return ListingStatus(
+            category,
+            *(label in found for label in self.FLAG_DICT.values())
+            )
 
-            self.biota_list = biota_list
+
+def _html_tree(text):
+    """Parses a page into an lxml tree with the same HTML parser BS4's "lxml"
+    builder uses.
+    """
+    try:
+        return etree.fromstring(text, etree.HTMLParser())
+    except ValueError:
+        # lxml won't parse a str that declares its own encoding
+        return etree.fromstring(
+            text.encode('utf-8'), etree.HTMLParser(encoding='utf-8'))
 
 
 class ProtectedMatter():
@@ -413,6 +4058,20 @@ class ProtectedMatter():
     report.
     """
 
+    # Fetcher used when one isn't passed in, shared by every instance so
+    # they all draw on the same connection pool
+    fetcher = Fetcher()
+
+    # How pages are parsed. "soup" builds a BS4 object of the whole page,
+    # "strainer" a BS4 object of only the _PARSE_ONLY tags, and "xpath"
+    # reads the fields straight from an lxml tree with _read_tree()
+    PARSERS = ('soup', 'strainer', 'xpath')
+    parser = 'soup'
+
+    # Tags (and their contents) the extractors read, kept by the strainer
+    # parser. None keeps the whole page
+    _PARSE_ONLY = None
+
     def __init__(self, **kwargs):
         """Dunder method to initialise the class. Can accept **kwargs.
         Recommend passing url as kwarg if available, as url is used to
@@ -421,18 +4080,75 @@ class ProtectedMatter():
         Arguments:
             name {str} -- Keyword argument, name of the Protected Matter
             url {str} -- Keyword argument, URL for the Protected Matter
+            fetcher {Fetcher} -- Keyword argument, Fetcher used to get the
+            html for the Protected Matter
+            parser {str} -- Keyword argument, one of PARSERS
+            (default: {"soup"})
 
         """
         self.name = None
         self.url = kwargs.get('url', None)
+        self.fetcher = kwargs.get('fetcher', self.fetcher)
+        self._set_parser(kwargs.get('parser', self.parser))
         self._soup = None
+        self._tree = None
         self._get_html()
 
+    def _set_parser(self, parser):
+        if parser not in self.PARSERS:
+            raise ValueError(f'parser {parser!r} not recognised')
+        self.parser = parser
+
     def _get_html(self):
-        response = requests.get(self.url)
-        response.raise_for_status()
-        self._soup = BeautifulSoup(response.text, "lxml")
-        print(f"Protected Matter added to object from url {self.url}")
+        name = type(self).__name__
+        with instruments.timer(name + '.fetch'):
+            text = self.fetcher.get(self.url)
+        with instruments.timer(name + '.parse'):
+            self._parse(text)
+        log.debug("Protected Matter added to object from url %s", self.url)
+
+    def _parse(self, text):
+        """Parses the page with the instance's parser, setting _soup, or
+        _tree for the xpath parser.
+        """
+        if self.parser == 'xpath':
+            self._tree = _html_tree(text)
+        elif self.parser == 'strainer' and self._PARSE_ONLY is not None:
+            self._soup = bs4.BeautifulSoup(
+                text, "lxml",
+                parse_only=bs4.SoupStrainer(self._PARSE_ONLY))
+        else:
+            self._soup = bs4.BeautifulSoup(text, "lxml")
+
+    def _read_tree(self):
+        """Reads the attributes from the lxml tree, for the xpath parser.
+        Gives the same values as the BS4 extractors. Implemented by
+        subclasses.
+        """
+        raise NotImplementedError
+
+    def _tree_listing_status(self):
+        """Returns the text of the EPBC Act listing status cell in the lxml
+        tree, or None if the page doesn't have one.
+        """
+        cells = self._tree.xpath(
+            '//th[.="EPBC Act Listing Status"]/following::td[1]')
+        return ' '.join(cells[0].itertext()) if cells else None
+
+    def _listing_status_cell(self):
+        """Returns the table cell holding the EPBC Act listing status, or
+        None if the page doesn't have one.
+        """
+        header = self._soup.find("th", string="EPBC Act Listing Status")
+        if header is None:
+            return None
+        return header.find_next("td")
+
+    def record(self):
+        """Returns the attributes read from the page as an immutable record.
+        Implemented by subclasses.
+        """
+        raise NotImplementedError
 
     def __str__(self):
         return "ProtectedMatter object\n  Name: {0}\n  URL: {1}".format(
@@ -461,16 +4177,31 @@ class Heritage(Place):
         3: "Commonwealth heritage place",
     }
 
-    def __init__(self, url):
+    _PARSE_ONLY = ('title',)
+
+    def __init__(self, url, **kwargs):
         self.name = None
+        self.fetcher = kwargs.get('fetcher', self.fetcher)
+        self._set_parser(kwargs.get('parser', self.parser))
         self.category = None  # category of heritage place
         self.type = None  # type of heritage place (e.g. national, world etc.)
         self.status = None  # status (listed, application etc.)
         self.id = None  # ID form the AHDB - 6 digit int - PK from DB?
         self.url = url
         self._soup = None
+        self._tree = None
         self._get_html()
 
+    def record(self):
+        return HeritageRecord(
+            self.id,
+            self.name,
+            self.category,
+            self.type,
+            self.status,
+            self.url,
+            )
+
 
 class Tec(Place):
     """Class for Threatened Ecological Communities (TECs).
@@ -485,28 +4216,43 @@ class Tec(Place):
         'Vulnerable',
     ]
 
-    def __init__(self, url):
-        super().__init__(url)
+    _CLASSIFIER = StatusClassifier(TEC_CAT_LIST)
+    _PARSE_ONLY = ('title', 'tr')
+
+    def __init__(self, url, **kwargs):
+        super().__init__(url=url, **kwargs)
         self.url = url
         self.category = None
-        self.get_name()
-        self.set_cat()
+        if self._tree is not None:
+            self._read_tree()
+        else:
+            self.get_name()
+            self.set_cat()
+
+    def _read_tree(self):
+        self.name = self._tree.findtext('.//title')
+        text = self._tree_listing_status()
+        self.category = None if text is None \
+            else self._CLASSIFIER.classify(text).category
 
     def get_name(self):
         self.name = self._soup.find(
             "title",
         ).text
 
+    def record(self):
+        return TecRecord(self.name, self.category, self.url)
+
     def set_cat(self):
-        for category in self.TEC_CAT_LIST:
-            regex = re.compile(category)
-            print(r"Searching for {0}".format(category))
-            if self._soup.find("td", text=regex):
-                self.category = category
-                print(r"Category set to {0}".format(self.category))
-                break
-            else:
-                print("No match for category found")
+        """Sets the category from the EPBC Act listing status cell.
+        """
+        cell = self._listing_status_cell()
+        if cell is None:
+            self.category = None
+        else:
+            self.category = self._CLASSIFIER.classify(
+                cell.get_text(" ")
+                ).category
 
 
 class Park(Place):
@@ -527,39 +4273,55 @@ class Kef(Place):
 
     """
 
+    _PARSE_ONLY = ('h1', 'a')
+
     def __init__(self, **kwargs):
         self.name = None
         self.html = None
+        self._soup = None
+        self._tree = None
         self.bioregion = []
         self.url_list = []
         self.url = kwargs.get('url', None)
+        self.fetcher = kwargs.get('fetcher', self.fetcher)
+        self._set_parser(kwargs.get('parser', self.parser))
         self._get_html()
-        self._get_name()
-        self._get_urls()
+        if self._tree is not None:
+            self._read_tree()
+        else:
+            self._get_name()
+            self._get_urls()
         self._get_bioregion()
 
     def _get_html(self):
-        response = requests.get(self.url)
-        response.raise_for_status()
-        self.html = BeautifulSoup(response.text, "lxml")
-        print("HTML added to KEF object")
+        with instruments.timer('Kef.fetch'):
+            text = self.fetcher.get(self.url)
+        with instruments.timer('Kef.parse'):
+            self._parse(text)
+        self.html = self._soup
+        log.debug("HTML added to KEF object from url %s", self.url)
+
+    def _read_tree(self):
+        headers = self._tree.xpath(
+            '//h1[contains(concat(" ", @class, " "), " header-all ")]')
+        self.name = ''.join(headers[0].itertext())
+        self.url_list = self._tree.xpath('//a/@href')
 
     def _get_urls(self):
-        url_list = []
-        for url in self.html.find_all("a"):
-            if url.get("href") is None:
-                pass
-            else:
-                url_list.append(url.get("href"))
-        self.url_list = url_list
+        self.url_list = [
+            url.get("href") for url in self.html.find_all("a", href=True)
+            ]
 
     def _get_name(self):
         self.name = self.html.find("h1", {"class": "header-all"}).text
 
     def _get_bioregion(self):
-        for url in self.url_list:
-            if re.search("topics/marine/marine-bioregional-plans?", url):
-                self.bioregion.append(url)
+        self.bioregion = list(
+            Report._URL_ROUTER.classify(self.url_list)['bioregion'].values()
+            )
+
+    def record(self):
+        return KefRecord(self.name, tuple(self.bioregion), self.url)
 
     def __str__(self):
         return 'Name: {0}, Bioregion: {1}, URL: {2}'.format(
@@ -583,9 +4345,13 @@ class Biota(ProtectedMatter):
         "Conservation Dependent",
         ]
 
+    _CLASSIFIER = StatusClassifier(THREATENED_LIST)
+    _PARSE_ONLY = ('title', 'tr')
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.sprat_id = None
+        self.category = None
         self.threatened = None
         self.migratory = None
         self.marine = None
@@ -594,13 +4360,38 @@ class Biota(ProtectedMatter):
         self.listing_advice = None
         self.recovery_plan = None
         self.set_sprat_id()
-        self.set_epbc_status_list()
-        self.get_common_name()
-        self.get_scientific_name()
-        self.set_cat()
-        self.set_migratory()
-        self.set_cetacean()
-        self.set_marine()
+        if self._tree is not None:
+            self._read_tree()
+        else:
+            self.set_epbc_status_list()
+            self.get_common_name()
+            self.get_scientific_name()
+        self.set_status()
+
+    def _read_tree(self):
+        self.common_name = self._tree.findtext('.//title')
+        text = self._tree_listing_status()
+        self.epbc_status_list = [] if text is None else [text]
+        names = self._tree.xpath('//th[.="Scientific name"]/following::i[1]')
+        name = names[0]
+        # Same strings as the contents of the BS4 tag: its text, then each
+        # child as markup followed by its tail
+        self.scientific_name = ([name.text] if name.text else []) + [
+            etree.tostring(child, encoding=str, method='html')
+            for child in name
+            ]
+
+    def record(self):
+        return BiotaRecord(
+            self.sprat_id,
+            self.common_name,
+            ''.join(str(name) for name in self.scientific_name).strip(),
+            self.category,
+            self.migratory,
+            self.marine,
+            self.cetacean,
+            self.url,
+            )
 
     def get_common_name(self):
         self.common_name = self._soup.find(
@@ -609,13 +4400,10 @@ class Biota(ProtectedMatter):
 
     def set_sprat_id(self):
         self.sprat_id = int(self.url.split("=")[1])
-        print(self.sprat_id)
 
     def set_epbc_status_list(self):
-        self.epbc_status_list = self._soup.find(
-            "th",
-            text="EPBC Act Listing Status",
-            ).find_next("td").contents
+        cell = self._listing_status_cell()
+        self.epbc_status_list = [] if cell is None else cell.contents
 
     def get_scientific_name(self):
         self.scientific_name = self._soup.find(
@@ -623,29 +4411,890 @@ class Biota(ProtectedMatter):
             text='Scientific name',
             ).find_next("i").contents
 
-    def set_migratory(self):
-        for status in self.epbc_status_list:
-            if 'Listed migratory' in status.__str__():
-                self.migratory = True
-            else:
-                self.migratory = False
+    def set_status(self):
+        """Sets category, migratory, marine and cetacean from a single scan
+        of the EPBC Act listing status.
+        """
+        text = " ".join(
+            status if isinstance(status, str) else status.get_text(" ")
+            for status in self.epbc_status_list
+            )
+        (self.category, self.migratory, self.marine,
+         self.cetacean) = self._CLASSIFIER.classify(text)
+
+
+def iter_report_files(directory):
+    """Yields the paths of the PMST report files in directory and its
+    subdirectories, in sorted order within each directory. Each directory
+    is listed and sorted in memory when it is reached, so memory use grows
+    with the size of the directories being walked (a flat directory of
+    thousands of reports is held whole), not with the files below them.
+
+    Arguments:
+        directory {str} -- directory to search
+    """
+    with os.scandir(directory) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            yield from iter_report_files(entry.path)
+        elif entry.name.upper().endswith(('.HTML', '.PDF')):
+            yield entry.path
+
+
+def _batch_record(file, fetch=(), cache_path=None, tables=False,
+                  index_path=None):
+    """Creates the Report for one file and returns it as a dictionary. Runs
+    in the batch worker processes; any error is returned in the record
+    rather than raised, so one bad file doesn't stop the batch.
+    """
+    # Each worker already has a core, so PDF pages are read in the worker
+    kwargs = {'streaming': True, 'fetch': fetch, 'tables': tables,
+              'pdf_workers': 1}
+    if cache_path is not None:
+        kwargs['fetcher'] = _worker_fetcher(cache_path)
+    if index_path is not None:
+        kwargs['index'] = _worker_index(index_path)
+    try:
+        return Report(file, **kwargs).to_dict()
+    except Exception as error:
+        return {'file': file, 'error': f'{type(error).__name__}: {error}'}
+
+
+# Fetcher with a PageCache made by each batch worker process, by cache path
+_worker_fetchers = {}
+
+# Index opened by each batch worker process, by path
+_worker_indexes = {}
+
+
+def _worker_fetcher(cache_path):
+    """Returns a Fetcher using the PageCache at cache_path, made once per
+    process, so every report in a worker shares its SQLite connection and
+    HTTP session rather than opening new ones.
+    """
+    if cache_path not in _worker_fetchers:
+        _worker_fetchers[cache_path] = Fetcher(
+            cache=PageCache(path=cache_path))
+    return _worker_fetchers[cache_path]
+
+
+def _worker_index(path):
+    """Returns the SpratIndex at path, opened once per process.
+    """
+    if path not in _worker_indexes:
+        _worker_indexes[path] = SpratIndex(path)
+    return _worker_indexes[path]
+
+
+def run_batch(files, output, jobs=None, fetch=(), cache_path=None,
+              progress=None, progress_interval=1.0, tables=False,
+              index_path=None):
+    """Creates a Report for each file across a pool of processes and writes
+    one JSON record per report to output, in the order they finish. At most
+    two files per process are in flight at once, so memory use doesn't grow
+    with the number of files.
+
+    Arguments:
+        files {iterable} -- paths of the report files
+        output {file} -- text file the JSON lines are written to
+        jobs {int} -- Keyword argument, number of worker processes
+        (default: {os.cpu_count()})
+        fetch {iterable} -- Keyword argument, kinds of protected matter to
+        fetch for each report, see Report._MATTER_DICT (default: {()})
+        cache_path {str} -- Keyword argument, path of a PageCache file shared
+        by the workers (default: {None})
+        progress {file} -- Keyword argument, text file progress and
+        throughput are written to (default: {None})
+        progress_interval {float} -- Keyword argument, seconds between
+        progress lines (default: {1.0})
+        tables {bool} -- Keyword argument, read the biota, TEC and KEF lists
+        from each report's tables instead of fetching them (default: {False})
+        index_path {str} -- Keyword argument, path of a SpratIndex the
+        workers resolve species and communities from (default: {None})
+
+    Returns:
+        tuple -- number of reports written and number that failed
+    """
+    jobs = jobs or os.cpu_count() or 1
+    fetch = tuple(fetch)
+    files = iter(files)
+    done = failed = 0
+    start = last_progress = time.perf_counter()
+
+    def report_progress(final=False):
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed else 0.0
+        print(
+            f"{'done' if final else 'processed'} {done} reports, "
+            f"{failed} failed, {elapsed:.1f}s, {rate:.1f} reports/s",
+            file=progress,
+            )
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs) as executor:
+        pending = set()
+        while True:
+            for file in files:
+                pending.add(executor.submit(
+                    _batch_record, file, fetch, cache_path, tables,
+                    index_path))
+                if len(pending) >= jobs * 2:
+                    break
+            if not pending:
+                break
+
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                output.write(json.dumps(record) + '\n')
+                done += 1
+                if 'error' in record:
+                    failed += 1
+
+            now = time.perf_counter()
+            if progress is not None and now - last_progress >= \
+                    progress_interval:
+                report_progress()
+                last_progress = now
+
+    if progress is not None:
+        report_progress(final=True)
+    return done, failed
+
+
+def _fetch_index_entries(urls, fetcher, parser, now):
+    """Fetches and reads the species or community page for each item of
+    urls, a dictionary of (kind, key) to URL. Returns a list of IndexEntry
+    fetched at now, and a dictionary of URL to error for the pages that
+    couldn't be fetched or read.
+    """
+    matter_classes = {'biota': Biota, 'tec': Tec}
+    items = list(urls.items())
+
+    def make_entry(item):
+        (kind, key), url = item
+        try:
+            record = matter_classes[kind](
+                url=url, fetcher=fetcher, parser=parser,
+                ).record()
+        except Exception as error:
+            instruments.count('matter_failures')
+            return error
+        return IndexEntry(kind, key, now, record)
+
+    entries, failed = [], {}
+    for (_, url), result in zip(items, fetcher.map(make_entry, items)):
+        if isinstance(result, Exception):
+            failed[url] = f'{type(result).__name__}: {result}'
+        else:
+            entries.append(result)
+    return entries, failed
+
+
+def _read_index_entries(path):
+    """Returns the entries of the index at path, or an empty list if there
+    isn't one or it can't be read (e.g. it was written in an older format).
+    """
+    if not os.path.exists(path):
+        return []
+    try:
+        index = SpratIndex(path)
+    except ValueError as error:
+        log.warning('Rebuilding index: %s', error)
+        return []
+    try:
+        return list(index)
+    finally:
+        index.close()
+
+
+def build_index(path, files, fetcher=None, parser=ProtectedMatter.parser,
+                now=None):
+    """Adds the species and communities linked from PMST reports to the
+    SpratIndex at path, creating it if needed. Only pages that aren't in the
+    index already are fetched; see refresh_index() to update old entries.
+
+    Arguments:
+        path {str} -- path of the index file
+        files {iterable} -- paths of the PMST report files
+        fetcher {Fetcher} -- Keyword argument, Fetcher used to get the pages.
+        Defaults to the Fetcher shared by all ProtectedMatter objects
+        parser {str} -- Keyword argument, how the pages are parsed, one of
+        ProtectedMatter.PARSERS (default: {"soup"})
+        now {float} -- Keyword argument, time saved as when new entries were
+        fetched (default: {time.time()})
+
+    Returns:
+        tuple -- number of entries added and a dictionary of URL to error
+        for the pages that couldn't be fetched
+    """
+    fetcher = ProtectedMatter.fetcher if fetcher is None else fetcher
+    now = time.time() if now is None else now
+    entries = _read_index_entries(path)
+    known = {(entry.kind, entry.key) for entry in entries}
+
+    urls = {}
+    for file in files:
+        report = Report(file, streaming=True, fetcher=fetcher)
+        for kind in SpratIndex.KINDS:
+            for key, url in (report.url_buckets or {}).get(kind, {}).items():
+                if isinstance(key, int) and (kind, key) not in known:
+                    urls.setdefault((kind, key), url)
+
+    added, failed = _fetch_index_entries(urls, fetcher, parser, now)
+    SpratIndex.write(path, entries + added, now=now)
+    return len(added), failed
+
+
+def refresh_index(path, max_age, fetcher=None, parser=ProtectedMatter.parser,
+                  now=None):
+    """Fetches the pages again for the entries of the SpratIndex at path
+    that were fetched more than max_age seconds ago, and rewrites the index.
+    Entries whose page can't be fetched keep their old record.
+
+    Arguments:
+        path {str} -- path of the index file
+        max_age {float} -- age in seconds above which entries are refreshed
+        fetcher {Fetcher} -- Keyword argument, Fetcher used to get the pages.
+        Defaults to the Fetcher shared by all ProtectedMatter objects
+        parser {str} -- Keyword argument, how the pages are parsed, one of
+        ProtectedMatter.PARSERS (default: {"soup"})
+        now {float} -- Keyword argument, the current time
+        (default: {time.time()})
+
+    Returns:
+        tuple -- number of entries refreshed and a dictionary of URL to
+        error for the pages that couldn't be fetched
+    """
+    fetcher = ProtectedMatter.fetcher if fetcher is None else fetcher
+    now = time.time() if now is None else now
+    index = SpratIndex(path)
+    try:
+        entries = list(index)
+    finally:
+        index.close()
+
+    urls = {
+        (entry.kind, entry.key): entry.record.url for entry in entries
+        if entry.fetched < now - max_age and entry.record.url
+        }
+    refreshed, failed = _fetch_index_entries(urls, fetcher, parser, now)
+    SpratIndex.write(path, entries + refreshed, now=now)
+    return len(refreshed), failed
+
+
+def _percentiles(values):
+    """Returns the count, 50th, 90th and 99th percentiles (nearest rank)
+    and maximum of values, in milliseconds from seconds.
+    """
+    values = sorted(values)
+    summary = {'count': len(values)}
+    for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        if values:
+            rank = max(1, math.ceil(len(values) * fraction))
+            summary[name] = values[rank - 1] * 1000
+        else:
+            summary[name] = None
+    summary['max'] = values[-1] * 1000 if values else None
+    return summary
+
+
+class ReportService():
+    """Creates Reports for a long-running process, such as the server
+    started by python -m pmst serve, so the cost of starting Python,
+    importing pmst and opening connections is paid once. Every report
+    shares one Fetcher (its pooled HTTP session and PageCache), an optional
+    SnapshotCache and a RecordCache, so pages, snapshots and protected
+    matter records stay warm between requests.
+
+    Reports are created on a bounded pool of worker threads. At most
+    max_workers reports are created at once and max_queue more wait for a
+    worker; submitting beyond that raises queue.Full rather than letting
+    the backlog grow. Latency and time spent waiting for a worker are kept
+    for the last LATENCY_WINDOW reports, see stats().
+    """
+
+    LATENCY_WINDOW = 1000
+
+    def __init__(self, max_workers=4, max_queue=64, fetcher=None,
+                 snapshots=None, records=None, root=None, **report_kwargs):
+        """Initialise class instance.
+
+        Arguments:
+            max_workers {int} -- Keyword argument, number of reports created
+            at the same time (default: {4})
+            max_queue {int} -- Keyword argument, number of reports that can
+            wait for a worker (default: {64})
+            fetcher {Fetcher} -- Keyword argument, Fetcher shared by every
+            report. Defaults to a new Fetcher, closed with the service
+            snapshots {SnapshotCache} -- Keyword argument, cache of report
+            state shared by every report (default: {None})
+            records {RecordCache} -- Keyword argument, cache of protected
+            matter records shared by every report. Defaults to a new
+            RecordCache
+            root {str} -- Keyword argument, directory report paths must be
+            inside, see check_path(). Any path is allowed if None
+            (default: {None})
+            report_kwargs -- Keyword arguments passed to every Report, e.g.
+            tables or parser. Reports are read in streaming mode with their
+            PDF pages read in the worker thread unless these say otherwise
+
+        Raises:
+            ValueError: Exception generated if max_workers is less than 1 or
+            max_queue is negative
+        """
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+        if max_queue < 0:
+            raise ValueError('max_queue must not be negative')
+
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._own_fetcher = fetcher is None
+        self.fetcher = Fetcher() if fetcher is None else fetcher
+        self.snapshots = snapshots
+        self.records = RecordCache() if records is None else records
+        self.root = os.path.realpath(root) if root is not None else None
+        self.report_kwargs = {'streaming': True, 'pdf_workers': 1}
+        self.report_kwargs.update(report_kwargs)
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.started = time.monotonic()
+        self._latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self._waits = deque(maxlen=self.LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='pmst-report',
+            )
+
+    def check_path(self, path):
+        """Returns the real path of a report file named in a request.
+
+        Raises:
+            PermissionError: Exception generated if the service has a root
+            and path isn't inside it
+            FileNotFoundError: Exception generated if there is no such file
+        """
+        real_path = os.path.realpath(path)
+        if self.root is not None and \
+                os.path.commonpath([self.root, real_path]) != self.root:
+            raise PermissionError(f'{path} is outside the service root')
+        if not os.path.isfile(real_path):
+            raise FileNotFoundError(f'no report file {path}')
+        return real_path
+
+    def submit(self, file, name=None, **kwargs):
+        """Queues a report to be created and returns a Future of its
+        dictionary (see Report.to_dict()).
+
+        Arguments:
+            file {str} -- HTML or PDF file containing PMST data
+            name {str} -- Keyword argument, name given as the file in the
+            result, e.g. the name of an uploaded file (default: {file})
+            kwargs -- Keyword arguments passed to the Report, over the
+            service's report_kwargs
+
+        Raises:
+            queue.Full: Exception generated if max_workers reports are being
+            created and max_queue more are waiting
+        """
+        with self._lock:
+            if self.queued + self.running >= \
+                    self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise queue.Full(
+                    f'{self.queued} reports already waiting for a worker')
+            self.queued += 1
+        try:
+            return self._executor.submit(
+                self._run, time.perf_counter(), file, name, kwargs)
+        except Exception:
+            with self._lock:
+                self.queued -= 1
+            raise
+
+    def process(self, file, name=None, **kwargs):
+        """Creates a report and returns its dictionary once it is done. See
+        submit().
+        """
+        return self.submit(file, name=name, **kwargs).result()
+
+    def _run(self, submitted, file, name, kwargs):
+        start = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._waits.append(start - submitted)
+        try:
+            result = self._make_report(file, **kwargs).to_dict()
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self._latencies.append(time.perf_counter() - submitted)
+        with self._lock:
+            self.completed += 1
+        if name is not None:
+            result['file'] = name
+        return result
+
+    def _make_report(self, file, **kwargs):
+        report_kwargs = dict(self.report_kwargs, **kwargs)
+        return Report(
+            file, fetcher=self.fetcher, snapshots=self.snapshots,
+            records=self.records, **report_kwargs,
+            )
+
+    def stats(self):
+        """Returns the service's counts as a dictionary of JSON serialisable
+        values: the number of reports waiting for a worker (queue_depth)
+        and being created (in_flight), reports completed, failed and
+        rejected, percentiles of the latency (from submit to result) and of
+        the time spent waiting for a worker in milliseconds, and the counts
+        of the shared Fetcher and caches.
+        """
+        with self._lock:
+            stats = {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'queue_depth': self.queued,
+                'in_flight': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'uptime': time.monotonic() - self.started,
+                'latency_ms': _percentiles(self._latencies),
+                'queue_wait_ms': _percentiles(self._waits),
+            }
+        stats['fetcher'] = self.fetcher.stats.as_dict()
+        stats['records'] = self.records.as_dict()
+        stats['snapshot_bytes'] = \
+            self.snapshots.size() if self.snapshots is not None else None
+        return stats
+
+    def close(self):
+        """Waits for the queued reports, then closes the Fetcher if the
+        service created it.
+        """
+        self._executor.shutdown(wait=True)
+        if self._own_fetcher:
+            self.fetcher.close()
+
+
+# Extension given to an uploaded report, by Content-Type
+_UPLOAD_SUFFIXES = {
+    'text/html': '.html',
+    'application/pdf': '.pdf',
+}
+
+# HTTP status returned for each error raised while handling a request
+_ERROR_STATUSES = (
+    (queue.Full, 503),
+    (PermissionError, 403),
+    (FileNotFoundError, 404),
+    (ValueError, 400),
+)
+
+
+def make_server(service, host='127.0.0.1', port=8765,
+                max_upload=64 * 2**20):
+    """Returns an HTTP server that creates reports with service, handling
+    each connection in its own thread. Call serve_forever() on it to start
+    it. The endpoints are:
+
+    POST /reports -- with a PMST report as the body (Content-Type text/html
+    or application/pdf, or a name query parameter ending in .html or .pdf)
+    or a JSON body {"path": file}, naming a file inside the service's root.
+    fetch (comma separated, or a JSON list) and tables query parameters or
+    JSON fields are passed to the Report. Returns the report's dictionary.
+    GET /stats -- returns ReportService.stats().
+
+    Errors are returned as {"error": message}, with status 400 for a bad
+    request, 403 for a path outside the root, 404 for a missing file or
+    endpoint, 413 for an upload over max_upload bytes, 503 when the
+    service's queue is full and 500 if the report can't be read.
+
+    Arguments:
+        service {ReportService} -- service that creates the reports
+        host {str} -- Keyword argument, address to listen on
+        (default: {"127.0.0.1"})
+        port {int} -- Keyword argument, port to listen on, 0 for any free
+        port (default: {8765})
+        max_upload {int} -- Keyword argument, largest report accepted in a
+        request body in bytes (default: {64 MB})
+    """
+    # Only needed by the server, so not imported with pmst
+    import http.server
+    import tempfile
+
+    class ReportHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # _send() writes the JSON body after the headers, which would
+        # otherwise wait for the client to acknowledge them
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            log.debug('%s %s', self.address_string(), format % args)
 
-    def set_marine(self):
-        for status in self.epbc_status_list:
-            if 'Listed marine' in status.__str__():
-                self.marine = True
+        def do_GET(self):
+            path = urllib.parse.urlsplit(self.path).path
+            if path == '/stats':
+                self._send(200, service.stats())
             else:
-                self.marine = False
+                self._send_error(404, f'no endpoint {path}')
 
-    def set_cetacean(self):
-        for status in self.epbc_status_list:
-            if 'Cetacean' in status.__str__():
-                self.cetacean = True
+        def do_POST(self):
+            parts = urllib.parse.urlsplit(self.path)
+            if parts.path != '/reports':
+                self._send_error(404, f'no endpoint {parts.path}')
+                return
+            length = self.headers.get('Content-Length')
+            if length is None:
+                self._send_error(411, 'request has no Content-Length')
+                return
+            # int() would also take signs and underscores
+            if not re.fullmatch(r'\s*[0-9]+\s*', length):
+                self._send_error(400, f'Content-Length {length!r} is not a '
+                                      'number of bytes')
+                return
+            length = int(length)
+            if length > max_upload:
+                self._send_error(
+                    413, f'report is larger than {max_upload} bytes')
+                return
+
+            body = self.rfile.read(length)
+            try:
+                result = self._report(body, urllib.parse.parse_qs(parts.query))
+            except Exception as error:
+                for error_type, status in _ERROR_STATUSES:
+                    if isinstance(error, error_type):
+                        break
+                else:
+                    status = 500
+                    log.exception('Unable to create report')
+                self._send(status, {'error': f'{type(error).__name__}: '
+                                             f'{error}'})
             else:
-                self.cetacean = False
+                self._send(200, result)
 
-    def set_cat(self):
-        for category in self.THREATENED_LIST:
-            regex = re.compile(category)
-            if self._soup.find("strong", text=regex):
-                self.category = category
+        def _report(self, body, options):
+            content_type = self.headers.get_content_type()
+            if content_type == 'application/json':
+                request = json.loads(body)
+                if not isinstance(request, dict) or \
+                        not isinstance(request.get('path'), str):
+                    raise ValueError('JSON body must have a path')
+                kwargs = {
+                    name: request[name] for name in ('fetch', 'tables')
+                    if name in request
+                    }
+                return service.process(
+                    service.check_path(request['path']), **kwargs)
+
+            kwargs = {}
+            if 'fetch' in options:
+                kwargs['fetch'] = [
+                    kind for value in options['fetch']
+                    for kind in value.split(',') if kind
+                    ]
+            if 'tables' in options:
+                kwargs['tables'] = options['tables'][-1].lower() in (
+                    '1', 'true', 'yes')
+            name = options.get('name', [None])[-1]
+            suffix = _UPLOAD_SUFFIXES.get(content_type)
+            if suffix is None and name is not None:
+                suffix = os.path.splitext(name)[1].lower()
+            if suffix not in _UPLOAD_SUFFIXES.values():
+                raise ValueError(
+                    'upload must be text/html or application/pdf, or be '
+                    'named with a .html or .pdf extension')
+            if not body:
+                raise ValueError('request has no report')
+
+            with tempfile.NamedTemporaryFile(
+                    suffix=suffix, delete=False) as upload:
+                upload.write(body)
+            try:
+                return service.process(
+                    upload.name, name=name or 'upload' + suffix, **kwargs)
+            finally:
+                os.remove(upload.name)
+
+        def _send_error(self, status, message):
+            # The body hasn't been read, so the connection can't be reused
+            self.close_connection = True
+            self._send(status, {'error': message})
+
+        def _send(self, status, value):
+            body = json.dumps(value).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if self.close_connection:
+                self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer((host, port), ReportHandler)
+    server.daemon_threads = True
+    return server
+
+
+def _batch_command(args):
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        done, failed = run_batch(
+            iter_report_files(args.directory),
+            output,
+            jobs=args.jobs,
+            fetch=args.fetch,
+            cache_path=args.cache,
+            progress=sys.stderr,
+            tables=args.tables,
+            index_path=args.index,
+            )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
+
+
+def _index_fetcher(args):
+    return Fetcher(cache=PageCache(path=args.cache) if args.cache else None)
+
+
+def _index_build_command(args):
+    files = []
+    for source in args.sources:
+        if os.path.isdir(source):
+            files.extend(iter_report_files(source))
+        else:
+            files.append(source)
+    fetcher = _index_fetcher(args)
+    try:
+        added, failed = build_index(
+            args.index, files, fetcher=fetcher, parser=args.parser)
+    finally:
+        fetcher.close()
+    print(f'added {added} entries from {len(files)} reports, '
+          f'{len(failed)} failed', file=sys.stderr)
+    for url, error in failed.items():
+        print(f'{url}: {error}', file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _index_refresh_command(args):
+    fetcher = _index_fetcher(args)
+    try:
+        refreshed, failed = refresh_index(
+            args.index, args.max_age * 24 * 3600, fetcher=fetcher,
+            parser=args.parser)
+    finally:
+        fetcher.close()
+    print(f'refreshed {refreshed} entries, {len(failed)} failed',
+          file=sys.stderr)
+    for url, error in failed.items():
+        print(f'{url}: {error}', file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _diff_command(args):
+    previous = Report(args.previous, streaming=True)
+    current = Report(args.current, streaming=True)
+    report_diff = current.diff(previous)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(report_diff.to_dict(), output, indent=2)
+        output.write('\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if report_diff.changed else 0
+
+
+def _serve_command(args):
+    service = ReportService(
+        max_workers=args.workers,
+        max_queue=args.max_queue,
+        fetcher=Fetcher(
+            cache=PageCache(path=args.cache) if args.cache else None),
+        snapshots=SnapshotCache(path=args.snapshots)
+        if args.snapshots else None,
+        root=args.root,
+        tables=args.tables,
+        parser=args.parser,
+        index=SpratIndex(args.index) if args.index else None,
+        )
+    server = make_server(service, host=args.host, port=args.port)
+    print('Serving PMST reports on http://{0}:{1}'.format(
+        *server.server_address[:2]), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        service.fetcher.close()
+    return 0
+
+
+def main(argv=None):
+    """Command line entry point, run with python -m pmst.
+    """
+    parser = argparse.ArgumentParser(
+        prog='pmst',
+        description='Extract data from PMST reports.',
+        )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch = subparsers.add_parser(
+        'batch',
+        help='parse a directory of PMST reports to JSON lines',
+        )
+    batch.add_argument(
+        'directory', help='directory of PMST html or PDF reports')
+    batch.add_argument(
+        '-o', '--output',
+        help='JSON lines file to write (default: standard output)',
+        )
+    batch.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: number of CPUs)',
+        )
+    batch.add_argument(
+        '--fetch', nargs='*', default=[],
+        choices=sorted(Report._MATTER_DICT),
+        help='protected matters to fetch from the web for each report',
+        )
+    batch.add_argument(
+        '--cache', default=None,
+        help='page cache file shared by the workers',
+        )
+    batch.add_argument(
+        '--tables', action='store_true',
+        help='read biota, TECs and KEFs from the report tables, without '
+             'fetching',
+        )
+    batch.add_argument(
+        '--index', default=None,
+        help='SPRAT index species and communities are read from first',
+        )
+    batch.set_defaults(func=_batch_command)
+
+    diff = subparsers.add_parser(
+        'diff',
+        help='compare two PMST reports for the same area as JSON, exits '
+             'with 1 if they differ',
+        )
+    diff.add_argument('previous', help='earlier PMST html or PDF report')
+    diff.add_argument('current', help='later PMST html or PDF report')
+    diff.add_argument(
+        '-o', '--output',
+        help='JSON file to write (default: standard output)',
+        )
+    diff.set_defaults(func=_diff_command)
+
+    serve = subparsers.add_parser(
+        'serve',
+        help='run a local HTTP service that returns PMST reports as JSON, '
+             'keeping connections and caches warm between requests',
+        )
+    serve.add_argument(
+        '--host', default='127.0.0.1',
+        help='address to listen on (default: 127.0.0.1)',
+        )
+    serve.add_argument(
+        '--port', type=int, default=8765,
+        help='port to listen on (default: 8765)',
+        )
+    serve.add_argument(
+        '-w', '--workers', type=int, default=4,
+        help='number of reports created at once (default: 4)',
+        )
+    serve.add_argument(
+        '--max-queue', type=int, default=64,
+        help='reports that can wait for a worker before requests are '
+             'refused with 503 (default: 64)',
+        )
+    serve.add_argument(
+        '--cache', default=None,
+        help='page cache file for fetched protected matter pages',
+        )
+    serve.add_argument(
+        '--snapshots', default=None,
+        help='snapshot cache file, so repeated reports are not parsed again',
+        )
+    serve.add_argument(
+        '--root', default=os.getcwd(),
+        help='directory report paths must be inside (default: current '
+             'directory)',
+        )
+    serve.add_argument(
+        '--tables', action='store_true',
+        help='read biota, TECs and KEFs from the report tables, without '
+             'fetching',
+        )
+    serve.add_argument(
+        '--parser', default=ProtectedMatter.parser,
+        choices=ProtectedMatter.PARSERS,
+        help='how protected matter pages are parsed (default: soup)',
+        )
+    serve.add_argument(
+        '--index', default=None,
+        help='SPRAT index species and communities are read from first',
+        )
+    serve.set_defaults(func=_serve_command)
+
+    index = subparsers.add_parser(
+        'index',
+        help='build or refresh the index of SPRAT species and communities',
+        )
+    index_commands = index.add_subparsers(dest='index_command', required=True)
+    index_build = index_commands.add_parser(
+        'build',
+        help='add the species and communities linked from PMST reports, '
+             'fetching only those not indexed yet',
+        )
+    index_build.add_argument('index', help='index file to create or update')
+    index_build.add_argument(
+        'sources', nargs='+',
+        help='PMST html or PDF reports, or directories of them',
+        )
+    index_build.set_defaults(func=_index_build_command)
+    index_refresh = index_commands.add_parser(
+        'refresh',
+        help='fetch the entries older than --max-age again',
+        )
+    index_refresh.add_argument('index', help='index file to update')
+    index_refresh.add_argument(
+        '--max-age', type=float, required=True,
+        help='age in days above which entries are fetched again',
+        )
+    index_refresh.set_defaults(func=_index_refresh_command)
+    for index_command in (index_build, index_refresh):
+        index_command.add_argument(
+            '--cache', default=None,
+            help='page cache file for the fetched pages',
+            )
+        index_command.add_argument(
+            '--parser', default=ProtectedMatter.parser,
+            choices=ProtectedMatter.PARSERS,
+            help='how the pages are parsed (default: soup)',
+            )
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,18 @@
 import pytest
 import pmst
 from bs4 import BeautifulSoup
+import json
 import os
+import subprocess
+import struct
+import sys
+import threading
+import time
+
+# Directory holding the .html files used by the tests
+HTML_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "html")
+# PMST report bundled with the repository
+PMST_HTML = os.path.join(os.path.dirname(HTML_DIR), os.pardir, "PMST.html")
 
 # Create Query object for testing
 qt = pmst.Query()
@@ -17,6 +28,47 @@ def test_query_set_coord_type():
     with pytest.raises(Exception):
         assert qt.set_coord_type(coord_type=42)
 
+def test_query_set_coord_list():
+    query = pmst.Query(geom_type=3, coord_type=1)
+    query.set_coord_list([[-32.1234567, 115.0], [-32.0, 117.0],
+                          [-31.0, 116.0], [-32.1234567, 115.0]])
+    assert isinstance(query.coord_list, pmst.CoordArray)
+    assert query.coord_list.tolist()[0] == [-32.12346, 115.0]
+    assert len(query.coord_list) == 4
+
+def test_query_set_coord_list_rejects():
+    query = pmst.Query(geom_type=3, coord_type=1)
+    with pytest.raises(ValueError, match="out of range"):
+        query.set_coord_list([[-32.0, 115.0], [-32.0, 64.0], [-4.0, 116.0]])
+    with pytest.raises(ValueError, match="at most 150"):
+        query.set_coord_list([[-32.0, 115.0 + i / 1000] for i in range(151)])
+    with pytest.raises(ValueError, match="Polygon"):
+        query.set_coord_list([[-32.0, 115.0], [-32.0, 117.0],
+                              [-32.0, 115.0]])
+    point = pmst.Query(geom_type=1, coord_type=1)
+    with pytest.raises(ValueError, match="Point"):
+        point.set_coord_list([[-32.0, 115.0], [-32.0, 117.0]])
+    point.set_coord_list([-32.0, 115.0])
+    assert point.coord_list.tolist() == [[-32.0, 115.0]]
+
+def test_query_set_coord_list_dms():
+    query = pmst.Query(geom_type=1, coord_type=2)
+    query.set_coord_list([[[-32, 30, 0], [115, 51, 36]]])
+    assert query.coord_list.tolist() == [[-32.5, 115.86]]
+
+def test_coord_array_dms_round_trip():
+    coords = pmst.CoordArray([[-32.12345, 115.98765], [-5.5, 179.99999]])
+    dms = coords.to_dms()
+    assert dms[0].tolist() == [[-32, 7, 24.42], [115, 59, 15.54]]
+    assert pmst.CoordArray.from_dms(dms).rounded() == coords
+
+def test_coord_array_from_report_string():
+    coords = pmst.CoordArray.from_string("-32.0 115.0 -32.0 117.0 -31.0 116.0")
+    assert coords.tolist() == [[-32.0, 115.0], [-32.0, 117.0], [-31.0, 116.0]]
+    assert coords.out_of_range().tolist() == []
+    with pytest.raises(ValueError):
+        pmst.CoordArray.from_string("-32.0 115.0 -32.0")
+
 # test the get_tec() method selects the correct threatened categories
 
 # test set up - create test class that over-rides the _get_html() method to use the test html files
@@ -46,13 +98,24 @@ class TestTec(pmst.Tec):
         self._soup = BeautifulSoup(open(self.url), "lxml")
         print(r"Test Protected Matter added to object {0}".format(self.url))
 
-# set up code - create the test TECs
-tec_crit = TestTec(".\\tests\\html\\tec_crit_end.html")
-tec_end = TestTec(".\\tests\\html\\tec_end.html")
-tec_vul = TestTec(".\\tests\\html\\tec_vul.html")
+# set up code - create the test TECs once per test run, when first needed
+@pytest.fixture(scope="module")
+def tec_crit():
+    return TestTec(os.path.join(HTML_DIR, "tec_crit_end.html"))
+
+
+@pytest.fixture(scope="module")
+def tec_end():
+    return TestTec(os.path.join(HTML_DIR, "tec_end.html"))
+
+
+@pytest.fixture(scope="module")
+def tec_vul():
+    return TestTec(os.path.join(HTML_DIR, "tec_vul.html"))
+
 
 # TEC tests
-def test_tec_find_category_crit_end():
+def test_tec_find_category_crit_end(tec_crit):
     """Tests that a critically endangered TEC doesn't get classified as an
     endangered or vulnerable TEC. Uses .html file in .\\tests\\html
     """
@@ -63,7 +126,7 @@ def test_tec_find_category_crit_end():
         assert tec_crit.category == 'Vulnerable'
 
 
-def test_tec_find_category_end():
+def test_tec_find_category_end(tec_end):
     """Tests that an endangered TEC doesn't get classified as an critically
     endangered or vulnerable TEC. Uses .html file in .\\tests\\html
     """
@@ -74,7 +137,7 @@ def test_tec_find_category_end():
         assert tec_end.category == 'Vulnerable'
 
 
-def test_tec_find_category_vul():
+def test_tec_find_category_vul(tec_vul):
     """Tests that a vulnerable TEC doesn't get classified as a critically
     endangered or vulnerable TEC. Uses .html file in .\\tests\\html
     """
@@ -87,8 +150,1578 @@ def test_tec_find_category_vul():
 def test_tec_cat_list():
     assert type(pmst.Tec.TEC_CAT_LIST) is list, "TEC_CAT_LIST type is not list"
 
-def test_tec_get_name():
+def test_tec_get_name(tec_crit, tec_end, tec_vul):
     assert tec_crit.name == 'Thrombolite (microbialite) Community of a Coastal Brackish Lake (Lake Clifton)'
     assert tec_end.name == 'Aquatic Root Mat Community 1 in Caves of the Leeuwin Naturaliste Ridge'
     assert tec_vul.name == 'Subtropical and Temperate Coastal Saltmarsh'
-    
+
+
+# Fetcher tests
+def test_fetcher_max_workers_range():
+    with pytest.raises(ValueError):
+        pmst.Fetcher(max_workers=0)
+
+
+def test_fetcher_map_keeps_order():
+    """Results come back in input order even when later items finish
+    first.
+    """
+    fetcher = pmst.Fetcher(max_workers=4)
+
+    def slow_echo(item):
+        time.sleep(0.01 * (5 - item))
+        return item
+
+    assert fetcher.map(slow_echo, range(5)) == [0, 1, 2, 3, 4]
+
+
+def test_fetcher_map_limits_workers():
+    fetcher = pmst.Fetcher(max_workers=3)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def track(item):
+        with lock:
+            running.append(item)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(item)
+
+    fetcher.map(track, range(12))
+    assert max(peak) <= 3
+
+
+def test_report_make_matters_shares_fetcher():
+    """Protected matters created by a report use the report's fetcher, and
+    the report keeps their records.
+    """
+    class StubMatter():
+        def __init__(self, url, fetcher, parser):
+            self.url = url
+            self.fetcher = fetcher
+
+        def record(self):
+            return (self.url, self.fetcher)
+
+    report = pmst.Report.__new__(pmst.Report)
+    report.fetcher = pmst.Fetcher(max_workers=2)
+    urls = ["http://a", "http://b", "http://c"]
+    records = report._make_matters(StubMatter, urls)
+    assert [record[0] for record in records] == urls
+    assert all(record[1] is report.fetcher for record in records)
+
+
+# PageCache tests
+class FakeResponse():
+    """Stands in for requests.Response in fetcher tests.
+    """
+    def __init__(self, text="", status_code=200, headers=None):
+        self.text = text
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    @property
+    def content(self):
+        return self.text.encode("utf-8")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise pmst.requests.HTTPError(self.status_code)
+
+
+class FakeSession(pmst.Transport):
+    """Transport that returns queued FakeResponses and records the requests
+    made.
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.calls.append((url, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_normalize_url():
+    assert pmst.normalize_url(
+        "HTTP://www.Environment.gov.au:80/cgi-bin/ahdb/search.pl"
+        "?place_id=106007;mode=place_detail#top"
+        ) == ("http://www.environment.gov.au/cgi-bin/ahdb/search.pl"
+              "?mode=place_detail;place_id=106007")
+
+
+def test_page_cache_round_trip(tmp_path):
+    cache = pmst.PageCache(path=str(tmp_path / "pages.sqlite"))
+    cache.put("http://a/page?b=2&a=1", "<html>a</html>", etag='"x"')
+    page = cache.get("http://a/page?a=1&b=2")
+    assert page.text == "<html>a</html>"
+    assert page.etag == '"x"'
+    assert cache.is_fresh(page)
+    assert cache.get("http://a/other") is None
+
+
+def test_page_cache_evicts_least_recently_used(tmp_path):
+    cache = pmst.PageCache(path=str(tmp_path / "pages.sqlite"))
+    page_text = os.urandom(600).hex()
+    cache.put("http://a/1", page_text)
+    cache.max_bytes = cache.size() * 2
+    cache.put("http://a/2", page_text)
+    cache.get("http://a/1")
+    cache.put("http://a/3", page_text)
+    assert cache.get("http://a/2") is None
+    assert cache.get("http://a/1") is not None
+    assert cache.get("http://a/3") is not None
+
+
+def test_sqlite_caches_sum_sizes_only_when_over(tmp_path):
+    cache = pmst.SnapshotCache(path=str(tmp_path / "snapshots.sqlite"))
+    statements = []
+    cache._db.set_trace_callback(statements.append)
+    state = {"text": os.urandom(600).hex()}
+    cache.put("1", "1.html", state)
+    cache.put("1", "1.html", state)
+    size = cache._total
+    assert not any("SUM(size)" in statement for statement in statements)
+    assert size == cache.size()
+
+    cache.max_bytes = size * 2
+    cache.put("2", "2.html", state)
+    cache.get("1")
+    cache.put("3", "3.html", state)
+    assert cache.get("2") is None
+    assert cache.get("1") == cache.get("3") == state
+    assert cache._total == cache.size() == size * 2
+
+
+def test_snapshot_cache_round_trip(tmp_path):
+    cache = pmst.SnapshotCache(path=str(tmp_path / "snapshots.sqlite"))
+    assert cache.get("key") is None
+    cache.put("key", "report.html", {"coords": {1: [1.5, 2.0]}})
+    assert cache.get("key") == {"coords": {1: [1.5, 2.0]}}
+    assert cache.size() > 0
+    cache.clear()
+    assert cache.get("key") is None
+
+
+def test_snapshot_key_follows_file_and_version(tmp_path, monkeypatch):
+    file = tmp_path / "report.html"
+    file.write_text("<html></html>")
+    key = pmst.SnapshotCache.file_key(str(file))
+    assert key == pmst.SnapshotCache.file_key(str(file))
+    assert key != pmst.SnapshotCache.file_key(str(file), tables=True)
+    monkeypatch.setattr(pmst, "__version__", "0.0.0")
+    assert key != pmst.SnapshotCache.file_key(str(file))
+    monkeypatch.undo()
+    file.write_text("<html> </html>")
+    assert key != pmst.SnapshotCache.file_key(str(file))
+
+
+def test_report_snapshot(tmp_path, monkeypatch):
+    cache = pmst.SnapshotCache(path=str(tmp_path / "snapshots.sqlite"))
+    transport = CountingTransport()
+    report = pmst.Report(PMST_HTML, snapshots=cache, transport=transport)
+    report.prefetch(kinds=["heritage"])
+
+    def no_parse(*args):
+        raise AssertionError("report parsed again")
+    monkeypatch.setattr(pmst.Report, "_make_soup", no_parse)
+    monkeypatch.setattr(pmst.Report, "_stream_header", no_parse)
+
+    loaded = pmst.Report(PMST_HTML, snapshots=cache, transport=transport)
+    assert loaded.to_dict() == report.to_dict()
+    assert loaded.url_buckets == report.url_buckets
+    assert loaded.heritage_list == report.heritage_list
+    assert isinstance(loaded.heritage_list[0], pmst.HeritageRecord)
+    assert not loaded.is_fetched("biota")
+    assert len(transport.urls) == len(report.heritage_list)
+
+
+def test_fetcher_uses_fresh_cache(tmp_path):
+    cache = pmst.PageCache(path=str(tmp_path / "pages.sqlite"))
+    cache.put("http://a/1", "cached")
+    fetcher = pmst.Fetcher(cache=cache, transport=FakeSession())
+    assert fetcher.get("http://a/1") == "cached"
+    assert fetcher.transport.calls == []
+
+
+def test_fetcher_revalidates_stale_page(tmp_path):
+    cache = pmst.PageCache(path=str(tmp_path / "pages.sqlite"), ttl=0)
+    cache.put("http://a/1", "cached", etag='"v1"')
+    fetcher = pmst.Fetcher(
+        cache=cache, transport=FakeSession(FakeResponse(status_code=304)))
+    assert fetcher.get("http://a/1") == "cached"
+    assert fetcher.transport.calls[0][1] == {"If-None-Match": '"v1"'}
+
+
+# Report header tests
+def make_header_report(file=PMST_HTML):
+    """Creates a Report with its header read from file, without fetching
+    any protected matters.
+    """
+    report = pmst.Report.__new__(pmst.Report)
+    report.tables = False
+    report._make_soup(file)
+    report._get_header()
+    return report
+
+
+def test_report_header():
+    report = make_header_report()
+    assert report.buffer == 1.0
+    assert report.date == pmst.datetime.datetime(2019, 5, 27)
+    assert report._coord_dict[1] == [-32.0, 115.0]
+    assert len(report._coord_dict) == 4
+    assert report.coords.tolist() == [
+        [-32.0, 115.0], [-32.0, 117.0], [-31.0, 116.0], [-32.0, 115.0]]
+    assert report.email is None
+
+
+def test_report_header_urls_unique_and_sorted():
+    report = make_header_report()
+    assert report.url_list == sorted(set(report.url_list))
+    assert "https://environment.gov.au/sprat-public/action/kef/view/25" in \
+        report.url_list
+
+
+def test_header_scanner_keeps_first_match():
+    scanner = pmst._HeaderScanner()
+    scanner.feed("span", "Buffer: 1.0Km")
+    scanner.feed("span", "Buffer: 5.0Km")
+    scanner.feed("span", "Sent to someone@example.com.au")
+    scanner.feed("a", None, href="http://a")
+    scanner.feed("a", None, href="http://a")
+    assert scanner.buffer_string == "Buffer: 1.0Km"
+    assert scanner.email == "someone@example.com.au"
+    assert scanner.urls == {"http://a"}
+
+
+# Streaming tests
+def test_stream_header_matches_soup():
+    soup_report = make_header_report()
+    stream_report = pmst.Report.__new__(pmst.Report)
+    stream_report.tables = False
+    stream_report._stream_header(PMST_HTML)
+    for attribute in ("buffer", "_coord_dict", "date", "email", "url_list"):
+        assert getattr(stream_report, attribute) == \
+            getattr(soup_report, attribute), attribute
+
+
+def test_element_string_matches_bs4():
+    html = "<p><span>a</span><span><b>b</b></span><span>c<b>d</b></span></p>"
+    element = pmst.etree.fromstring(html)
+    soup = BeautifulSoup(html, "lxml")
+    assert [pmst._element_string(span) for span in element] == \
+        [span.string for span in soup.find_all("span")]
+
+
+def fixture_fetcher(file_name):
+    """Creates a Fetcher that answers its next request with the contents of
+    a file in tests/html.
+    """
+    with open(os.path.join(HTML_DIR, file_name)) as html:
+        text = html.read()
+    return pmst.Fetcher(transport=FakeSession(FakeResponse(text=text)))
+
+
+# Parser tests
+@pytest.mark.parametrize("file_name, matter_class", [
+    (file_name, matter_class)
+    for file_name in sorted(os.listdir(HTML_DIR))
+    for prefix, matter_class in (
+        ("biota_", pmst.Biota), ("tec_", pmst.Tec), ("KEF", pmst.Kef))
+    if file_name.startswith(prefix)
+    ])
+@pytest.mark.parametrize("parser", ["strainer", "xpath"])
+def test_parser_matches_full_parse(file_name, matter_class, parser):
+    url = "http://fixtures/{0}?taxon_id=1".format(file_name)
+    fetcher = pmst.Fetcher(transport=pmst.ReplayTransport(HTML_DIR))
+    assert matter_class(url=url, fetcher=fetcher, parser=parser).record() == \
+        matter_class(url=url, fetcher=fetcher).record()
+
+
+def test_parser_checked():
+    with pytest.raises(ValueError):
+        pmst.Report(PMST_HTML, parser="regex")
+    with pytest.raises(ValueError):
+        pmst.Tec(url="http://fixtures/tec_end.html", parser="regex",
+                 fetcher=pmst.Fetcher(
+                     transport=pmst.ReplayTransport(HTML_DIR)))
+
+
+def test_report_strained_header_matches_full_parse():
+    full_report = make_header_report()
+    strained_report = pmst.Report(PMST_HTML, parser="xpath")
+    assert len(strained_report._soup.find_all("table")) == 0
+    for attribute in ("buffer", "_coord_dict", "date", "email", "url_list"):
+        assert getattr(strained_report, attribute) == \
+            getattr(full_report, attribute), attribute
+
+
+def test_report_passes_parser_to_matters():
+    report = pmst.Report(
+        PMST_HTML, parser="xpath",
+        transport=pmst.ReplayTransport(HTML_DIR, mapping={
+            url: os.path.join(HTML_DIR, "tec_end.html")
+            for url in make_header_report()._matter_urls("tec")
+            }),
+        )
+    assert report.tec_list
+    assert not report.failed_urls
+
+
+# Batch tests
+def test_report_fetch_kind_checked():
+    with pytest.raises(ValueError):
+        pmst.Report(PMST_HTML, fetch=["parks"])
+
+
+def test_iter_report_files(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ("b.html", "a.HTML", "notes.txt", "sub/c.html"):
+        (tmp_path / name).write_text("<html></html>")
+    assert [os.path.relpath(file, tmp_path) for file in
+            pmst.iter_report_files(str(tmp_path))] == \
+        ["a.HTML", "b.html", os.path.join("sub", "c.html")]
+
+
+def test_run_batch_writes_json_lines(tmp_path):
+    import io
+    import json
+    output = io.StringIO()
+    progress = io.StringIO()
+    files = [PMST_HTML, str(tmp_path / "missing.html")]
+    done, failed = pmst.run_batch(files, output, jobs=2, progress=progress)
+    records = {record["file"]: record for record in
+               map(json.loads, output.getvalue().splitlines())}
+    assert (done, failed) == (2, 1)
+    assert records[PMST_HTML]["buffer"] == 1.0
+    assert records[PMST_HTML]["date"] == "2019-05-27T00:00:00"
+    assert "error" in records[str(tmp_path / "missing.html")]
+    assert "reports/s" in progress.getvalue()
+
+
+def test_batch_worker_reuses_fetcher(tmp_path, monkeypatch):
+    fetchers = []
+
+    class CapturingReport(pmst.Report):
+        def __init__(self, file, **kwargs):
+            fetchers.append(kwargs["fetcher"])
+            super().__init__(file, **kwargs)
+
+    monkeypatch.setattr(pmst, "Report", CapturingReport)
+    monkeypatch.setattr(pmst, "_worker_fetchers", {})
+    cache_path = str(tmp_path / "pages.sqlite")
+    for _ in range(2):
+        record = pmst._batch_record(PMST_HTML, cache_path=cache_path)
+        assert record["buffer"] == 1.0
+    assert fetchers[0] is fetchers[1]
+    assert fetchers[0].cache.path == cache_path
+
+
+# Record tests
+def test_biota_record():
+    biota = pmst.Biota(
+        url="http://www.environment.gov.au/cgi-bin/sprat/public/"
+            "publicspecies.pl?taxon_id=36",
+        fetcher=fixture_fetcher("biota_end.html"),
+        )
+    record = biota.record()
+    assert record == pmst.BiotaRecord(
+        36,
+        "Balaenoptera musculus \u2014 Blue Whale",
+        "Balaenoptera musculus",
+        biota.category,
+        biota.migratory,
+        biota.marine,
+        biota.cetacean,
+        biota.url,
+        )
+    assert not hasattr(record, "__dict__")
+    with pytest.raises(AttributeError):
+        record.category = "Vulnerable"
+
+
+def test_tec_record(tec_vul):
+    assert tec_vul.record() == pmst.TecRecord(
+        "Subtropical and Temperate Coastal Saltmarsh",
+        "Vulnerable",
+        tec_vul.url,
+        )
+
+
+# Status classification tests
+@pytest.mark.parametrize("file_name, expected", [
+    ("biota_cons_dep.html", ("Conservation Dependent", False, False, False)),
+    ("biota_crit_end.html", ("Critically Endangered", False, False, False)),
+    ("biota_end.html", ("Endangered", True, False, True)),
+    ("biota_exinct_in_wild.html", ("Extinct in the Wild", False, False, False)),
+    ("biota_extinct.html", ("Extinct", False, False, False)),
+    ("biota_vul.html", ("Vulnerable", False, False, False)),
+])
+def test_biota_status(file_name, expected):
+    """Checks category, migratory, marine and cetacean for each biota page
+    in .\\tests\\html
+    """
+    biota = pmst.Biota(
+        url="http://www.environment.gov.au/cgi-bin/sprat/public/"
+            "publicspecies.pl?taxon_id=1",
+        fetcher=fixture_fetcher(file_name),
+        )
+    assert (biota.category, biota.migratory, biota.marine,
+            biota.cetacean) == expected
+
+
+def test_status_classifier_precedence():
+    classifier = pmst.StatusClassifier(pmst.Biota.THREATENED_LIST)
+    assert classifier.classify(
+        "Listed as Critically Endangered").category == "Critically Endangered"
+    assert classifier.classify(
+        "Listed as Extinct in the\n  wild").category == "Extinct in the Wild"
+    assert classifier.classify(
+        "Listed marine Listed migratory") == pmst.ListingStatus(
+            None, True, True, False)
+    assert classifier.classify("Not listed") == pmst.ListingStatus(
+        None, False, False, False)
+
+
+# Transport tests
+def test_replay_transport_serves_directory():
+    fetcher = pmst.Fetcher(transport=pmst.ReplayTransport(HTML_DIR))
+    tec = pmst.Tec("http://fixtures/tec_vul.html?id=1", fetcher=fetcher)
+    assert tec.category == "Vulnerable"
+    with pytest.raises(pmst.requests.HTTPError):
+        fetcher.get("http://fixtures/missing.html")
+
+
+def test_replay_transport_mapping():
+    url = ("http://www.environment.gov.au/cgi-bin/sprat/public/"
+           "publicspecies.pl?taxon_id=36")
+    transport = pmst.ReplayTransport(
+        HTML_DIR, mapping={url: "biota_end.html"})
+    biota = pmst.Biota(url=url, fetcher=pmst.Fetcher(transport=transport))
+    assert biota.sprat_id == 36
+    assert biota.category == "Endangered"
+
+
+def test_record_then_replay(tmp_path):
+    archive = str(tmp_path / "archive")
+    url = "http://www.environment.gov.au/page.pl?b=2&a=1"
+    recorder = pmst.RecordTransport(archive, transport=FakeSession(
+        FakeResponse(text="<title>Saved</title>", headers={"ETag": '"1"'})))
+    assert pmst.Fetcher(transport=recorder).get(url) == \
+        "<title>Saved</title>"
+
+    replay = pmst.ReplayTransport(archive)
+    response = replay.get("http://www.environment.gov.au/page.pl?a=1&b=2")
+    assert response.text == "<title>Saved</title>"
+    assert response.headers == {"ETag": '"1"'}
+
+
+# Retry and rate limit tests
+def test_fetcher_retries_throttled_request():
+    fetcher = pmst.Fetcher(backoff=0, transport=FakeSession(
+        FakeResponse(status_code=503),
+        pmst.requests.ConnectionError("reset"),
+        FakeResponse(text="ok"),
+        ))
+    assert fetcher.get("http://a/1") == "ok"
+    assert fetcher.stats.requests == 3
+    assert fetcher.stats.retries == 2
+    assert fetcher.stats.throttled == 1
+    assert fetcher.window.limit < fetcher.max_workers
+
+
+def test_fetcher_counts_bytes():
+    fetcher = pmst.Fetcher(transport=FakeSession(
+        FakeResponse(text="Balaenoptera musculus \u2014 Blue Whale")))
+    fetcher.get("http://a/1")
+    assert fetcher.stats.bytes == 36
+
+    replay = pmst.Fetcher(transport=pmst.ReplayTransport(HTML_DIR))
+    replay.get("http://fixtures/biota_end.html")
+    assert replay.stats.bytes == os.path.getsize(
+        os.path.join(HTML_DIR, "biota_end.html"))
+
+
+def test_fetcher_gives_up_after_retries():
+    fetcher = pmst.Fetcher(backoff=0, retries=1, transport=FakeSession(
+        FakeResponse(status_code=500), FakeResponse(status_code=500)))
+    with pytest.raises(pmst.requests.HTTPError):
+        fetcher.get("http://a/1")
+    assert fetcher.stats.failures == 1
+
+
+def test_fetcher_uses_retry_after():
+    fetcher = pmst.Fetcher()
+    response = FakeResponse(status_code=429, headers={"Retry-After": "7"})
+    assert fetcher._retry_delay(0, response) == 7.0
+    assert 0.25 <= fetcher._retry_delay(0, None) <= 0.75
+
+
+def test_adaptive_window_backs_off_and_recovers():
+    window = pmst.AdaptiveWindow(8, latency_target=1.0)
+    window.acquire()
+    window.release(0.1, throttled=True)
+    assert window.limit == 4
+    for _ in range(20):
+        window.acquire()
+        window.release(0.1)
+    assert 4 < window.limit <= 8
+
+
+def test_token_bucket_limits_rate():
+    bucket = pmst.TokenBucket(rate=100)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.045
+
+
+def test_report_make_matters_keeps_going_after_failure():
+    fetcher = pmst.Fetcher(
+        retries=0, transport=pmst.ReplayTransport(HTML_DIR))
+    report = pmst.Report.__new__(pmst.Report)
+    report.fetcher = fetcher
+    report.failed_urls = {}
+    urls = ["http://fixtures/tec_end.html", "http://fixtures/missing.html",
+            "http://fixtures/tec_vul.html"]
+    records = report._make_matters(pmst.Tec, urls)
+    assert [record.category for record in records] == \
+        ["Endangered", "Vulnerable"]
+    assert list(report.failed_urls) == ["http://fixtures/missing.html"]
+
+
+# Lazy protected matter tests
+class CountingTransport(pmst.Transport):
+    """Transport that answers every request with a small page and counts
+    the requests.
+    """
+    def __init__(self):
+        self.urls = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, timeout=None):
+        with self.lock:
+            self.urls.append(url)
+        return pmst.TransportResponse(
+            url, 200, "<html><title>Place</title></html>")
+
+
+def test_report_fetches_nothing_until_used():
+    transport = CountingTransport()
+    report = pmst.Report(PMST_HTML, transport=transport)
+    assert transport.urls == []
+    assert not report.is_fetched("heritage")
+    assert report.to_dict()["heritage"] is None
+
+    heritage_list = report.heritage_list
+    assert len(heritage_list) == len(transport.urls) > 0
+    assert report.is_fetched("heritage")
+    assert report.heritage_list is heritage_list
+    assert len(transport.urls) == len(heritage_list)
+
+
+def test_report_prefetch():
+    transport = CountingTransport()
+    report = pmst.Report(PMST_HTML, transport=transport)
+    report.prefetch(kinds=["heritage", "tec"])
+    assert report.is_fetched("heritage") and report.is_fetched("tec")
+    assert not report.is_fetched("biota")
+    fetched = len(transport.urls)
+    report.prefetch(kinds=["heritage"])
+    assert len(transport.urls) == fetched
+    with pytest.raises(ValueError):
+        report.prefetch(kinds=["parks"])
+
+
+# URL router tests
+def test_url_router_routes():
+    router = pmst.UrlRouter()
+    base = "http://www.environment.gov.au"
+    assert router.route(
+        base + "/cgi-bin/sprat/public/publicspecies.pl?taxon_id=855"
+        )[:2] == ("biota", 855)
+    assert router.route(
+        base + "/cgi-bin/sprat/public/publicshowcommunity.pl?id=12"
+        )[:2] == ("tec", 12)
+    assert router.route(
+        "https://environment.gov.au/sprat-public/action/kef/view/25"
+        )[:2] == ("kef", 25)
+    assert router.route(
+        base + ":80/cgi-bin/ahdb/search.pl?mode=place_detail;place_id=106007"
+        )[:2] == ("heritage", 106007)
+    assert router.route("#Matters of NES")[0] == "other"
+
+
+def test_url_router_deduplicates():
+    router = pmst.UrlRouter()
+    species = "http://www.environment.gov.au/cgi-bin/sprat/public/" \
+        "publicspecies.pl"
+    buckets = router.classify([
+        species + "?taxon_id=1&x=2",
+        species + "?x=2&taxon_id=1",
+        species.replace("www.", "WWW.") + "?taxon_id=1",
+        species + "?taxon_id=2",
+        ])
+    assert list(buckets["biota"]) == [1, 2]
+    assert buckets["biota"][1] == species + "?taxon_id=1&x=2"
+
+
+def test_report_url_buckets():
+    report = make_header_report()
+    assert len(report.url_buckets["kef"]) == 5
+    assert len(report.url_buckets["tec"]) == len(set(
+        url for url in report.url_list if "publicshowcommunity" in url))
+    assert report._matter_urls("kef")[0] == \
+        "https://environment.gov.au/sprat-public/action/kef/view/17"
+
+
+# Report table tests
+@pytest.fixture(scope="module")
+def table_report():
+    return pmst.Report(PMST_HTML, tables=True, transport=CountingTransport())
+
+
+def test_report_tables_make_no_requests(table_report):
+    assert all(table_report.is_fetched(kind)
+               for kind in ("biota", "tec", "kef"))
+    assert len(table_report.biota_list) == len(
+        table_report.url_buckets["biota"])
+    assert len(table_report.tec_list) == len(table_report.url_buckets["tec"])
+    assert len(table_report.kef_list) == len(table_report.url_buckets["kef"])
+    table_report.prefetch(kinds=["biota", "tec", "kef"])
+    assert table_report.fetcher.transport.urls == []
+
+
+def test_report_tables_match_sprat(table_report):
+    url = ("http://www.environment.gov.au/cgi-bin/sprat/public/"
+           "publicspecies.pl?taxon_id=36")
+    sprat = pmst.Biota(url=url, fetcher=fixture_fetcher("biota_end.html"))
+    record = next(
+        record for record in table_report.biota_list if record.sprat_id == 36)
+    assert record == sprat.record()._replace(
+        common_name="Blue Whale",
+        presence="Foraging, feeding or related behaviour known to occur "
+                 "within area",
+        )
+    assert record in table_report.migratory_list
+    assert record not in table_report.marine_list
+
+
+def test_report_tables_tec(table_report):
+    assert table_report.tec_list[-1] == pmst.TecRecord(
+        "Subtropical and Temperate Coastal Saltmarsh",
+        "Vulnerable",
+        "http://www.environment.gov.au/cgi-bin/sprat/public/"
+        "publicshowcommunity.pl?id=118",
+        "Community likely to occur within area",
+        )
+
+
+def test_report_tables_kef(table_report):
+    assert table_report.kef_list[0] == pmst.KefRecord(
+        "Ancient coastline at 90-120m depth", ("South-west",),
+        "https://environment.gov.au/sprat-public/action/kef/view/25")
+
+
+def test_report_tables_rows_split_over_pages(table_report):
+    # The type of presence of the Sooty Albatross is split by a page break,
+    # with the column headings in between
+    record = next(
+        record for record in table_report.biota_list
+        if record.sprat_id == 1075)
+    assert record.presence == "Species or species habitat may occur within area"
+    assert all(
+        record.presence.endswith("within area")
+        for record in table_report.biota_list + table_report.tec_list
+        )
+
+
+def test_report_tables_streaming(table_report):
+    report = pmst.Report(PMST_HTML, tables=True, streaming=True)
+    assert report.biota_list == table_report.biota_list
+    assert report.tec_list == table_report.tec_list
+    assert report.kef_list == table_report.kef_list
+
+
+# Report diff tests
+@pytest.fixture
+def moved_report_file(tmp_path):
+    """Copy of PMST.html with one heritage place swapped for another."""
+    with open(PMST_HTML) as html:
+        text = html.read()
+    assert "place_id=105619" in text
+    file = tmp_path / "PMST_rerun.html"
+    file.write_text(text.replace("place_id=105619", "place_id=999999"))
+    return str(file)
+
+
+def test_report_diff(moved_report_file):
+    previous = pmst.Report(PMST_HTML, streaming=True)
+    current = pmst.Report(moved_report_file, streaming=True)
+    report_diff = current.diff(previous)
+    heritage = report_diff.matters["heritage"]
+    assert [url[-6:] for url in heritage.added] == ["999999"]
+    assert [url[-6:] for url in heritage.removed] == ["105619"]
+    assert len(heritage.unchanged) == len(previous.url_buckets["heritage"]) - 1
+    assert report_diff.matters["biota"].added == ()
+    assert report_diff.changed and not report_diff.coords_changed
+
+    summary = json.loads(json.dumps(report_diff.to_dict()))
+    assert summary["matters"]["heritage"]["unchanged"] == len(
+        heritage.unchanged)
+    assert not previous.diff(previous).changed
+
+
+def test_report_diff_fetches_only_new_matters(moved_report_file):
+    transport = CountingTransport()
+    previous = pmst.Report(PMST_HTML, transport=transport, streaming=True)
+    previous_list = previous.heritage_list
+    transport.urls.clear()
+
+    current = pmst.Report(moved_report_file, transport=transport,
+                          streaming=True)
+    current.diff(previous, fetch=["heritage"])
+    assert [url[-6:] for url in transport.urls] == ["999999"]
+    assert current.is_fetched("heritage")
+    assert len(current.heritage_list) == len(previous_list)
+    reused = [record for record in current.heritage_list
+              if not record.url.endswith("999999")]
+    assert len(reused) == len(previous_list) - 1
+    assert all(record in previous_list for record in reused)
+
+
+def test_diff_command(moved_report_file, tmp_path):
+    output = tmp_path / "diff.json"
+    assert pmst.main(
+        ["diff", PMST_HTML, moved_report_file, "-o", str(output)]) == 1
+    summary = json.loads(output.read_text())
+    assert summary["file"] == moved_report_file
+    assert len(summary["matters"]["heritage"]["added"]) == 1
+    assert pmst.main(["diff", PMST_HTML, PMST_HTML, "-o", str(output)]) == 0
+
+
+# Report store tests
+def test_report_store(tmp_path, table_report, moved_report_file):
+    store = pmst.ReportStore(path=str(tmp_path / "reports.sqlite"))
+    moved = pmst.Report(moved_report_file, streaming=True)
+    first_id, moved_id = store.add_many([table_report, moved])
+    assert store.files() == [PMST_HTML, moved_report_file]
+
+    # Both reports link to the species, only table_report has its record
+    assert store.reports_with_species(36) == [PMST_HTML, moved_report_file]
+    assert store.matter("biota", 36) == next(
+        record for record in table_report.biota_list
+        if record.sprat_id == 36)._replace(presence=None)
+    assert store.matter("tec", 118) == table_report.tec_list[-1]._replace(
+        presence=None)
+    assert store.matter("heritage", 105619) is None
+    assert store.reports_with("heritage", 999999) == [moved_report_file]
+    assert store.reports_with_category(
+        "tec", "Critically Endangered") == [PMST_HTML, moved_report_file]
+    assert store.reports_with_category("biota", "Extinct") == []
+
+
+def test_report_store_skips_matters_without_id(tmp_path, caplog):
+    no_id_url = ("http://www.environment.gov.au/cgi-bin/sprat/public/"
+                 "publicshowcommunity.pl")
+    species = pmst.BiotaRecord(
+        36, "Blue Whale", "Balaenoptera musculus", "Endangered", True,
+        True, True, SPECIES_URL.format(36))
+    report = stand_in_report([species], "no_id.html",
+                             coords=pmst.CoordArray([-32, 116]), buffer=1.0)
+    report.url_list.append(no_id_url)
+    report.url_buckets = pmst.UrlRouter().classify(report.url_list)
+    report.tec_list = [pmst.TecRecord("Woodland", "Vulnerable", no_id_url)]
+
+    store = pmst.ReportStore(path=str(tmp_path / "reports.sqlite"))
+    store.add(report)
+    assert store.matter("biota", 36) == species
+    assert store.reports_with_species(36) == ["no_id.html"]
+    assert store._db.execute(
+        "SELECT COUNT(*) FROM communities").fetchone()[0] == 0
+    assert "has no ID" in caplog.text
+
+
+def test_report_store_upserts(tmp_path, table_report):
+    store = pmst.ReportStore(path=str(tmp_path / "reports.sqlite"))
+    report_id = store.add(table_report)
+    links = store._db.execute(
+        "SELECT COUNT(*) FROM report_matters").fetchone()[0]
+    assert store.add(table_report) == report_id
+    assert store._db.execute(
+        "SELECT COUNT(*) FROM report_matters").fetchone()[0] == links
+    presence = store._db.execute(
+        "SELECT presence FROM report_matters "
+        "WHERE kind = 'biota' AND matter_id = 1075").fetchone()[0]
+    assert presence == "Species or species habitat may occur within area"
+
+    store.remove(PMST_HTML)
+    assert store.files() == []
+    assert store.reports_with_species(36) == []
+    assert store.matter("biota", 36) is not None
+
+
+# Footprint and spatial index tests
+TRIANGLE = [[-32.0, 115.0], [-32.0, 117.0], [-31.0, 116.0], [-32.0, 115.0]]
+
+
+def footprint(coords, buffer=0.0):
+    return pmst.Footprint(pmst.CoordArray(coords), buffer)
+
+
+def test_footprint_geometry_type():
+    assert footprint([[-32.0, 115.0]]).geom_type == 1
+    assert footprint(TRIANGLE[:3]).geom_type == 2
+    assert footprint(TRIANGLE).geom_type == 3
+
+
+def test_footprint_covers_and_overlaps():
+    triangle = footprint(TRIANGLE, buffer=1.0)
+    inside = footprint([[-31.8, 116.0]], buffer=1.0)
+    # About 0.55 km south of the triangle's southern edge
+    near = footprint([[-32.005, 116.0]])
+    # About 2.2 km south, with a 0.5 km buffer
+    beyond = footprint([[-32.02, 116.0]], buffer=0.5)
+    crossing = footprint([[-33.0, 116.0], [-31.5, 116.0]])
+
+    assert triangle.covers(inside) and triangle.overlaps(inside)
+    assert triangle.covers(near)
+    assert not inside.covers(triangle) and inside.overlaps(triangle)
+    assert not triangle.overlaps(beyond) and not beyond.overlaps(triangle)
+    assert not triangle.covers(crossing) and triangle.overlaps(crossing)
+
+
+def test_footprint_line_round_polygon_doesnt_cover_it():
+    square_ring = [[-31, 116], [-31, 117], [-30, 117], [-30, 116],
+                   [-31, 116]]
+    square = footprint(square_ring)
+    # A line along the square's edges, but not its closing edge
+    loop = pmst.Footprint(pmst.CoordArray(square_ring), buffer=1.0,
+                          geom_type=2)
+    centre = footprint([[-30.5, 116.5]])
+    assert not loop.covers(centre)
+    assert not loop.covers(square)
+    assert footprint(square_ring, buffer=1.0).covers(square)
+
+
+def test_report_store_footprints(tmp_path, table_report):
+    path = str(tmp_path / "reports.sqlite")
+    store = pmst.ReportStore(path=path)
+    store.add(table_report)
+
+    query = pmst.Query(geom_type=1, coord_type=1)
+    query.set_coord_list([-31.8, 116.0])
+    assert store.reports_covering(query) == [PMST_HTML]
+    assert store.reports_overlapping(query) == [PMST_HTML]
+
+    query = pmst.Query(geom_type=2, coord_type=1, buffer=0)
+    query.set_coord_list([[-33.0, 116.0], [-31.5, 116.0]])
+    assert store.reports_covering(query) == []
+    assert store.reports_overlapping(query) == [PMST_HTML]
+
+    query.set_coord_list([[-20.0, 130.0], [-20.0, 131.0]])
+    assert store.reports_overlapping(query) == []
+
+    # Reports stored before their footprint was indexed are indexed when
+    # the store is opened
+    with store._db:
+        store._db.execute("DELETE FROM footprints")
+    store.close()
+    store = pmst.ReportStore(path=path)
+    assert store.reports_overlapping(footprint(TRIANGLE)) == [PMST_HTML]
+    store.remove(PMST_HTML)
+    assert store.reports_overlapping(footprint(TRIANGLE)) == []
+
+
+# Instrumentation tests
+@pytest.fixture
+def stats():
+    sink = pmst.instruments.add_sink(pmst.StatsSink())
+    yield sink
+    pmst.instruments.remove_sink(sink)
+
+
+def test_instruments_disabled_by_default():
+    assert not pmst.instruments.enabled
+    assert pmst.instruments.timer("Report.soup") is pmst._NULL_TIMER
+
+
+def test_instruments_time_report_and_matters(stats, capsys):
+    pmst.Report(PMST_HTML)
+    pmst.Biota(
+        url="http://www.environment.gov.au/cgi-bin/sprat/public/"
+            "publicspecies.pl?taxon_id=36",
+        fetcher=fixture_fetcher("biota_end.html"),
+        )
+    result = stats.as_dict()
+    for stage in ("Report.read", "Report.soup", "Report.header",
+                  "Biota.fetch", "Biota.parse"):
+        assert result["timings"][stage]["count"] == 1, stage
+        assert result["timings"][stage]["total"] >= 0
+    assert result["counters"]["requests"] == 1
+    assert capsys.readouterr().out == ""
+
+
+def test_json_and_logging_sinks(tmp_path, caplog):
+    path = tmp_path / "metrics.jsonl"
+    json_sink = pmst.instruments.add_sink(pmst.JsonSink(str(path)))
+    logging_sink = pmst.instruments.add_sink(pmst.LoggingSink())
+    with caplog.at_level("DEBUG", logger="pmst"):
+        with pmst.instruments.timer("Test.stage"):
+            pass
+        pmst.instruments.count("cache_hits", 2)
+    pmst.instruments.remove_sink(json_sink)
+    pmst.instruments.remove_sink(logging_sink)
+    assert not pmst.instruments.enabled
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(line["type"], line["name"]) for line in lines] == [
+        ("timing", "Test.stage"), ("counter", "cache_hits")]
+    assert lines[1]["value"] == 2
+    assert "Test.stage took" in caplog.text
+
+
+# PDF report tests
+PMST_PDF = os.path.join(os.path.dirname(HTML_DIR), os.pardir, "PMST.pdf")
+
+
+@pytest.fixture(scope="module")
+def pdf_report():
+    return pmst.Report(PMST_PDF, pdf_workers=1)
+
+
+def test_pdf_report_matches_html(pdf_report, table_report):
+    for attribute in ("buffer", "coords", "date"):
+        assert getattr(pdf_report, attribute) == \
+            getattr(table_report, attribute), attribute
+    assert pdf_report.biota_list == table_report.biota_list
+    assert pdf_report.url_buckets["biota"] == \
+        table_report.url_buckets["biota"]
+    # Communities and KEFs are listed without an ID, so they have no URL
+    for kind in ("tec", "kef"):
+        assert [record._replace(url=None)
+                for record in getattr(pdf_report, kind + "_list")] == [
+            record._replace(url=None)
+            for record in getattr(table_report, kind + "_list")], kind
+
+
+def test_read_pdf_pages_short_pdf_in_one_process(monkeypatch):
+    pages = pmst.read_pdf_pages(PMST_PDF)
+    assert len(pages) == 30
+
+    def no_processes(*args, **kwargs):
+        raise AssertionError("started a process pool")
+
+    monkeypatch.setattr(pmst.os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(pmst.concurrent.futures, "ProcessPoolExecutor",
+                        no_processes)
+    assert pmst.read_pdf_pages(PMST_PDF, max_workers=8) == pages
+
+
+def test_pdf_report_places(pdf_report):
+    assert len(pdf_report.kef_list) == 5
+    assert pdf_report.kef_list[0] == pmst.KefRecord(
+        "Ancient coastline at 90-120m depth", ("South-west",), None)
+    assert [(record.name, record.category, record.type)
+            for record in pdf_report.heritage_list[:2]] == [
+        ("Goldfields Water Supply Scheme, Western Australia", "Historic",
+         "National heritage place"),
+        ("Bindoon Defence Training Area", "Natural",
+         "Commonwealth heritage place"),
+        ]
+    assert all(pdf_report.is_fetched(kind)
+               for kind in pmst.Report._MATTER_DICT)
+
+
+def test_report_reuses_pdf_report(pdf_report):
+    transport = CountingTransport()
+    report = pmst.Report(PMST_HTML, transport=transport, streaming=True)
+    report.diff(pdf_report, fetch=["tec", "biota"])
+    # The PDF's communities have no URL to match on, so they're fetched
+    assert sorted(transport.urls) == sorted(report.url_buckets["tec"].values())
+    assert report.is_fetched("tec")
+    assert sorted(report.biota_list) == sorted(pdf_report.biota_list)
+
+
+def test_read_pdf_pages_in_processes():
+    assert pmst.read_pdf_pages(PMST_PDF, max_workers=3) == \
+        pmst.read_pdf_pages(PMST_PDF, max_workers=1)
+
+
+def test_report_store_pdf(tmp_path, pdf_report):
+    store = pmst.ReportStore(path=str(tmp_path / "reports.sqlite"))
+    store.add(pdf_report)
+    assert store.reports_with_species(26000) == [PMST_PDF]
+    assert store.matter("biota", 26000).category == "Vulnerable"
+
+
+# Import tests
+def loaded_modules(code):
+    """Runs code in a new interpreter after importing pmst and returns which
+    of the slow to import dependencies it loaded.
+    """
+    script = (
+        "import sys, pmst\n" + code + "\n"
+        "print(' '.join(name for name in ('bs4', 'lxml', 'numpy', 'requests',"
+        " 'pypdf') if name in sys.modules))"
+        )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True,
+        check=True, cwd=os.path.join(os.path.dirname(HTML_DIR), os.pardir),
+        )
+    return result.stdout.split()
+
+
+def test_import_defers_dependencies():
+    assert loaded_modules("") == []
+    assert loaded_modules(
+        "query = pmst.Query(geom_type=1, coord_type=1)\n"
+        "query.set_coord_list([-31.8, 116.0])"
+        ) == ["numpy"]
+    assert loaded_modules(
+        "pmst.Report('PMST.html', streaming=True)") == ["lxml", "numpy"]
+
+
+def test_lazy_module_replaces_itself():
+    lazy = pmst._LazyModule("json", "_lazy_json")
+    assert lazy.dumps([1]) == "[1]"
+    assert pmst._lazy_json is json
+    del pmst._lazy_json
+
+
+# Report service tests
+def test_record_cache_evicts_least_recently_used():
+    records = pmst.RecordCache(max_entries=2)
+    records.put("http://example.com/a", "a")
+    records.put("http://example.com/b", "b")
+    assert records.get("HTTP://example.com/a") == "a"
+    records.put("http://example.com/c", "c")
+    assert records.get("http://example.com/b") is None
+    assert len(records) == 2
+    assert records.as_dict()["hits"] == 1
+    assert records.as_dict()["misses"] == 1
+    with pytest.raises(ValueError):
+        pmst.RecordCache(max_entries=0)
+
+
+def test_report_reuses_cached_records():
+    transport = CountingTransport()
+    records = pmst.RecordCache()
+    first = pmst.Report(PMST_HTML, transport=transport, records=records)
+    requests = len(first.heritage_list)
+    assert requests == len(transport.urls) > 0
+
+    second = pmst.Report(PMST_HTML, transport=transport, records=records)
+    assert second.heritage_list == first.heritage_list
+    assert len(transport.urls) == requests
+
+
+@pytest.fixture
+def service():
+    transport = CountingTransport()
+    service = pmst.ReportService(
+        max_workers=2,
+        fetcher=pmst.Fetcher(transport=transport),
+        root=os.path.dirname(PMST_HTML),
+        )
+    service.transport = transport
+    yield service
+    service.close()
+
+
+def test_service_keeps_records_warm(service):
+    first = service.process(PMST_HTML, fetch=["heritage"])
+    second = service.process(PMST_HTML, name="again.html",
+                             fetch=["heritage"])
+    assert second["file"] == "again.html"
+    assert second["heritage"] == first["heritage"]
+    assert len(service.transport.urls) == len(first["heritage"]) > 0
+
+    stats = service.stats()
+    assert stats["completed"] == 2
+    assert stats["queue_depth"] == stats["in_flight"] == 0
+    assert stats["latency_ms"]["count"] == 2
+    assert stats["latency_ms"]["p50"] <= stats["latency_ms"]["max"]
+    assert stats["records"]["hits"] == len(first["heritage"])
+
+
+def test_service_refuses_when_queue_full():
+    release = threading.Event()
+
+    class BlockedService(pmst.ReportService):
+        def _make_report(self, file, **kwargs):
+            release.wait(5)
+            return super()._make_report(file, **kwargs)
+
+    service = BlockedService(max_workers=1, max_queue=0)
+    try:
+        future = service.submit(PMST_HTML)
+        with pytest.raises(pmst.queue.Full):
+            service.submit(PMST_HTML)
+        assert service.stats()["rejected"] == 1
+        release.set()
+        assert future.result()["buffer"] == 1.0
+    finally:
+        release.set()
+        service.close()
+
+
+def test_service_percentiles():
+    summary = pmst._percentiles([i / 1000 for i in range(1, 101)])
+    assert summary["count"] == 100
+    assert summary["p50"] == pytest.approx(50)
+    assert summary["p99"] == pytest.approx(99)
+    assert summary["max"] == pytest.approx(100)
+    assert pmst._percentiles([])["p50"] is None
+
+
+@pytest.fixture
+def server_url(service):
+    server = pmst.make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{0}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def http_request(url, body=None, content_type=None):
+    """Returns the status and decoded JSON of a request to the server.
+    """
+    import urllib.error
+    import urllib.request
+
+    request = urllib.request.Request(url, data=body)
+    if content_type:
+        request.add_header("Content-Type", content_type)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_server_checks_content_length(server_url):
+    import http.client
+
+    def post(*headers):
+        connection = http.client.HTTPConnection(
+            server_url[len("http://"):], timeout=5)
+        connection.putrequest("POST", "/reports")
+        for header in headers:
+            connection.putheader(*header)
+        connection.endheaders()
+        with connection.getresponse() as response:
+            return (response.status, response.getheader("Connection"),
+                    json.load(response))
+
+    for length in ("abc", "-1", "+5"):
+        status, connection, body = post(("Content-Length", length))
+        assert (status, connection) == (400, "close"), length
+        assert "Content-Length" in body["error"]
+    assert post()[:2] == (411, "close")
+
+
+def test_server_upload_and_path(server_url):
+    with open(PMST_HTML, "rb") as file:
+        body = file.read()
+    status, uploaded = http_request(
+        server_url + "/reports?name=PMST.html", body, "text/html")
+    assert status == 200
+    assert uploaded["file"] == "PMST.html"
+    assert uploaded["buffer"] == 1.0
+
+    status, by_path = http_request(
+        server_url + "/reports",
+        json.dumps({"path": PMST_HTML, "fetch": ["heritage"]}).encode(),
+        "application/json")
+    assert status == 200
+    assert by_path["coords"] == uploaded["coords"]
+    assert len(by_path["heritage"]) > 0
+
+    status, stats = http_request(server_url + "/stats")
+    assert status == 200
+    assert stats["completed"] == 2
+
+
+def test_server_errors(server_url):
+    def post_path(path, **fields):
+        return http_request(
+            server_url + "/reports",
+            json.dumps(dict(path=path, **fields)).encode(),
+            "application/json")[0]
+
+    assert post_path("/x.html") == 403
+    assert post_path(os.path.join(os.path.dirname(PMST_HTML),
+                                  "missing.html")) == 404
+    assert post_path(PMST_HTML, fetch=["parks"]) == 400
+    assert http_request(server_url + "/reports", b"{", "application/json"
+                        )[0] == 400
+    assert http_request(server_url + "/reports", b"x", "text/plain")[0] == 400
+    assert http_request(server_url + "/nothing")[0] == 404
+
+
+# SPRAT index tests
+SPECIES_URL = ("http://www.environment.gov.au/cgi-bin/sprat/public/"
+               "publicspecies.pl?taxon_id={0}")
+COMMUNITY_URL = ("http://www.environment.gov.au/cgi-bin/sprat/public/"
+                 "publicshowcommunity.pl?id={0}")
+
+
+def test_sprat_index_round_trip(tmp_path):
+    path = str(tmp_path / "sprat.idx")
+    whale = pmst.BiotaRecord(36, "Blue Whale", "Balaenoptera musculus",
+                             "Endangered", True, False, None,
+                             SPECIES_URL.format(36))
+    plant = pmst.BiotaRecord(5, "Plant — é", "", None, False,
+                             False, False, SPECIES_URL.format(5))
+    tec = pmst.TecRecord("Woodland", "Vulnerable", COMMUNITY_URL.format(36))
+    assert pmst.SpratIndex.write(path, [
+        pmst.IndexEntry("biota", 36, 100.0, whale),
+        pmst.IndexEntry("tec", 36, 200.0, tec),
+        pmst.IndexEntry("biota", 5, 300.0, plant),
+        ]) == 3
+
+    index = pmst.SpratIndex(path)
+    assert len(index) == 3
+    assert index.library_version == pmst.__version__
+    assert index.get("biota", 36) == whale
+    assert index.get("biota", 5) == plant
+    assert index.get("tec", 36) == tec
+    assert index.get("biota", 7) is None
+    assert index.get("kef", 36) is None
+    assert index.record_for(SPECIES_URL.format(36) + "#top") == whale
+    assert index.record_for(COMMUNITY_URL.format(36)) == tec
+    assert index.record_for("http://example.com/") is None
+    assert index.entry("tec", 36).fetched == 200.0
+    assert [(entry.kind, entry.key) for entry in index] == [
+        ("biota", 5), ("biota", 36), ("tec", 36)]
+    index.close()
+    # Keys are little-endian whatever the host's byte order
+    with open(path, "rb") as file:
+        data = file.read()
+    assert struct.unpack_from("<3Q", data, pmst.SpratIndex._HEADER.size) == (
+        5, 36, 1 << 32 | 36)
+
+
+def test_sprat_index_checks_format(tmp_path):
+    path = str(tmp_path / "sprat.idx")
+    pmst.SpratIndex.write(path, [])
+    with open(path, "r+b") as file:
+        file.seek(8)
+        file.write(b"\x63\x00")
+    with pytest.raises(ValueError, match="format 99"):
+        pmst.SpratIndex(path)
+
+    with open(path, "wb") as file:
+        file.write(b"not an index at all, but long enough to read")
+    with pytest.raises(ValueError, match="not a PMST index"):
+        pmst.SpratIndex(path)
+
+
+class CountingReplay(pmst.ReplayTransport):
+    """ReplayTransport that counts the URLs it is asked for.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.urls = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.urls.append(url)
+        return super().get(url, headers=headers, timeout=timeout)
+
+
+@pytest.fixture
+def index_report(tmp_path):
+    """Writes a report linking to two species and a community, and returns
+    its path with a Fetcher replaying their pages from tests/html.
+    """
+    path = tmp_path / "links.html"
+    path.write_text(
+        "<html><body>"
+        '<a href="{0}">Blue Whale</a><a href="{1}">Species</a>'
+        '<a href="{2}">Community</a>'
+        "</body></html>".format(
+            SPECIES_URL.format(36), SPECIES_URL.format(37),
+            COMMUNITY_URL.format(9)))
+    transport = CountingReplay(HTML_DIR, mapping={
+        SPECIES_URL.format(36): "biota_end.html",
+        SPECIES_URL.format(37): "biota_vul.html",
+        COMMUNITY_URL.format(9): "tec_vul.html",
+        })
+    return str(path), pmst.Fetcher(transport=transport)
+
+
+def test_build_index_fetches_new_entries_only(tmp_path, index_report):
+    file, fetcher = index_report
+    path = str(tmp_path / "sprat.idx")
+    assert pmst.build_index(path, [file], fetcher=fetcher) == (3, {})
+    assert len(fetcher.transport.urls) == 3
+
+    index = pmst.SpratIndex(path)
+    assert index.get("biota", 36).category == "Endangered"
+    assert index.get("biota", 37).category == "Vulnerable"
+    assert index.get("tec", 9).category == "Vulnerable"
+    index.close()
+
+    assert pmst.build_index(path, [file], fetcher=fetcher) == (0, {})
+    assert len(fetcher.transport.urls) == 3
+
+
+def test_refresh_index_fetches_old_entries(tmp_path, index_report):
+    file, fetcher = index_report
+    path = str(tmp_path / "sprat.idx")
+    pmst.build_index(path, [file], fetcher=fetcher, now=1000.0)
+    index = pmst.SpratIndex(path)
+    entries = list(index)
+    index.close()
+    # Make one entry newer than the rest
+    pmst.SpratIndex.write(
+        path, entries[:1] + [entries[1]._replace(fetched=1900.0)] +
+        entries[2:])
+
+    fetcher.transport.urls.clear()
+    refreshed, failed = pmst.refresh_index(
+        path, max_age=500, fetcher=fetcher, now=2000.0)
+    assert (refreshed, failed) == (2, {})
+    assert sorted(fetcher.transport.urls) == sorted(
+        entry.record.url for entry in entries if entry != entries[1])
+
+    index = pmst.SpratIndex(path)
+    assert [entry.fetched for entry in index] == [2000.0, 1900.0, 2000.0]
+    assert [entry.record for entry in index] == [
+        entry.record for entry in entries]
+    index.close()
+
+
+def test_report_resolves_from_index(tmp_path, table_report):
+    path = str(tmp_path / "sprat.idx")
+    router = pmst.UrlRouter()
+    pmst.SpratIndex.write(path, [
+        pmst.IndexEntry(kind, router.route(record.url)[1], 0.0,
+                        record._replace(presence=None))
+        for kind in ("biota", "tec")
+        for record in getattr(table_report, kind + "_list")
+        ])
+    index = pmst.SpratIndex(path)
+
+    transport = CountingTransport()
+    report = pmst.Report(PMST_HTML, transport=transport, index=index,
+                         fetch=["biota", "tec"])
+    assert transport.urls == []
+    by_id = lambda record: record.sprat_id  # noqa: E731
+    assert sorted(report.biota_list, key=by_id) == sorted(
+        (record._replace(presence=None)
+         for record in table_report.biota_list), key=by_id)
+    assert len(report.tec_list) == len(table_report.tec_list)
+    index.close()
+
+
+# Query tiling tests
+def zigzag_line(count=1000):
+    """Returns a line of count vertices from Perth towards the north east,
+    zigzagging about 1 km either side of its course.
+    """
+    t = pmst.np.linspace(0, 1, count)
+    return pmst.np.column_stack([
+        -32 + 2 * t + 0.01 * (pmst.np.arange(count) % 2),
+        116 + 3 * t,
+        ])
+
+
+def star_polygon(count=1000):
+    """Returns a closed, star shaped ring of count vertices (plus the
+    closing vertex) about 100 km across.
+    """
+    angle = pmst.np.linspace(0, 2 * pmst.np.pi, count, endpoint=False)
+    radius = 0.5 * (1 + 0.3 * pmst.np.sin(angle * 17))
+    ring = pmst.np.column_stack([
+        -30 + radius * pmst.np.sin(angle),
+        130 + radius * pmst.np.cos(angle),
+        ])
+    return pmst.np.vstack([ring, ring[:1]])
+
+
+def test_query_tile_line():
+    query = pmst.Query(geom_type=2, coord_type=1, buffer=2)
+    line = zigzag_line()
+    tiles = query.tile(line)
+    assert len(tiles) == 7
+    assert all(len(tile.coord_list) <= 150 for tile in tiles)
+    assert all(tile.buffer == 2 and tile.geom_type == 2 for tile in tiles)
+    for first, second in zip(tiles, tiles[1:]):
+        assert first.coord_list.tolist()[-1] == second.coord_list.tolist()[0]
+    joined = pmst.np.vstack([tiles[0].coord_list.array] + [
+        tile.coord_list.array[1:] for tile in tiles[1:]])
+    assert pmst.np.array_equal(joined, pmst.np.round(line, 5))
+
+
+def test_query_tile_polygon():
+    query = pmst.Query(geom_type=3, coord_type=1)
+    ring = star_polygon()
+    tiles = query.tile(ring)
+    assert len(tiles) > 6
+    assert all(len(tile.coord_list) <= 150 and tile.coord_list.is_closed
+               for tile in tiles)
+    areas = [abs(pmst._ring_area(tile.coord_list.array[:-1]))
+             for tile in tiles]
+    assert sum(areas) == pytest.approx(abs(pmst._ring_area(ring[:-1])),
+                                       rel=1e-5)
+
+    points = pmst.np.random.default_rng(1).uniform(
+        [-30.7, 129.3], [-29.3, 130.7], size=(500, 2))
+    inside = pmst._points_in_polygon(points, ring)
+    in_tiles = pmst.np.zeros(len(points), dtype=bool)
+    for tile in tiles:
+        in_tiles |= pmst._points_in_polygon(points, tile.coord_list.array)
+    assert inside.any()
+    assert pmst.np.array_equal(inside, in_tiles)
+
+
+def test_query_tile_simplified():
+    query = pmst.Query(geom_type=2, coord_type=1, buffer=1)
+    line = zigzag_line()
+    tiles = query.tile(line, tolerance=1.5)
+    assert len(tiles) == 1
+    assert tiles[0].buffer == 2.5
+    original = pmst.Footprint(pmst.CoordArray(line), buffer=1, geom_type=2)
+    assert pmst.Footprint.from_query(tiles[0]).covers(original)
+
+
+def test_query_tile_small_geometries():
+    query = pmst.Query(geom_type=3, coord_type=1)
+    ring = [[-32, 116], [-32, 116.1], [-31.9, 116.1], [-32, 116]]
+    tiles = query.tile(ring, tolerance=1.0)
+    assert len(tiles) == 1
+    assert tiles[0].buffer == query.buffer
+    query.set_coord_list(ring)
+    assert tiles[0].coord_list == query.coord_list
+
+    point = pmst.Query(geom_type=1, coord_type=1)
+    assert len(point.tile([-32, 116])) == 1
+    with pytest.raises(ValueError):
+        point.tile(zigzag_line())
+    with pytest.raises(ValueError):
+        query.tile(star_polygon(), max_vertices=3)
+    with pytest.raises(ValueError):
+        query.tile(star_polygon() + [0, 100])
+
+
+class LocalSearch():
+    """Stands in for the PMST search tool: finds the species, each at a
+    point, that are inside a query's buffered footprint.
+    """
+    def __init__(self, species):
+        self.species = species
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def found(self, footprint):
+        return [
+            record for point, record in self.species
+            if footprint.overlaps(pmst.Footprint(pmst.CoordArray(point)))
+            ]
+
+    def __call__(self, query):
+        assert len(query.coord_list) <= pmst.CoordArray.MAX_VERTICES
+        with self.lock:
+            self.queries.append(query)
+            number = len(self.queries)
+        records = self.found(pmst.Footprint.from_query(query))
+        return stand_in_report(records, "tile{0}.html".format(number),
+                               coords=query.coord_list, buffer=query.buffer)
+
+
+def stand_in_report(records, file, **attributes):
+    """Returns a Report listing records as its biota, with no KEFs,
+    heritage places or TECs fetched.
+    """
+    report = pmst.Report.merge([], **attributes)
+    report.file = file
+    report.coords = attributes.get("coords")
+    report.buffer = attributes.get("buffer")
+    report.url_list = sorted(record.url for record in records)
+    report.url_buckets = pmst.UrlRouter().classify(report.url_list)
+    report.biota_list = records
+    return report
+
+
+@pytest.mark.parametrize("geom_type, coords, buffer", [
+    (2, zigzag_line(), 1.0),
+    (3, star_polygon(), 0.5),
+])
+def test_search_tiled_matches_single_search(geom_type, coords, buffer):
+    rng = pmst.np.random.default_rng(2)
+    low, high = coords.min(axis=0) - 0.05, coords.max(axis=0) + 0.05
+    points = rng.uniform(low, high, size=(150, 2)).tolist()
+    # Species on the vertices shared by neighbouring tiles
+    points += coords[::149].tolist()
+    species = [
+        (point, pmst.BiotaRecord(
+            sprat_id, "Species {0}".format(sprat_id), "", "Vulnerable",
+            False, False, False, SPECIES_URL.format(sprat_id),
+            "Species or species habitat known to occur within area"))
+        for sprat_id, point in enumerate(points, 1)
+    ]
+    search = LocalSearch(species)
+    query = pmst.Query(geom_type=geom_type, coord_type=1, buffer=buffer)
+
+    report = query.search_tiled(coords, search)
+    assert len(search.queries) > 1
+    assert report.tiles == ["tile{0}.html".format(number) for number in
+                            range(1, len(search.queries) + 1)]
+    assert report.coords == pmst.CoordArray(coords).rounded()
+    assert report.buffer == buffer
+
+    whole = search.found(pmst.Footprint(
+        pmst.CoordArray(coords), buffer=buffer, geom_type=geom_type))
+    sprat_ids = [record.sprat_id for record in report.biota_list]
+    assert len(sprat_ids) == len(set(sprat_ids))
+    assert sorted(sprat_ids) == sorted(record.sprat_id for record in whole)
+    assert 0 < len(sprat_ids) < len(species)
+    assert set(report.url_buckets["biota"]) == set(sprat_ids)
+
+
+def test_report_merge_keeps_most_certain_presence():
+    may = pmst.BiotaRecord(
+        1, "Species 1", "", "Endangered", False, False, False,
+        SPECIES_URL.format(1),
+        "Species or species habitat may occur within area")
+    known = may._replace(
+        presence="Species or species habitat known to occur within area")
+    other = may._replace(sprat_id=2, url=SPECIES_URL.format(2))
+    first = stand_in_report([may, other], "a.html", buffer=1.0)
+    second = stand_in_report([known], "b.html", buffer=2.0)
+    second.failed_urls = {"http://example.com/": "HTTPError: 500"}
+
+    merged = pmst.Report.merge([first, second])
+    assert merged.biota_list == [known, other]
+    assert merged.tiles == ["a.html", "b.html"]
+    assert merged.buffer == 2.0
+    assert merged.url_list == [SPECIES_URL.format(1), SPECIES_URL.format(2)]
+    assert merged.failed_urls == second.failed_urls
+    assert not merged.is_fetched("kef")
+    assert merged.to_dict()["biota"][0]["presence"] == known.presence
+
+
+def test_report_merge_keys_records_without_url():
+    species = pmst.BiotaRecord(
+        1, "Species 1", "Genus one", "Endangered", False, False, False, None)
+    other = species._replace(sprat_id=2, scientific_name="Genus two")
+    community = pmst.TecRecord("Community", "Endangered", None)
+    first = stand_in_report([], "a.html")
+    first.biota_list = [species, other]
+    first.tec_list = [community]
+    second = stand_in_report([], "b.html")
+    second.biota_list = [species]
+    second.tec_list = [community]
+
+    merged = pmst.Report.merge([first, second])
+    assert merged.biota_list == [species, other]
+    assert merged.tec_list == [community]